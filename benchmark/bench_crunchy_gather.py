@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# pylint: disable=consider-using-with
+# pylint: disable=C0209
+"""
+Benchmark harness for crunchy_gather.py
+
+Description:
+    Runs crunchy_gather.py end to end against a simulated cluster served
+    by fake_kube_cli.py, installed as kubectl and oc on PATH, so that the
+    collection can be timed without a kubernetes cluster. Each run reports
+    the wall time, the per-collector time from run_report.json, the peak
+    RSS of the script, the number of kube cli processes it spawned and
+    how many of them were in flight at once.
+
+    A run's results can be saved with --json and later given to --compare
+    to fail (exit code 1) when the wall time or the peak RSS regressed by
+    more than --tolerance.
+
+Example:
+    ./benchmark/bench_crunchy_gather.py --pods 10 --log-size 4M --runs 3
+    ./benchmark/bench_crunchy_gather.py --json base.json
+    ./benchmark/bench_crunchy_gather.py --compare base.json -- -j 8
+
+Arguments:
+    --pods: number of simulated Postgres pods
+    --containers: comma separated containers of each Postgres pod
+    --log-size: bytes of log per container, accepts K/M/G suffixes
+    --latency: seconds each kube cli call takes before answering
+    --pg-log-files: number of pg log files in each Postgres pod
+    --pg-log-size: bytes of each pg log file, accepts K/M/G suffixes
+    --exec-hang: seconds patronictl hangs in the pods, 0 to not hang
+    --operator: also run the operator pod in the namespace
+    --runs: number of runs to report the median of
+    --json: file to save the results to
+    --compare: results file of a baseline to compare against
+    --tolerance: allowed regression over the baseline, in percent
+    after --: arguments passed on to crunchy_gather.py
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(os.path.dirname(BENCH_DIR), "crunchy_gather.py")
+FAKE_CLI = os.path.join(BENCH_DIR, "fake_kube_cli.py")
+NAMESPACE = "bench"
+SAMPLE_INTERVAL = 0.05  # seconds between RSS samples
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3}
+
+PG_LOG_LINE = ("2024-01-01 00:00:00.000 UTC [1234] LOG:  checkpoint "
+               "complete: wrote 42 buffers (0.3%); 0 WAL file(s) added\n")
+
+
+def parse_size(value):
+    """
+        Returns the bytes of a size such as 512K or 4M
+    """
+    value = value.strip().upper().rstrip("B")
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ""
+    try:
+        return int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(
+            "invalid size: {}".format(value)) from error
+
+
+def make_cluster(work_dir, args):
+    """
+        Writes the simulated cluster: fake kube cli wrappers, a hanging
+        patronictl, pg log files and the fake configuration
+        Returns the environment to run crunchy_gather.py with
+    """
+    bin_dir = os.path.join(work_dir, "bin")
+    os.makedirs(bin_dir)
+    for name in ("kubectl", "oc"):
+        write_script(os.path.join(bin_dir, name),
+                     "#!/bin/sh\nexec {} {} \"$@\"\n".format(
+                         sys.executable, FAKE_CLI))
+    write_script(os.path.join(bin_dir, "patronictl"),
+                 "#!/bin/sh\nsleep {}\necho \"+ Cluster: hippo-ha +\"\n"
+                 .format(args.exec_hang))
+
+    log_dir = os.path.join(work_dir, "pod", "pgdata", "pg16", "pglogs")
+    os.makedirs(log_dir)
+    line = PG_LOG_LINE.encode('utf-8')
+    for index in range(args.pg_log_files):
+        path = os.path.join(log_dir, "postgresql-{:02d}.log".format(index))
+        with open(path, "wb") as file_pointer:
+            for _ in range(args.pg_log_size // len(line)):
+                file_pointer.write(line)
+        # newest last, as ls -t orders them
+        os.utime(path, (time.time() - 3600 + index, time.time() - 3600 + index))
+
+    config = {
+        "namespace": NAMESPACE,
+        "pods": args.pods,
+        "operator": args.operator,
+        "containers": args.containers.split(","),
+        "log_size": args.log_size,
+        "latency": args.latency,
+        "root": os.path.join(work_dir, "pod"),
+    }
+    config_path = os.path.join(work_dir, "cluster.json")
+    with open(config_path, "w", encoding="utf-8") as file_pointer:
+        json.dump(config, file_pointer)
+
+    env = dict(os.environ)
+    env["PATH"] = bin_dir + os.pathsep + env.get("PATH", "")
+    env["FAKE_KUBE_CONFIG"] = config_path
+    env["FAKE_KUBE_CALLS"] = os.path.join(work_dir, "calls.log")
+    return env
+
+
+def write_script(path, content):
+    """
+        Writes an executable script
+    """
+    with open(path, "w", encoding="utf-8") as file_pointer:
+        file_pointer.write(content)
+    os.chmod(path, 0o755)
+
+
+def sample_rss(pid, peak, done):
+    """
+        Samples the resident set size of pid into peak["rss"] until done
+    """
+    path = "/proc/{}/status".format(pid)
+    while not done.is_set():
+        try:
+            with open(path, encoding="utf-8") as file_pointer:
+                for line in file_pointer:
+                    if line.startswith("VmRSS:"):
+                        peak["rss"] = max(peak["rss"], int(line.split()[1]) * 1024)
+                        break
+        except (OSError, ValueError):
+            break
+        done.wait(SAMPLE_INTERVAL)
+
+
+def read_calls(path):
+    """
+        Returns the number of kube cli calls logged, the calls per verb
+        and the most calls that were in flight at the same time
+    """
+    events = []
+    verbs = {}
+    if not os.path.exists(path):
+        return 0, verbs, 0
+    with open(path, encoding="utf-8") as file_pointer:
+        for line in file_pointer:
+            started, ended, verb = line.split(" ", 2)
+            verb = verb.strip()
+            verbs[verb] = verbs.get(verb, 0) + 1
+            events.append((float(started), 1))
+            events.append((float(ended), -1))
+    in_flight = peak = 0
+    for _, delta in sorted(events):
+        in_flight += delta
+        peak = max(peak, in_flight)
+    return sum(verbs.values()), verbs, peak
+
+
+def read_run_report(output_dir):
+    """
+        Returns the run_report.json written by crunchy_gather.py, from the
+        archive or the collection directory it left in output_dir
+    """
+    for name in sorted(os.listdir(output_dir)):
+        path = os.path.join(output_dir, name)
+        if os.path.isdir(path):
+            report = os.path.join(path, "run_report.json")
+            if os.path.exists(report):
+                with open(report, encoding="utf-8") as file_pointer:
+                    return json.load(file_pointer)
+        elif name.endswith(".tar.gz"):
+            with tarfile.open(path) as tar:
+                for member in tar:
+                    if member.name.endswith("/run_report.json"):
+                        return json.load(tar.extractfile(member))
+    return None
+
+
+def archive_size(output_dir):
+    """
+        Returns the size of the archive written in output_dir
+    """
+    return sum(os.path.getsize(os.path.join(output_dir, name))
+               for name in os.listdir(output_dir)
+               if name.endswith((".tar.gz", ".tar.zst")))
+
+
+def run_once(work_dir, env, gather_args):
+    """
+        Runs crunchy_gather.py once
+        Returns a dict of the measurements of the run
+    """
+    output_dir = os.path.join(work_dir, "out")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    if os.path.exists(env["FAKE_KUBE_CALLS"]):
+        os.remove(env["FAKE_KUBE_CALLS"])
+    cmd = [sys.executable, SCRIPT, "-n", NAMESPACE, "-o", output_dir,
+           "-c", "kubectl"] + gather_args
+    peak = {"rss": 0}
+    done = threading.Event()
+    started = time.monotonic()
+    with open(os.path.join(work_dir, "gather.log"), "wb") as log:
+        handle = subprocess.Popen(cmd, env=env, stdout=log, stderr=log)
+        sampler = threading.Thread(target=sample_rss,
+                                   args=(handle.pid, peak, done))
+        sampler.start()
+        return_code = handle.wait()
+        done.set()
+        sampler.join()
+    wall = time.monotonic() - started
+
+    calls, verbs, concurrency = read_calls(env["FAKE_KUBE_CALLS"])
+    result = {
+        "return_code": return_code,
+        "wall_seconds": round(wall, 3),
+        "peak_rss_bytes": peak["rss"],
+        "processes": calls,
+        "processes_by_verb": verbs,
+        "peak_concurrency": concurrency,
+        "archive_bytes": archive_size(output_dir),
+        "phases": {},
+    }
+    report = read_run_report(output_dir)
+    if report is not None:
+        result["phases"] = {
+            collector["collector"]: collector["seconds"]
+            for collector in report.get("collectors", [])}
+    return result
+
+
+def median_result(results):
+    """
+        Returns the run with the median wall time, with the spread of
+        the wall times of all runs
+    """
+    ordered = sorted(results, key=lambda result: result["wall_seconds"])
+    result = dict(ordered[len(ordered) // 2])
+    walls = [run["wall_seconds"] for run in results]
+    result["runs"] = len(results)
+    result["wall_seconds_min"] = min(walls)
+    result["wall_seconds_max"] = max(walls)
+    result["wall_seconds_stdev"] = round(
+        statistics.pstdev(walls), 3) if len(walls) > 1 else 0.0
+    return result
+
+
+def print_result(result, baseline=None):
+    """
+        Prints the measurements of a run, next to the baseline if any
+    """
+    def row(label, key, fmt="{}"):
+        value = fmt.format(result[key])
+        if baseline is not None and key in baseline:
+            value += "  (baseline {})".format(fmt.format(baseline[key]))
+        print("  {:<20}{}".format(label, value))
+
+    print("crunchy_gather.py benchmark, median of {} run(s):".format(result["runs"]))
+    row("exit code", "return_code")
+    row("wall time", "wall_seconds", "{:.3f}s")
+    print("  {:<20}{:.3f}s .. {:.3f}s".format(
+        "wall time range", result["wall_seconds_min"], result["wall_seconds_max"]))
+    row("peak RSS", "peak_rss_bytes", "{:,} B")
+    row("kube cli processes", "processes")
+    row("peak concurrency", "peak_concurrency")
+    row("archive size", "archive_bytes", "{:,} B")
+    print("  per verb: " + ", ".join(
+        "{} {}".format(verb, count)
+        for verb, count in sorted(result["processes_by_verb"].items())))
+    if result["phases"]:
+        print("  phases:")
+        base_phases = (baseline or {}).get("phases", {})
+        for name, seconds in result["phases"].items():
+            line = "    {:<32}{:8.3f}s".format(name, seconds)
+            if name in base_phases:
+                line += "  (baseline {:.3f}s)".format(base_phases[name])
+            print(line)
+
+
+def compare(result, baseline, tolerance):
+    """
+        Returns the list of regressions of result over baseline
+    """
+    regressions = []
+    for key in ("wall_seconds", "peak_rss_bytes"):
+        if not baseline.get(key):
+            continue
+        change = (result[key] - baseline[key]) * 100.0 / baseline[key]
+        if change > tolerance:
+            regressions.append("{} regressed by {:.1f}% ({} -> {})".format(
+                key, change, baseline[key], result[key]))
+    return regressions
+
+
+def main():
+    """
+        Parses arguments, runs the benchmark and reports it
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark crunchy_gather.py against a simulated cluster")
+    parser.add_argument("--pods", type=int, default=3)
+    parser.add_argument("--containers",
+                        default="database,pgbackrest,replication-cert-copy")
+    parser.add_argument("--log-size", type=parse_size, default="1M")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--pg-log-files", type=int, default=4)
+    parser.add_argument("--pg-log-size", type=parse_size, default="1M")
+    parser.add_argument("--exec-hang", type=float, default=0)
+    parser.add_argument("--operator", action="store_true")
+    parser.add_argument("--runs", type=int, default=1)
+    parser.add_argument("--json", dest="json_path")
+    parser.add_argument("--compare", dest="baseline_path")
+    parser.add_argument("--tolerance", type=float, default=10.0)
+    parser.add_argument("gather_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    gather_args = args.gather_args
+    if gather_args[:1] == ["--"]:
+        gather_args = gather_args[1:]
+
+    work_dir = tempfile.mkdtemp(prefix="crunchy_gather_bench_")
+    try:
+        env = make_cluster(work_dir, args)
+        results = [run_once(work_dir, env, gather_args)
+                   for _ in range(max(args.runs, 1))]
+        result = median_result(results)
+        if result["return_code"]:
+            with open(os.path.join(work_dir, "gather.log"), encoding="utf-8") as file_pointer:
+                sys.stderr.write(file_pointer.read())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    result["parameters"] = {
+        "pods": args.pods, "containers": args.containers,
+        "log_size": args.log_size, "latency": args.latency,
+        "pg_log_files": args.pg_log_files, "pg_log_size": args.pg_log_size,
+        "exec_hang": args.exec_hang, "operator": args.operator,
+        "gather_args": gather_args,
+    }
+    baseline = None
+    if args.baseline_path:
+        with open(args.baseline_path, encoding="utf-8") as file_pointer:
+            baseline = json.load(file_pointer)
+    print_result(result, baseline)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as file_pointer:
+            json.dump(result, file_pointer, indent=2)
+
+    if result["return_code"]:
+        return result["return_code"]
+    if baseline is not None:
+        regressions = compare(result, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
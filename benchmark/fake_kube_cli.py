@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+# pylint: disable=C0209
+"""
+Fake kube cli for benchmarking crunchy_gather.py offline
+
+Description:
+    Stands in for kubectl or oc on PATH and answers the calls made by
+    crunchy_gather.py for a simulated namespace of PGO v5 Postgres pods,
+    optionally with the operator pod. Container logs are generated on the fly; pod
+    exec runs the requested command locally with /pgdata mapped to a
+    directory of generated pg log files, so ls, stat, tar and tail
+    behave as they do in a pod.
+
+    The simulation is read from the JSON file named by FAKE_KUBE_CONFIG,
+    see DEFAULTS for its keys. Every call appends "start end verb" to
+    the file named by FAKE_KUBE_CALLS so that the harness can count the
+    processes spawned and how many of them were in flight at once.
+
+    bench_crunchy_gather.py writes both and puts this script on PATH.
+"""
+
+import datetime
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+
+DEFAULTS = {
+    "namespace": "bench",
+    "pods": 3,                # Postgres instance pods
+    "operator": False,        # also run the operator pod in the namespace
+    "containers": ["database", "pgbackrest", "replication-cert-copy"],
+    "log_size": 1024*1024,    # bytes of log per container
+    "latency": 0.05,          # seconds added to every call
+    "root": "",               # local directory holding the simulated pgdata/
+    "nodes": 3,
+    "watch_seconds": 3600,    # seconds before the server ends a watch
+    # resource types the simulated cluster knows, the others are unknown
+    "served": ["pods", "replicaset", "statefulset", "deployment", "services",
+               "ingress", "pvc", "configmap", "networkpolicies",
+               "postgresclusters", "pgupgrades", "pgadmins", "events"],
+}
+
+# kind of the items of each served resource type
+KINDS = {
+    "pods": "Pod", "replicaset": "ReplicaSet", "statefulset": "StatefulSet",
+    "deployment": "Deployment", "services": "Service", "ingress": "Ingress",
+    "pvc": "PersistentVolumeClaim", "configmap": "ConfigMap",
+    "networkpolicies": "NetworkPolicy", "postgresclusters": "PostgresCluster",
+    "pgupgrades": "PGUpgrade", "pgadmins": "PGAdmin", "events": "Event",
+}
+
+# flags of the kube cli taking a separate value
+VALUE_FLAGS = ("-n", "--namespace", "-c", "--container", "-o", "--context",
+               "-l", "--selector", "--raw")
+
+LOG_START = datetime.datetime(2024, 1, 1)
+LOG_LINE = "{}Z level=info msg=\"request {} completed\" duration=12ms\n"
+ERROR_LINE = "{}Z ERROR:  could not connect to server: connection refused {}\n"
+
+
+def load_config():
+    """
+        Returns the simulation settings
+    """
+    config = dict(DEFAULTS)
+    path = os.environ.get("FAKE_KUBE_CONFIG")
+    if path:
+        with open(path, encoding="utf-8") as file_pointer:
+            config.update(json.load(file_pointer))
+    return config
+
+
+def option(args, name):
+    """
+        Returns the value of a --name=value or --name value flag, else None
+    """
+    for index, arg in enumerate(args):
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+        if arg == name and index + 1 < len(args):
+            return args[index + 1]
+    return None
+
+
+def positional_args(args):
+    """
+        Returns the arguments that are neither flags nor flag values
+    """
+    positional = []
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+        elif arg == "--":
+            break
+        elif arg in VALUE_FLAGS:
+            skip = True
+        elif not arg.startswith("-"):
+            positional.append(arg)
+    return positional
+
+
+def pod_names(config):
+    """
+        Returns the names of the simulated pods, the operator pod last
+    """
+    pods = ["hippo-instance1-{:04d}-0".format(index)
+            for index in range(config["pods"])]
+    if config["operator"]:
+        pods.append("pgo-7d4f8b9c5-x2kqp")
+    return pods
+
+
+def pod_node(config, pod):
+    """
+        Returns the node a simulated pod is scheduled on
+    """
+    return "node-{}".format(pod_names(config).index(pod) % config["nodes"])
+
+
+def pod_containers(config, pod):
+    """
+        Returns the containers of a simulated pod
+    """
+    if pod.startswith("pgo-"):
+        return ["operator"]
+    return list(config["containers"])
+
+
+def pod_item(config, pod):
+    """
+        Returns the API object of a simulated pod
+    """
+    if pod.startswith("pgo-"):
+        labels = {"app.kubernetes.io/name": "postgres-operator",
+                  "postgres-operator.crunchydata.com/control-plane": "pgo"}
+    else:
+        labels = {"postgres-operator.crunchydata.com/cluster": "hippo",
+                  "postgres-operator.crunchydata.com/data": "postgres",
+                  "postgres-operator.crunchydata.com/instance": pod[:-2]}
+    containers = pod_containers(config, pod)
+    return {
+        "apiVersion": "v1", "kind": "Pod",
+        "metadata": {"name": pod, "namespace": config["namespace"],
+                     "labels": labels},
+        "spec": {"nodeName": pod_node(config, pod),
+                 "containers": [{"name": name} for name in containers]},
+        "status": {"phase": "Running", "containerStatuses": [
+            {"name": name, "ready": True, "restartCount": 0,
+             "state": {"running": {"startedAt": "2024-01-01T00:00:00Z"}}}
+            for name in containers]},
+    }
+
+
+def resource_items(config, resource_type):
+    """
+        Returns the API objects of a served resource type
+    """
+    if resource_type in ("pods", "pod"):
+        return [pod_item(config, pod) for pod in pod_names(config)]
+    return [{"apiVersion": "v1", "kind": KINDS[resource_type],
+             "metadata": {"name": "hippo-" + resource_type,
+                          "namespace": config["namespace"]},
+             "data": {"postgres-ha.yaml": "bootstrap:\n  dcs: {}\n"}}]
+
+
+def stats_summary(config, path):
+    """
+        Returns the kubelet stats summary of the node named in path
+    """
+    node = path.split("/")[4]
+    return {"node": {"nodeName": node}, "pods": [
+        {"podRef": {"name": pod, "namespace": config["namespace"]},
+         "containers": [{"name": name,
+                         "logs": {"usedBytes": config["log_size"]}}
+                        for name in pod_containers(config, pod)]}
+        for pod in pod_names(config) if pod_node(config, pod) == node]}
+
+
+def watch(config, resource_type, version=0):
+    """
+        Writes a watch event per simulated pod, or a warning event about
+        it, after version when resuming, then waits to be killed like a
+        kube cli watch or for the server to end the watch
+    """
+    for index, pod in enumerate(pod_names(config), 1):
+        if index <= version:
+            continue
+        if resource_type == "pods":
+            item = pod_item(config, pod)
+            item["status"]["containerStatuses"][0]["restartCount"] = 1
+        else:
+            item = {"apiVersion": "v1", "kind": "Event", "type": "Warning",
+                    "reason": "BackOff", "count": 1,
+                    "lastTimestamp": LOG_START.isoformat() + "Z",
+                    "message": "Back-off restarting failed container",
+                    "involvedObject": {"kind": "Pod", "name": pod},
+                    "metadata": {"name": pod + ".1",
+                                 "namespace": config["namespace"]}}
+        item["metadata"]["resourceVersion"] = str(index)
+        print(json.dumps({"type": "MODIFIED", "object": item}, indent=4))
+        sys.stdout.flush()
+        time.sleep(config["latency"])
+    time.sleep(config["watch_seconds"])
+    return 0
+
+
+def get(config, args):
+    """
+        Answers get calls: stats summaries, watches, JSON lists and tables
+    """
+    if "--watch-only" in args:
+        return watch(config, positional_args(args)[1])
+    raw = option(args, "--raw")
+    if raw and "watch=true" in raw:
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(raw).query)
+        return watch(config, raw.split("?")[0].split("/")[-1],
+                     int(query["resourceVersion"][0]))
+    if raw:
+        print(json.dumps(stats_summary(config, raw)))
+        return 0
+    positional = positional_args(args)
+    resource_types = positional[1].split(",") if len(positional) > 1 else []
+    output = option(args, "-o") or ""
+    if output == "json":
+        items = []
+        for resource_type in resource_types:
+            if resource_type.lower() not in config["served"] + ["pod"]:
+                sys.stderr.write("error: the server doesn't have a resource "
+                                 "type \"{}\"\n".format(resource_type))
+                return 1
+            items += resource_items(config, resource_type.lower())
+        print(json.dumps({"apiVersion": "v1", "kind": "List", "items": items,
+                          "metadata": {"resourceVersion": ""}}, indent=4))
+    elif output == "yaml":
+        print("apiVersion: v1\nitems: []\nkind: List\n"
+              "metadata:\n  resourceVersion: \"\"")
+    else:
+        print("NAME                          STATUS    AGE")
+        for pod in pod_names(config):
+            print("{:<30}Running   1d".format(pod))
+    return 0
+
+
+def logs(config, args):
+    """
+        Writes generated log lines of a container, honoring --tail,
+        --limit-bytes, --since-time and --timestamps
+    """
+    size = config["log_size"]
+    if option(args, "--since-time"):
+        size //= 10
+    lines = []
+    total = index = 0
+    while total < size:
+        stamp = (LOG_START + datetime.timedelta(seconds=index)).isoformat()
+        line = (ERROR_LINE if index % 97 == 0 else LOG_LINE).format(stamp, index)
+        if "--timestamps" in args or option(args, "--timestamps") == "true":
+            line = "{}.000000000Z {}".format(stamp, line)
+        lines.append(line)
+        total += len(line)
+        index += 1
+    tail = option(args, "--tail")
+    if tail is not None:
+        lines = lines[len(lines) - min(int(tail), len(lines)):]
+    data = "".join(lines).encode('utf-8')
+    limit = option(args, "--limit-bytes")
+    if limit is not None:
+        data = data[:int(limit)]
+    sys.stdout.buffer.write(data)
+    return 0
+
+
+def pod_exec(config, args):
+    """
+        Runs the exec command locally, with /pgdata and the tar stream
+        root mapped to the simulated pod root
+    """
+    command = args[args.index("--") + 1:]
+    root = config["root"]
+    if root:
+        command = [arg.replace("sed 's|^/||' | tar -C /",
+                               "sed 's|^{0}/||' | tar -C {0}".format(root))
+                   .replace("/pgdata", root + "/pgdata")
+                   # paths listed by an earlier exec are already mapped
+                   .replace(root + root, root) for arg in command]
+    return subprocess.call(command)
+
+
+def copy_from_pod(config, args):
+    """
+        Answers cp calls copying a pod file to a local path
+    """
+    positional = positional_args(args)
+    source = config["root"] + positional[1].split(":", 1)[1]
+    target = positional[2]
+    if os.path.dirname(target):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        dst.write(src.read())
+    return 0
+
+
+def main(args):
+    """
+        Dispatches a kube cli call on its verb
+    """
+    config = load_config()
+    config["namespace"] = option(args, "-n") or config["namespace"]
+    time.sleep(config["latency"])
+    verb = (positional_args(args) or [""])[0]
+    if verb in ("version", "cluster-info", "whoami"):
+        print("Client Version: v1.28.0-fake\nServer Version: v1.28.0-fake")
+        return 0
+    if verb == "config":
+        # no kubeconfig: --rest-client falls back to the kube cli
+        sys.stderr.write("error: no kubeconfig in the fake cluster\n")
+        return 1
+    if verb == "get":
+        return get(config, args)
+    if verb == "describe":
+        for pod in pod_names(config):
+            print("Name:         {}\nNamespace:    {}\nStatus:       Running\n"
+                  .format(pod, config["namespace"]))
+        return 0
+    if verb == "logs":
+        return logs(config, args)
+    if verb == "exec":
+        return pod_exec(config, args)
+    if verb == "cp":
+        return copy_from_pod(config, args)
+    sys.stderr.write("error: unknown command \"{}\"\n".format(verb))
+    return 1
+
+
+def record_call(started, verb):
+    """
+        Appends a call to the FAKE_KUBE_CALLS file
+    """
+    path = os.environ.get("FAKE_KUBE_CALLS")
+    if path:
+        with open(path, "a", encoding="utf-8") as file_pointer:
+            file_pointer.write("{:.6f} {:.6f} {}\n".format(
+                started, time.time(), verb))
+
+
+if __name__ == "__main__":
+    STARTED = time.time()
+    VERB = (positional_args(sys.argv[1:]) or [""])[0]
+    RETURN_CODE = 1
+    try:
+        RETURN_CODE = main(sys.argv[1:])
+    finally:
+        record_call(STARTED, VERB)
+    sys.exit(RETURN_CODE)
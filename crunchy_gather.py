@@ -32,20 +32,114 @@ Example:
     ./crunchy_gather_k8s_support_dump.py -n pgdb -o $HOME/dumps/crunchy/pgdb
 
 Arguments:
-    -n: namespace or project name
+    -n: namespace or project name, or a comma separated list of them to
+        collect concurrently, each into its own directory of the dump
     -o: directory to create the support dump in
     -l: number of pg_log files to save
+    -j: number of concurrent log collection workers, also the limit of
+        kube cli or API calls in flight across all namespaces
+    --adaptive: adjust the number of calls in flight between --min-jobs
+                and -j to the latency and errors of the API server
+    --context: kube context, or comma separated list of contexts, to
+               collect the namespaces from; one directory per context
+    --sequential: collect logs one container at a time (same as -j 1)
+    --stream: write collected files straight into the archive
+    --keep-files: with --stream or --store, also keep an on-disk copy of
+                  the files
+    --compress: archive compression (auto, gzip, pigz or zstd)
+    --seekable: gzip each archive member on its own and index them, so
+                --read-archive can list the archive and extract a
+                single member without decompressing the others
+    --read-archive: list the members of a --seekable archive, or extract
+                    --member into dest_dir (-n is then not needed)
+    --rest-client: use the in-process kubernetes API client for get/log
+    --exec-timeout: seconds each pod detail command may run
+    --call-timeout: seconds each kube cli or API request may run before
+                    it is killed; transient API errors are retried. Log
+                    and file transfers are only bounded by --deadline
+    --deadline: seconds the whole collection may run; the calls still
+                running are killed and what was collected is archived
+    --scan: index ERROR/FATAL/PANIC, OOM, failover and leader change lines
+            of the collected logs while they are written
+    --scan-patterns: JSON file of the patterns to index (implies --scan)
+    --redact: mask passwords, tokens and e-mail addresses in the collected
+              logs while they are written
+    --redact-rules: JSON file of the redaction rules (implies --redact)
+    --profile: print the N slowest operations of the run at the end
+    --watch: record the namespace events and pod state changes during the
+             whole run from watch streams into watch_timeline.jsonl
+    --snapshot: also load the pods, containers, PVCs, configmaps, events
+                and Postgres resources into resources.sqlite, indexed by
+                namespace, name, owner and node
+    --max-size: size budget of the archive; the lowest priority logs are
+                tailed or skipped so that it fits
+    --longest-first: estimate the log sizes up front and collect the PG
+                     and container logs as one pool of work, largest
+                     first, so that no big log starts last
+    --plan: print the estimated bytes and transfer time of each log and
+            the resulting run time, without collecting anything
+    --pg-sample: sample pg_stat_activity, locks, replication lag and the
+                 cumulative statistics views of each database pod for
+                 this many seconds, over one psql session per pod
+    --pg-sample-interval: seconds between two samples
+    --incremental: only collect log lines and pg log files that are new
+                   since the previous --incremental run into dest_dir
+    --since, --until: only collect the logs of a time window, UTC such as
+                      2024-05-01T10:00 or relative such as 2h: the pg log
+                      files whose mtime overlaps it, cut to its lines in
+                      the pod, and the container log lines in it
+    --resume: continue an interrupted run in its dump directory, the
+              latest unarchived one in dest_dir by default, skipping
+              the items its resume_manifest.jsonl lists as complete
+    --store: save the dump into a content addressed store directory
+             shared by repeated dumps, each unique chunk stored once,
+             instead of a tar archive; the files are staged in dest_dir
+             as usual and removed once stored, or with --stream go
+             straight into the store
+    --export: with --store, rebuild the tar archive of a stored dump in
+              dest_dir (-n is then not needed)
 """
 
 import argparse
+import base64
+import calendar
+import codecs
+import csv
+import hashlib
+import http.client
+import io
+import json
 import logging
 import os
+import re
+import shlex
 import subprocess
 import sys
 import tarfile
 import posixpath
+import queue
+import random
+import shutil
+import signal
+import ssl
+import struct
+import tempfile
+import threading
 import time
-from collections import OrderedDict
+import urllib.parse
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import yaml
+except ImportError:
+    yaml = None  # pylint: disable=invalid-name
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None  # pylint: disable=invalid-name
 
 if sys.version_info[0] < 3:
     print("Python 3 or a more recent version is required.")
@@ -62,18 +156,285 @@ class Options():  # pylint: disable=too-few-public-methods
     """
     def __init__(self, dest_dir, namespace, kube_cli, pg_logs_count):
         self.dest_dir = dest_dir
-        self.namespace = namespace
         self.kube_cli = kube_cli
         self.pg_logs_count = pg_logs_count
         self.delete_dir = False
+        self.jobs = DEFAULT_JOBS
+        self.limiter = threading.BoundedSemaphore(DEFAULT_JOBS)
+        self.exec_timeout = DEFAULT_EXEC_TIMEOUT
+        self.call_timeout = DEFAULT_CALL_TIMEOUT
+        self.watchdog = ProcessWatchdog()
+        self.stream_archive = False
+        self.keep_files = False
+        self.compression = "auto"
+        self.archive = None
+        self.store = None
+        self.seekable = False
+        self.max_size = None
+        self.since = None  # epoch seconds of the --since/--until window
+        self.until = None
+        self.longest_first = False
+        self.scanner = None
+        self.redactor = None
+        self.resume = None
+        self.watch = False
+        self.snapshot = False
+        self.pg_sample = 0
+        self.pg_sample_interval = DEFAULT_PG_SAMPLE_INTERVAL
+        self.report = None
+        self.profile = 0
         self.output_dir = ""
         self.dir_name = (f"crunchy_k8s_support_dump_{time.strftime('%a-%Y-%m-%d-%H%M%S%z')}")
+        # the dump root target, the only one unless several namespaces
+        # or contexts are collected, each into its own directory
+        self.root = Target(namespace)
+        self.targets = [self.root]
+        self.local = threading.local()
+
+    @property
+    def target(self):
+        """
+            Target collected by the current thread, the root one when
+            none is set
+        """
+        return getattr(self.local, "target", None) or self.root
+
+
+class Target():  # pylint: disable=too-few-public-methods
+    """
+        Namespace, in a kube context, collected into a directory of the
+        dump with its own incremental state, size budget and REST client
+    """
+    def __init__(self, namespace, context=None, dir_name=""):
+        self.namespace = namespace
+        self.context = context
+        self.dir_name = dir_name
+        self.state = None
+        self.budget = None
+        self.client = None
+        self.collector = None
+        self.size = 0
+        self.watch = None
+        self.snapshot = None
+
+
+class ProcessWatchdog():
+    """
+        Starts kube cli calls in their own process group and kills the
+        groups that outlive their call deadline or the run deadline,
+        from a single daemon thread
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.processes = {}
+        self.thread = None
+        self.deadline = None  # monotonic time of the run deadline
+
+    def start(self, cmd, timeout=None, **kwargs):
+        """
+            Popen of a shell command killed after timeout seconds, or at
+            the run deadline; handle.timed_out tells if it was
+        """
+        handle = subprocess.Popen(cmd, shell=True, start_new_session=True,
+                                  **kwargs)
+        handle.timed_out = False
+        deadlines = [self.deadline] if self.deadline is not None else []
+        if timeout:
+            deadlines.append(time.monotonic() + timeout)
+        with self.lock:
+            self.processes[handle] = min(deadlines) if deadlines else None
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.watch, daemon=True)
+                self.thread.start()
+        return handle
+
+    def expired(self):
+        """
+            Returns True once the run deadline has passed
+        """
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def watch(self):
+        """
+            Forgets finished processes and kills expired ones, forever
+        """
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            now = time.monotonic()
+            with self.lock:
+                for handle, deadline in list(self.processes.items()):
+                    if handle.poll() is not None:
+                        del self.processes[handle]
+                    elif deadline is not None and now >= deadline:
+                        self.kill(handle)
+                        del self.processes[handle]
+
+    def cancel(self):
+        """
+            Kills all the running processes
+        """
+        with self.lock:
+            for handle in self.processes:
+                if handle.poll() is None:
+                    self.kill(handle)
+            self.processes.clear()
+
+    @staticmethod
+    def stop(handle):
+        """
+            Ends the process group of a handle whose output is not
+            needed anymore, waiting for it
+        """
+        try:
+            os.killpg(handle.pid, signal.SIGTERM)
+        except OSError:
+            pass
+        handle.wait()
+
+    @staticmethod
+    def kill(handle):
+        """
+            Kills the process group of a handle: the shell and kube cli
+        """
+        handle.timed_out = True
+        try:
+            os.killpg(handle.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+class AdaptiveLimiter():
+    """
+        Limiter of the kube cli and API calls in flight, used like the
+        BoundedSemaphore of -j, whose limit follows the health of the
+        API server: it doubles, then grows by one, after each round of
+        calls that completed fast and well, and halves on timeouts,
+        throttling, retried transient errors or when the median latency
+        of a kind of request, log and file transfers left out, rises
+        well above its baseline
+    """
+    def __init__(self, minimum, maximum):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = minimum
+        self.active = 0
+        self.condition = threading.Condition()
+        self.slow_start = True
+        self.successes = 0  # completed calls since the last change
+        self.completed = 0
+        self.cooldown = 0  # calls in flight at the last decrease end at
+        self.latencies = {}
+        self.baselines = {}
+        self.started = time.monotonic()
+        self.history = [(0.0, minimum)]
 
+    def __enter__(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        return self
 
+    def __exit__(self, *args):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def observe(self, kind, seconds, congested):
+        """
+            Adjusts the limit after a call of kind, that took seconds,
+            None for a transfer, completed; congested tells if it timed
+            out or was throttled
+        """
+        with self.condition:
+            self.completed += 1
+            congested = (seconds is not None and self._slow(kind, seconds)) or congested
+            if congested:
+                self.successes = 0
+                self.slow_start = False
+                # calls started before the last decrease only confirm it
+                if self.completed >= self.cooldown:
+                    self.cooldown = self.completed + self.active
+                    self._set(max(self.minimum, self.limit // 2))
+                return
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.maximum:
+                self.successes = 0
+                self._set(min(self.maximum, self.limit * 2 if self.slow_start
+                              else self.limit + 1))
+
+    def _slow(self, kind, seconds):
+        """
+            Returns True when a window of calls of kind is complete and
+            its median latency is well above the baseline
+        """
+        window = self.latencies.setdefault(kind, [])
+        window.append(seconds)
+        if len(window) < LATENCY_WINDOW:
+            return False
+        median = sorted(window)[len(window) // 2]
+        del window[:]
+        baseline = self.baselines.get(kind, median)
+        # the baseline creeps up, so a lasting change is accepted
+        self.baselines[kind] = min(median, baseline * LATENCY_BASELINE_DRIFT)
+        return median > LATENCY_MIN_SECONDS and median > LATENCY_TOLERANCE * baseline
+
+    def _set(self, limit):
+        if limit == self.limit:
+            return
+        logger.debug("Concurrency limit %d -> %d", self.limit, limit)
+        self.limit = limit
+        self.history.append((round(time.monotonic() - self.started, 3), limit))
+        self.condition.notify_all()
+
+
+DEFAULT_JOBS = 4
+DEFAULT_MIN_JOBS = 1
+DEFAULT_EXEC_TIMEOUT = 60
+DEFAULT_CALL_TIMEOUT = 300
+DEFAULT_PG_SAMPLE_INTERVAL = 5
+WATCH_MAX_ENTRIES = 10000  # changes kept per watched resource
+WATCH_MAX_AGE = 6*3600  # seconds changes are kept
+WATCH_RESTARTS = 5  # restarts in a row of watch streams ending early
+WATCH_HEALTHY = 60  # seconds after which a watch stream did not end early
+WATCHDOG_INTERVAL = 0.5  # seconds between checks of the call deadlines
+# retries of kube calls failing with a transient API error, and the
+# delay before the first retry, doubled for each one
+CALL_RETRIES = 2
+CALL_RETRY_DELAY = 1.0
+# --adaptive latency signal: median of each window of calls of a kind,
+# compared to the lowest median seen
+LATENCY_WINDOW = 8
+LATENCY_TOLERANCE = 2.0
+LATENCY_MIN_SECONDS = 0.1  # faster calls never count as slow
+LATENCY_BASELINE_DRIFT = 1.1
 OPT = Options("", "", "kubectl", 2)
 
 
 MAX_ARCHIVE_EMAIL_SIZE = 25*1024*1024  # 25 MB filesize limit
+RESUME_MANIFEST = "resume_manifest.jsonl"
+# size budget planning: compressed/raw ratio assumed for text and logs,
+# size assumed for container logs the kubelet does not report, short
+# log line length used to turn a byte budget into --tail lines, and the
+# smallest share of the budget worth keeping as a tail
+BUDGET_COMPRESSION_RATIO = 0.15
+BUDGET_UNKNOWN_LOG_SIZE = 16*1024*1024
+BUDGET_LINE_SIZE = 32
+BUDGET_MIN_TAIL = 64*1024
+# --plan transfer time estimate: setup time of each log call and rate
+PLAN_CALL_SECONDS = 0.5
+PLAN_BYTES_PER_SECOND = 20*1024*1024
+SPOOL_SIZE = 8*1024*1024  # archive members larger than this spool to disk
+STREAM_CHUNK_SIZE = 64*1024  # subprocess and API output is copied in chunks
+STORE_CHUNK_SIZE = 1024*1024  # files are deduplicated in chunks of this size
+ARCHIVE_INDEX = "archive_index.json"  # last member of --seekable archives
+
+# external compressor command and archive suffix, None runs gzip in-process
+COMPRESSORS = OrderedDict([
+    ("gzip", (None, ".tar.gz")),
+    ("pigz", (["pigz", "-c"], ".tar.gz")),
+    ("zstd", (["zstd", "-q", "-T0", "-c"], ".tar.zst")),
+])
 logger = logging.getLogger("crunchy_support")  # pylint: disable=locally-disabled, invalid-name
 
 API_RESOURCES = [
@@ -94,6 +455,153 @@ API_RESOURCES = [
     "pgtasks"
 ]
 
+# resources loaded into the --snapshot database, events are only fetched
+# for it, the others are taken from the API resources collection
+SNAPSHOT_RESOURCES = ["pods", "pvc", "configmap", "events",
+                      "postgresclusters", "pgclusters", "pgreplicas"]
+SNAPSHOT_SCHEMA = """
+CREATE TABLE snapshot (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE pods (namespace TEXT, name TEXT, uid TEXT, node TEXT,
+    phase TEXT, pod_ip TEXT, start_time TEXT, created TEXT,
+    owner_kind TEXT, owner_name TEXT, labels TEXT);
+CREATE TABLE containers (namespace TEXT, pod TEXT, name TEXT, init INTEGER,
+    image TEXT, ready INTEGER, restart_count INTEGER, state TEXT,
+    reason TEXT, started_at TEXT, last_state TEXT, last_reason TEXT,
+    last_exit_code INTEGER, last_finished_at TEXT);
+CREATE TABLE pod_volumes (namespace TEXT, pod TEXT, volume TEXT,
+    claim TEXT, config_map TEXT);
+CREATE TABLE pvcs (namespace TEXT, name TEXT, phase TEXT, volume TEXT,
+    storage_class TEXT, requested TEXT, capacity TEXT, access_modes TEXT,
+    created TEXT, owner_kind TEXT, owner_name TEXT, labels TEXT);
+CREATE TABLE configmaps (namespace TEXT, name TEXT, created TEXT,
+    owner_kind TEXT, owner_name TEXT, labels TEXT, data TEXT);
+CREATE TABLE events (namespace TEXT, name TEXT, type TEXT, reason TEXT,
+    message TEXT, count INTEGER, first_time TEXT, last_time TEXT,
+    object_kind TEXT, object_name TEXT, node TEXT);
+CREATE TABLE postgres_crs (namespace TEXT, name TEXT, kind TEXT,
+    api_version TEXT, created TEXT, owner_kind TEXT, owner_name TEXT,
+    labels TEXT, spec TEXT, status TEXT);
+"""
+SNAPSHOT_INDEXES = """
+CREATE INDEX pods_name ON pods (namespace, name);
+CREATE INDEX pods_owner ON pods (owner_kind, owner_name);
+CREATE INDEX pods_node ON pods (node);
+CREATE INDEX containers_pod ON containers (namespace, pod);
+CREATE INDEX pod_volumes_pod ON pod_volumes (namespace, pod);
+CREATE INDEX pod_volumes_claim ON pod_volumes (namespace, claim);
+CREATE INDEX pvcs_name ON pvcs (namespace, name);
+CREATE INDEX pvcs_owner ON pvcs (owner_kind, owner_name);
+CREATE INDEX configmaps_name ON configmaps (namespace, name);
+CREATE INDEX configmaps_owner ON configmaps (owner_kind, owner_name);
+CREATE INDEX events_object ON events (namespace, object_kind, object_name);
+CREATE INDEX events_node ON events (node);
+CREATE INDEX postgres_crs_name ON postgres_crs (namespace, name);
+CREATE INDEX postgres_crs_owner ON postgres_crs (owner_kind, owner_name);
+"""
+
+# Kind reported in the items of a batched `get -o json` for each resource
+API_RESOURCE_KINDS = {
+    "pods": "Pod",
+    "ReplicaSet": "ReplicaSet",
+    "StatefulSet": "StatefulSet",
+    "Deployment": "Deployment",
+    "Services": "Service",
+    "Routes": "Route",
+    "Ingress": "Ingress",
+    "pvc": "PersistentVolumeClaim",
+    "configmap": "ConfigMap",
+    "networkpolicies": "NetworkPolicy",
+    "postgresclusters": "PostgresCluster",
+    "pgreplicas": "Pgreplica",
+    "pgclusters": "Pgcluster",
+    "pgpolicies": "Pgpolicy",
+    "pgtasks": "Pgtask"
+}
+
+UNKNOWN_RESOURCE_RE = re.compile(
+    r'the server doesn\'t have a resource type "([^"]+)"')
+
+PG_LOGS_LIST_CMD = "ls -1dt /pgdata/*/pglogs/* | head -{}"
+# size, mtime, inode, checksum of the first bytes and path of each listed file
+PG_LOGS_STAT_CMD = (" | while read -r f; do echo \"$(stat -c '%s %Y %i' \"$f\")"
+                    " $(head -c {} \"$f\" | cksum | cut -d ' ' -f 1) $f\"; done")
+PG_LOG_HEAD_SIZE = 256
+# prints the lines of a pg log file in the --since/--until window: those
+# from a timestamp in it, near the start of the line for stderr, csv and
+# json logs, up to the next out of window one
+PG_LOG_WINDOW_CMD = (
+    "awk -v since={} -v until={} "
+    "'match($0, /[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9][ T]"
+    "[0-9][0-9]:[0-9][0-9]:[0-9][0-9]/) && RSTART <= 16 {{ "
+    "stamp = substr($0, RSTART, 19); sub(/T/, \" \", stamp); "
+    "if (until != \"\" && stamp > until) exit; keep = stamp >= since }} keep' {}")
+
+# patterns indexed by --scan: (name, severity, bytes regex)
+SCAN_PATTERNS = [
+    ("panic", "PANIC", rb"\bPANIC\b"),
+    ("fatal", "FATAL", rb"\bFATAL\b"),
+    ("oom", "FATAL", rb"(?i:out of memory|OOMKilled|oom-kill|killed process)"),
+    ("leader_change", "WARNING",
+     rb"acquired session lock as a leader|promoted self to leader|"
+     rb"lost leader lock|demoting self|demoted self"),
+    ("failover", "WARNING", rb"(?i:\bfail ?over\b|\bswitchover\b|promoting standby)"),
+    ("error", "ERROR", rb"\bERROR\b|\blevel=error\b|\"level\":\"error\""),
+]
+
+# rules masked by --redact: (name, bytes regex, triggers); when the regex
+# has a group only its first group is masked, else the whole match
+# The regex only runs on lines containing one of the lowercase trigger
+# strings: most lines have none, and a search for the literals is much
+# cheaper than the rules regex
+REDACT_RULES = [
+    ("url_password", rb"://[^:/\s@]+:([^@\s/]+)@", (b"://",)),
+    ("bearer_token", rb"(?i:\bbearer\s+([A-Za-z0-9._~+/-]+=*))", (b"bearer",)),
+    ("jwt", rb"\beyJ[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+", (b"eyj",)),
+    # the key may have a prefix: PGPASSWORD, POSTGRES_PASSWORD, db_password,
+    # PGBACKREST_REPO1_S3_KEY_SECRET, repo1-cipher-pass
+    ("password", rb"(?i:(?:password|passwd|passphrase|pwd|secret|token|"
+                 rb"api[_-]?key|access[_-]?key|cipher[_-]?pass)"
+                 rb"[\"']?\s*[:=]\s*[\"']?([^\s\"'&,;]+))",
+     (b"pass", b"pwd", b"secret", b"token", b"key")),
+    ("sql_password", rb"(?i:\bpassword\s+'([^']*)')", (b"password",)),
+    ("aws_access_key", rb"\bAKIA[0-9A-Z]{16}\b", (b"akia",)),
+    ("email", rb"\b[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}\b",
+     (b"@",)),
+]
+
+# leading timestamp of a log line: ISO 8601 or PostgreSQL log_line_prefix
+LOG_TIMESTAMP_RE = re.compile(
+    rb"^\s*\[?(\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(?:[.,]\d+)?"
+    rb"(?:Z|[+-]\d{2}:?\d{2}| [A-Z]{2,5})?)")
+
+MAX_LINE_SIZE = 1024*1024  # longer lines are split when scanned
+
+# RFC 3339 timestamp the kube cli and API prefix log lines with, and
+# the space after it
+LOG_LINE_STAMP_RE = re.compile(
+    rb"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})(?:\.\d+)?(Z|z|[+-]\d{2}:\d{2}) ")
+
+# kube cli flag of each container log query option
+LOG_OPTION_FLAGS = {
+    "sinceTime": "--since-time",
+    "tailLines": "--tail",
+    "timestamps": "--timestamps"
+}
+
+# delimiters of the commands of a batched exec session
+EXEC_END_RE = re.compile(rb"^##### END \[(\d+)\] exit_code=(\d+) elapsed_ms=(-?\d+)")
+EXEC_TIMEOUT_CODE = 124  # exit code of timeout(1)
+
+# kube cli and API errors worth retrying: overload, restarts, network
+TRANSIENT_ERROR_RE = re.compile(
+    rb"(?i:TLS handshake timeout|i/o timeout|connection refused|"
+    rb"connection reset by peer|unexpected EOF|http2: client connection lost|"
+    rb"etcdserver: request timed out|Too Many Requests|"
+    rb"the server is currently unable to handle the request|"
+    rb"the server was unable to return a response in the time allotted|"
+    rb"context deadline exceeded|ServiceUnavailable)")
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 CONTAINER_COMMANDS = {
     'collect': [],
     'exporter': [],
@@ -104,28 +612,182 @@ CONTAINER_COMMANDS = {
     'all': ["ps aux --width 500"]
 }
 
+# queries of each --pg-sample sample: (name, CSV columns, psql variable
+# the query depends on, SQL); the queries without columns return
+# (object, counter, value) rows of cumulative counters, stored with
+# their deltas and rates between samples
+PG_SAMPLE_QUERIES = [
+    ("activity", ["state", "wait_event_type", "backends", "longest_xact_seconds"], None,
+     "SELECT coalesce(state, ''), coalesce(wait_event_type, ''), count(*),"
+     " round(coalesce(max(extract(epoch FROM clock_timestamp() - xact_start)), 0)::numeric, 3)"
+     " FROM pg_stat_activity WHERE backend_type = 'client backend'"
+     " AND pid <> pg_backend_pid() GROUP BY 1, 2"),
+    ("locks", ["locktype", "mode", "granted", "locks"], None,
+     "SELECT locktype, mode, granted, count(*) FROM pg_locks"
+     " WHERE pid <> pg_backend_pid() GROUP BY 1, 2, 3"),
+    ("replication", ["name", "state", "lag_bytes", "lag_seconds"], None,
+     "SELECT application_name, state, pg_wal_lsn_diff(CASE WHEN pg_is_in_recovery()"
+     " THEN NULL ELSE pg_current_wal_lsn() END, replay_lsn),"
+     " round(coalesce(extract(epoch FROM replay_lag), 0)::numeric, 3) FROM pg_stat_replication"
+     " UNION ALL SELECT 'replay', 'recovery', NULL, round(coalesce(extract(epoch FROM"
+     " now() - pg_last_xact_replay_timestamp()), 0)::numeric, 3) WHERE pg_is_in_recovery()"),
+    ("bgwriter", None, None,
+     "SELECT 'bgwriter', key, value FROM pg_stat_bgwriter s, jsonb_each_text(to_jsonb(s))"),
+    ("checkpointer", None, "has_checkpointer",
+     "SELECT 'checkpointer', key, value FROM pg_stat_checkpointer s,"
+     " jsonb_each_text(to_jsonb(s))"),
+    ("wal", None, "has_wal",
+     "SELECT 'wal', key, value FROM pg_stat_wal s, jsonb_each_text(to_jsonb(s))"),
+    ("database", None, None,
+     "SELECT 'database:' || datname, key, value FROM pg_stat_database s,"
+     " jsonb_each_text(to_jsonb(s) - 'datid' - 'datname') WHERE datname IS NOT NULL"),
+    ("statements", None, "has_statements",
+     "SELECT 'statement:' || queryid, key, value FROM (SELECT * FROM pg_stat_statements"
+     " ORDER BY calls DESC LIMIT 100) s, jsonb_each_text(to_jsonb(s) - 'query'"
+     " - 'queryid' - 'userid' - 'dbid' - 'toplevel')"),
+]
+
+# run once at the start of a --pg-sample session
+PG_SAMPLE_SETUP = (
+    "SET application_name = 'crunchy_gather_sampler';\n"
+    "SET statement_timeout = '10s';\n"
+    "SELECT to_regclass('pg_catalog.pg_stat_checkpointer') IS NOT NULL AS has_checkpointer,"
+    " to_regclass('pg_catalog.pg_stat_wal') IS NOT NULL AS has_wal,"
+    " to_regclass('pg_stat_statements') IS NOT NULL AS has_statements \\gset\n")
+
+# run once at the end, the text of the sampled statements
+PG_SAMPLE_STATEMENTS = (
+    "\\echo '##### statement_text'\n\\if :has_statements\n"
+    "SELECT queryid, left(regexp_replace(query, '\\s+', ' ', 'g'), 500)"
+    " FROM pg_stat_statements ORDER BY calls DESC LIMIT 100;\n\\endif\n")
+
 
 def run():
     """
         Main function to collect support dump
     """
 
-    logger.info("Saving support dump files in %s", OPT.output_dir)
-
-    collect_current_time()
-    collect_script_version()
-    collect_kube_version()
-    collect_node_info()
-    collect_namespace_info()
-    collect_events()
-    collect_pvc_list()
-    collect_configmap_list()
-    collect_pods_describe()
-    collect_api_resources()
-    collect_pg_logs()
-    collect_pods_logs()
-    collect_pg_pod_details()
+    if OPT.stream_archive:
+        OPT.archive = open_archive()
+        logger.info("Streaming support dump files into %s", OPT.archive.file_name)
+    else:
+        logger.info("Saving support dump files in %s", OPT.output_dir)
+
+    OPT.report = RunReport()
+    if OPT.archive is None:
+        OPT.resume = ResumeManifest(posixpath.join(OPT.output_dir,
+                                                   RESUME_MANIFEST))
+        if OPT.resume.resumed:
+            logger.info("Resuming %s: %d items already collected",
+                        OPT.dir_name, OPT.resume.resumed)
+    if OPT.watch:
+        for target in OPT.targets:
+            target.watch = WatchRecorder()
+            run_in_target(target, target.watch.start)
+    if OPT.snapshot:
+        for target in OPT.targets:
+            target.snapshot = ResourceSnapshot()
+    collectors = [
+        collect_current_time,
+        collect_script_version,
+        collect_kube_version,
+        collect_node_info,
+        collect_namespace_info,
+        collect_events,
+        collect_pvc_list,
+        collect_configmap_list,
+        collect_pods_describe,
+        collect_api_resources,
+    ]
+    if OPT.snapshot:
+        collectors.append(collect_resource_snapshot)
+    if OPT.max_size or OPT.longest_first:
+        collectors += [plan_size_budget, collect_logs_longest_first]
+    else:
+        collectors += [collect_pg_logs, collect_pods_logs]
+    collectors.append(collect_pg_pod_details)
+    if OPT.pg_sample:
+        collectors.append(collect_pg_samples)
+    if OPT.targets[0].state is not None:
+        collectors.append(collect_incremental_info)
+    if OPT.max_size:
+        collectors.append(collect_budget_manifest)
+
+    if len(OPT.targets) == 1:
+        collect_target(collectors)
+    else:
+        logger.info("Collecting %d namespaces with up to %d concurrent"
+                    " calls", len(OPT.targets), OPT.jobs)
+        with ThreadPoolExecutor(max_workers=len(OPT.targets)) as pool:
+            for future in [pool.submit(run_in_target, target,
+                                       collect_target, collectors)
+                           for target in OPT.targets]:
+                future.result()
+    partial = OPT.watchdog.expired()
+    if OPT.watch:
+        for target in OPT.targets:
+            target.watch.stop()
+        for target in OPT.targets:
+            run_in_target(target, OPT.report.run_collector, collect_watch_timeline)
+    if OPT.scanner is not None:
+        OPT.report.run_collector(collect_log_index)
+    if OPT.redactor is not None:
+        OPT.report.run_collector(collect_redaction_summary)
+    collect_run_report()
     archive_files()
+    if partial:
+        # cut transfers must be collected again by the next run
+        logger.warning("Run deadline reached: the support dump is partial"
+                       " and the incremental state was not saved")
+    else:
+        for target in OPT.targets:
+            if target.state is not None:
+                target.state.save()
+    if OPT.profile:
+        OPT.report.log_profile(OPT.profile)
+
+
+def collect_target(collectors):
+    """
+        Runs the collectors of the current target, logging rather than
+        raising their errors so that the other targets are collected
+        After the run deadline, only the collectors writing what was
+        already collected run
+    """
+    for collector in collectors:
+        if OPT.watchdog.expired() and collector not in (
+                collect_incremental_info, collect_budget_manifest,
+                collect_resource_snapshot):
+            logger.warning("Run deadline reached, skipping %s",
+                           collector.__name__)
+            continue
+        try:
+            OPT.report.run_collector(collector)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("Collector %s failed", collector.__name__)
+
+
+def run_in_target(target, func, *args):
+    """
+        Calls func with target as the current target of the thread
+    """
+    previous = getattr(OPT.local, "target", None)
+    OPT.local.target = target
+    try:
+        return func(*args)
+    finally:
+        OPT.local.target = previous
+
+
+class TargetLogFilter(logging.Filter):  # pylint: disable=too-few-public-methods
+    """
+        Prefixes the messages logged for a namespace directory with it,
+        as the namespaces are collected concurrently
+    """
+    def filter(self, record):
+        if OPT.target.dir_name:
+            record.msg = "[{}] {}".format(OPT.target.dir_name, record.msg)
+        return True
 
 
 def collect_current_time():
@@ -143,7 +805,7 @@ def collect_kube_version():
     """
         function to gather kubernetes version information
     """
-    cmd = OPT.kube_cli + " version "
+    cmd = OPT.kube_cli + " version " + get_context_argument()
     logger.debug("collecting kube version info: %s", cmd)
     collect_helper(cmd, file_name="k8s-version.info", resource_name="Platform Version info")
 
@@ -162,7 +824,7 @@ def collect_node_info():
     """
         function to gather kubernetes node information
     """
-    cmd = OPT.kube_cli + " get nodes -o wide "
+    cmd = OPT.kube_cli + " get nodes -o wide " + get_context_argument()
     logger.debug("collecting node info: %s", cmd)
     collect_helper(cmd, file_name="nodes.info", resource_name="Node info")
 
@@ -172,9 +834,11 @@ def collect_namespace_info():
         function to gather kubernetes namespace information
     """
     if OPT.kube_cli == "oc":
-        cmd = OPT.kube_cli + " describe project " + OPT.namespace
+        cmd = OPT.kube_cli + " describe project {} {}".format(
+            get_context_argument(), OPT.target.namespace)
     else:
-        cmd = OPT.kube_cli + " get namespace -o yaml " + OPT.namespace
+        cmd = OPT.kube_cli + " get namespace -o yaml {} {}".format(
+            get_context_argument(), OPT.target.namespace)
 
     logger.debug("collecting namespace info: %s", cmd)
     collect_helper(cmd, file_name="namespace.yml",
@@ -229,18 +893,417 @@ def collect_api_resources():
         function to gather details on different k8s resources
     """
     logger.info("Collecting API resources:")
-    resources_out = OrderedDict()
-    for resource in API_RESOURCES:
-        if OPT.kube_cli == "kubectl" and resource == "Routes":
-            continue
-        output = run_kube_get(resource)
-        if output:
-            resources_out[resource] = run_kube_get(resource)
-            logger.info("  + %s", resource)
+    resources = [resource for resource in API_RESOURCES
+                 if not (OPT.kube_cli == "kubectl" and resource == "Routes")]
+    for resource in [resource for resource in resources
+                     if is_collected(f"{resource}.yml")]:
+        logger.info("  + %s (resumed)", resource)
+        resources.remove(resource)
+    if not resources:
+        return
+
+    batch = run_kube_get_batch(resources)
+    if batch is not None:
+        for resource in resources:
+            if resource in batch:
+                mark_collected(f"{resource}.yml")
+                logger.info("  + %s", resource)
+    else:
+        logger.debug("Batched get failed, fetching resources one at a time")
+        for resource in resources:
+            if run_kube_get(resource):
+                mark_collected(f"{resource}.yml")
+                logger.info("  + %s", resource)
+
+
+def collect_resource_snapshot():
+    """
+        Completes the resource snapshot with the events and the types
+        the API resources collection did not fetch as JSON, unless the
+        run deadline has passed, and writes it into resources.sqlite
+    """
+    snapshot = OPT.target.snapshot
+    for resource in SNAPSHOT_RESOURCES:
+        if OPT.watchdog.expired():
+            break
+        if resource not in snapshot.loaded and not stream_kube_items(
+                resource, lambda item, resource=resource: snapshot.add(resource, item)):
+            logger.debug("Resource %s not in the snapshot; this is probably"
+                         " fine, an item which doesn't exist in v4/v5", resource)
+    snapshot.close()
+    try:
+        with open(snapshot.file_name, "rb") as source, \
+                open_output("resources.sqlite") as file_pointer:
+            shutil.copyfileobj(source, file_pointer, STREAM_CHUNK_SIZE)
+    finally:
+        os.remove(snapshot.file_name)
+    logger.info("Collected resource snapshot: %s", ", ".join(
+        "{} {}".format(count, table) for table, count in snapshot.counts.items()))
+
+
+def stream_kube_items(resource_type, add):
+    """
+        Calls add() with each item of resource_type in the namespace, as
+        it is decoded from a JSON get, returns False when the get failed
+    """
+    if OPT.target.client is not None:
+        try:
+            return OPT.target.client.stream_list(resource_type, add) is not None
+        except (http.client.HTTPException, OSError, ValueError) as error:
+            logger.debug("REST client get failed: %s", error)
+            return False
+    cmd = OPT.kube_cli + " get {} {} -o json".format(resource_type,
+                                                     get_namespace_argument())
+    started = time.monotonic()
+    with OPT.limiter, tempfile.TemporaryFile() as errors:
+        handle = OPT.watchdog.start(cmd, OPT.call_timeout,
+                                    stdout=subprocess.PIPE, stderr=errors)
+        reader = JsonItemsReader(handle.stdout)
+        parse_error = None
+        try:
+            for item in reader:
+                add(item)
+        except ValueError as error:
+            parse_error = error
+        finally:
+            handle.stdout.close()
+            return_code = handle.wait()
+        errors.seek(0)
+        error = errors.read().decode('utf-8', 'replace')
+    record_operation(cmd, started, return_code, reader.size,
+                     timeout=handle.timed_out)
+    if return_code or parse_error:
+        logger.debug("Failed to get %s as JSON: %s", resource_type,
+                     str(parse_error or error).rstrip())
+    return return_code == 0
+
+
+def owner_of(item):
+    """
+        Returns the (kind, name) of the controller owning an API object,
+        else of its first owner, else (None, None)
+    """
+    owners = item["metadata"].get("ownerReferences") or []
+    for owner in sorted(owners, key=lambda owner: not owner.get("controller")):
+        return owner.get("kind"), owner.get("name")
+    return None, None
+
+
+def container_state(state):
+    """
+        Returns the (state, reason, started or finished time, exit code)
+        of a container status state
+    """
+    for name, details in (state or {}).items():
+        return (name, details.get("reason"),
+                details.get("startedAt") or details.get("finishedAt"),
+                details.get("exitCode"))
+    return None, None, None, None
+
 
-    for entry, out in resources_out.items():
-        with open(posixpath.join(OPT.output_dir, f"{entry}.yml"), "wb") as file_pointer:
-            file_pointer.write(out)
+class ResourceSnapshot():
+    """
+        SQLite database of the namespace resources, a row per pod,
+        container, pod volume, PVC, configmap, event and Postgres
+        resource, built in a temporary file as the items are fetched
+    """
+    def __init__(self):
+        handle, self.file_name = tempfile.mkstemp(suffix=".sqlite")
+        os.close(handle)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.file_name, check_same_thread=False)
+        self.db.executescript(SNAPSHOT_SCHEMA)
+        self.loaded = set()
+        self.counts = OrderedDict()
+
+    def add(self, resource, item):
+        """
+            Loads an item of one of the SNAPSHOT_RESOURCES
+        """
+        if resource not in SNAPSHOT_RESOURCES:
+            return
+        metadata = item["metadata"]
+        namespace = metadata.get("namespace")
+        owner = owner_of(item)
+        labels = json.dumps(metadata.get("labels") or {}, sort_keys=True)
+        rows = []
+        if resource == "pods":
+            spec, status = item.get("spec") or {}, item.get("status") or {}
+            rows.append(("pods", (namespace, metadata["name"], metadata.get("uid"),
+                                  spec.get("nodeName"), status.get("phase"),
+                                  status.get("podIP"), status.get("startTime"),
+                                  metadata.get("creationTimestamp")) + owner + (labels,)))
+            images = dict((container["name"], container.get("image"))
+                          for container in (spec.get("containers") or []) +
+                          (spec.get("initContainers") or []))
+            for init, key in ((0, "containerStatuses"), (1, "initContainerStatuses")):
+                for container in status.get(key) or []:
+                    state, reason, started, _ = container_state(container.get("state"))
+                    last, last_reason, finished, exit_code = container_state(
+                        container.get("lastState"))
+                    rows.append(("containers", (
+                        namespace, metadata["name"], container["name"], init,
+                        container.get("image") or images.get(container["name"]),
+                        int(bool(container.get("ready"))),
+                        container.get("restartCount", 0), state, reason, started,
+                        last, last_reason, exit_code, finished)))
+            for volume in spec.get("volumes") or []:
+                claim = (volume.get("persistentVolumeClaim") or {}).get("claimName")
+                config_map = (volume.get("configMap") or {}).get("name")
+                if claim or config_map:
+                    rows.append(("pod_volumes", (namespace, metadata["name"],
+                                                 volume["name"], claim, config_map)))
+        elif resource == "pvc":
+            spec, status = item.get("spec") or {}, item.get("status") or {}
+            rows.append(("pvcs", (
+                namespace, metadata["name"], status.get("phase"),
+                spec.get("volumeName"), spec.get("storageClassName"),
+                ((spec.get("resources") or {}).get("requests") or {}).get("storage"),
+                (status.get("capacity") or {}).get("storage"),
+                ",".join(spec.get("accessModes") or []),
+                metadata.get("creationTimestamp")) + owner + (labels,)))
+        elif resource == "configmap":
+            rows.append(("configmaps", (
+                namespace, metadata["name"], metadata.get("creationTimestamp"))
+                + owner + (labels, json.dumps(item.get("data") or {}, sort_keys=True))))
+        elif resource == "events":
+            involved = item.get("involvedObject") or {}
+            rows.append(("events", (
+                namespace, metadata["name"], item.get("type"), item.get("reason"),
+                item.get("message"), item.get("count"),
+                item.get("firstTimestamp") or item.get("eventTime"),
+                item.get("lastTimestamp") or item.get("eventTime"),
+                involved.get("kind"), involved.get("name"),
+                (item.get("source") or {}).get("host"))))
+        else:
+            rows.append(("postgres_crs", (
+                namespace, metadata["name"], item.get("kind"), item.get("apiVersion"),
+                metadata.get("creationTimestamp")) + owner + (
+                    labels, json.dumps(item.get("spec") or {}, sort_keys=True),
+                    json.dumps(item.get("status") or {}, sort_keys=True))))
+        with self.lock:
+            self.loaded.add(resource)
+            for table, row in rows:
+                self.db.execute("INSERT INTO {} VALUES ({})".format(
+                    table, ",".join("?" * len(row))), row)
+                self.counts[table] = self.counts.get(table, 0) + 1
+
+    def close(self):
+        """
+            Records what the snapshot is of and builds the indexes
+        """
+        with self.lock:
+            self.db.executemany("INSERT INTO snapshot VALUES (?, ?)", [
+                ("tool_version", __version__),
+                ("namespace", OPT.target.namespace),
+                ("context", OPT.target.context or ""),
+                ("collected", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()))])
+            self.db.executescript(SNAPSHOT_INDEXES)
+            self.db.commit()
+            self.db.close()
+
+
+def collect_watch_timeline():
+    """
+        Writes the changes recorded by the watch recorder
+    """
+    OPT.target.watch.write()
+
+
+class WatchRecorder():
+    """
+        Records the changes of the events and pods of the namespace
+        during the run, from kube cli watch streams started with it,
+        into ring buffers evicting by count and by age
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.handles = {}
+        self.threads = []
+        self.buffers = {}
+        self.pods = {}
+        self.evicted = 0
+
+    def start(self):
+        """
+            Starts the watch of the events and pods of the current target
+        """
+        for resource in ("events", "pods"):
+            self.buffers[resource] = deque(maxlen=WATCH_MAX_ENTRIES)
+            thread = threading.Thread(target=run_in_target, daemon=True,
+                                      args=(OPT.target, self.watch, resource))
+            thread.start()
+            self.threads.append(thread)
+
+    def watch(self, resource):
+        """
+            Reads the watch stream of resource, restarting it from the
+            last resourceVersion seen when the API server ends it
+        """
+        failures = 0
+        resource_version = None
+        while True:
+            cmd = self.watch_command(resource, resource_version)
+            with self.lock:
+                if self.stopped or OPT.watchdog.expired():
+                    return
+                handle = OPT.watchdog.start(cmd, stdout=subprocess.PIPE,
+                                            stderr=subprocess.DEVNULL)
+                self.handles[resource] = handle
+            started = time.monotonic()
+            changes = 0
+            try:
+                for value in JsonItemsReader(handle.stdout).values():
+                    if not isinstance(value, dict):
+                        continue
+                    if value.get("type") == "ERROR":
+                        # 410 Gone: the version is older than the history
+                        # the API server keeps, watch from now on again
+                        logger.debug("Watch of %s failed: %s", resource,
+                                     (value.get("object") or {}).get("message"))
+                        resource_version = None
+                        continue
+                    version = ((value.get("object") or {}).get("metadata")
+                               or {}).get("resourceVersion")
+                    if version:
+                        resource_version = version
+                    if value.get("type") != "BOOKMARK":
+                        self.add(resource, value)
+                        changes += 1
+            except ValueError as error:
+                logger.debug("Unreadable %s watch stream: %s", resource, error)
+            handle.stdout.close()
+            return_code = handle.wait()
+            record_operation(cmd, started, 0 if self.stopped else return_code,
+                             kind="watch", paced=False)
+            if self.stopped:
+                return
+            logger.debug("Watch of %s ended (exit code %s)", resource, return_code)
+            # API servers end watches after a few minutes, only streams
+            # ending early without any change count against the restarts
+            if changes or time.monotonic() - started >= WATCH_HEALTHY:
+                failures = 0
+            else:
+                failures += 1
+                if failures > WATCH_RESTARTS:
+                    break
+            backoff(failures)
+        logger.warning("Watch of %s failed, the timeline may miss changes",
+                       resource)
+
+    @staticmethod
+    def watch_command(resource, resource_version):
+        """
+            Returns the kube cli command watching resource, from
+            resource_version when set, or from now on
+        """
+        if resource_version is None:
+            return (OPT.kube_cli + " get {} {} --watch-only --output-watch-events"
+                    " -o json".format(resource, get_namespace_argument()))
+        # kube cli get has no resourceVersion option, the watch API is
+        # called directly, with the same stream of typed changes
+        path = "/api/v1/{}{}?{}".format(
+            "namespaces/{}/".format(OPT.target.namespace)
+            if OPT.target.namespace else "", resource,
+            urllib.parse.urlencode([("watch", "true"),
+                                    ("resourceVersion", resource_version),
+                                    ("allowWatchBookmarks", "true")]))
+        return OPT.kube_cli + " get --raw {} {}".format(
+            shlex.quote(path), get_context_argument())
+
+    def add(self, resource, value):
+        """
+            Adds a change read from the watch stream of resource
+        """
+        if not isinstance(value, dict) or not isinstance(value.get("object"), dict):
+            return
+        if resource == "events":
+            entry = summarize_event(value.get("type"), value["object"])
+        else:
+            entry = summarize_pod(value.get("type"), value["object"])
+        now = time.time()
+        with self.lock:
+            if resource == "pods":
+                # pods are modified by every status or annotation update,
+                # only the changes of the summarized state are kept
+                state = dict(entry, watch=None)
+                if self.pods.get(entry["object"]) == state:
+                    return
+                self.pods[entry["object"]] = state
+            buffer = self.buffers[resource]
+            if len(buffer) == buffer.maxlen:
+                self.evicted += 1
+            buffer.append((now, entry))
+            while buffer[0][0] < now - WATCH_MAX_AGE:
+                buffer.popleft()
+                self.evicted += 1
+
+    def stop(self):
+        """
+            Ends the watch streams
+        """
+        with self.lock:
+            self.stopped = True
+            for handle in self.handles.values():
+                if handle.poll() is None:
+                    ProcessWatchdog.kill(handle)
+        for thread in self.threads:
+            thread.join(WATCHDOG_INTERVAL * 4)
+
+    def write(self):
+        """
+            Writes watch_timeline.jsonl, the changes in time order
+        """
+        with self.lock:
+            entries = sorted((entry for buffer in self.buffers.values()
+                              for entry in buffer), key=lambda entry: entry[0])
+        with open_output("watch_timeline.jsonl") as file_pointer:
+            for observed, entry in entries:
+                line = OrderedDict([("observed", "{}.{:03d}Z".format(
+                    time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(observed)),
+                    int(observed % 1 * 1000)))])
+                line.update(entry)
+                file_pointer.write((json.dumps(line) + "\n").encode('utf-8'))
+        logger.info("Collected watch timeline of %d changes (%d evicted)",
+                    len(entries), self.evicted)
+
+
+def summarize_event(change, event):
+    """
+        Returns the timeline entry of a watched event
+    """
+    involved = event.get("involvedObject") or event.get("regarding") or {}
+    return OrderedDict([
+        ("source", "event"), ("watch", change),
+        ("time", event.get("lastTimestamp") or event.get("eventTime")
+         or event.get("metadata", {}).get("creationTimestamp")),
+        ("type", event.get("type")), ("reason", event.get("reason")),
+        ("object", "{}/{}".format(involved.get("kind"), involved.get("name"))),
+        ("count", event.get("count")), ("message", event.get("message"))])
+
+
+def summarize_pod(change, pod):
+    """
+        Returns the timeline entry of a watched pod: its phase, node,
+        and the state and restarts of its containers
+    """
+    status = pod.get("status", {})
+    containers = OrderedDict()
+    for container in status.get("containerStatuses") or []:
+        state = container.get("state") or {}
+        name = next(iter(state), "unknown")
+        reason = (state.get(name) or {}).get("reason")
+        containers[container.get("name")] = OrderedDict([
+            ("state", name + (":" + reason if reason else "")),
+            ("ready", container.get("ready")),
+            ("restarts", container.get("restartCount"))])
+    return OrderedDict([
+        ("source", "pod"), ("watch", change),
+        ("object", "Pod/{}".format(pod.get("metadata", {}).get("name"))),
+        ("phase", status.get("phase")),
+        ("node", pod.get("spec", {}).get("nodeName")),
+        ("containers", containers)])
 
 
 def collect_pods_describe():
@@ -256,23 +1319,39 @@ def collect_pods_logs():
         Collects all the pods logs from a given namespace
     """
     logger.info("Collecting pod logs:")
-    logs_dir = posixpath.join(OPT.output_dir, "pod_logs")
-    os.makedirs(logs_dir)
+    logs_dir = "pod_logs"
+    make_output_dir(logs_dir)
+    work = container_log_work(logs_dir)
+    if work is None:
+        return
+
+    failed = 0
+    for item, result in run_parallel(
+            lambda item: collect_container_log(logs_dir, *item), work):
+        failed += log_container_log_result(item, result)
+    logger.info("Collected %d container logs (%d failed) with %d worker(s)",
+                len(work) - failed, failed, min(OPT.jobs, len(work)) or 1)
 
-    pods = get_pods_v4() + get_op_pod()
+
+def container_log_work(logs_dir):
+    """
+        Returns the list of (pod, container) logs to collect, leaving out
+        those skipped by the size budget or kept from a resumed run,
+        None when the pods or their containers cannot be listed
+    """
+    pods = find_log_pods()
     if not pods:
-        logger.debug("No Pods found, trying PGO V5 methods...")
-        pods = get_pods_v5() + get_op_pod()
-        if not pods:
-            logger.warning("Could not get pods list - skipping automatic pod logs collection")
-            logger.error("########")
-            logger.error("#### You will need to collect these pod logs manually ####")
-            logger.error("########")
-            logger.warning("»HINT: Was the correct namespace used?")
-            logger.debug("This error sometimes happens when labels have been modified")
-            return
+        logger.warning("Could not get pods list - skipping automatic pod logs collection")
+        logger.error("########")
+        logger.error("#### You will need to collect these pod logs manually ####")
+        logger.error("########")
+        logger.warning("»HINT: Was the correct namespace used?")
+        logger.debug("This error sometimes happens when labels have been modified")
+        return None
 
     logger.info("Found and processing the following containers:")
+    work = []
+    skipped = resumed = 0
     for pod in pods:
         containers = get_containers(pod)
         if not containers:
@@ -283,263 +1362,2529 @@ def collect_pods_logs():
             logger.error("#### You will need to collect these pod logs manually ####")
             logger.error("########")
             logger.debug("This error sometimes happens when labels have been modified")
-            return
+            return None
         for cont in containers:
-            container = cont.rstrip()
-            cmd = (OPT.kube_cli + " logs {} {} -c {}".
-                   format(get_namespace_argument(), pod, container))
-            with open("{}/{}_{}.log".format(logs_dir, pod,
-                                            container), "wb") as file_pointer:
-                handle = subprocess.Popen(cmd, shell=True,
-                                          stdout=subprocess.PIPE,
-                                          stderr=subprocess.STDOUT)
-                while True:
-                    line = handle.stdout.readline()
-                    if line:
-                        file_pointer.write(line)
-                    else:
-                        break
-            logger.info("  + pod:%s, container:%s", pod, container)
+            if OPT.target.budget is not None and OPT.target.budget.limit(pod, cont.rstrip()) == 0:
+                skipped += 1
+                continue
+            if is_collected("{}/{}_{}.log".format(logs_dir, pod, cont.rstrip())):
+                resumed += 1
+                continue
+            work.append((pod, cont.rstrip()))
+    if resumed:
+        logger.info("Kept %d container logs collected before the resume", resumed)
+    if skipped:
+        logger.warning("Skipped %d container logs to fit the size budget", skipped)
+    return work
 
 
-def collect_pg_pod_details():
+def log_container_log_result(item, result):
     """
-        Collects PG pods details
+        Logs the outcome of a container log, returns 1 if it failed
     """
-    logger.info("Collecting PG pod details:")
-    logs_dir = posixpath.join(OPT.output_dir, "pg_pod_details")
-    os.makedirs(logs_dir)
+    (pod, container), (return_code, size) = item, result
+    if return_code:
+        logger.warning("  - pod:%s, container:%s (exit code %s, %s)",
+                       pod, container, return_code, sizeof_fmt(size))
+        return 1
+    logger.info("  + pod:%s, container:%s (%s)",
+                pod, container, sizeof_fmt(size))
+    return 0
 
-    pods = get_pg_pods_v4()
+
+def collect_logs_longest_first():
+    """
+        Collects the PG logs of each pod and the container logs as one
+        pool of work, in decreasing order of their planned size, so that
+        the largest transfers do not start last and decide the run time
+    """
+    logger.info("Collecting last %s PG logs and pod logs, largest first:",
+                OPT.pg_logs_count)
+    make_output_dir("pg_logs")
+    make_output_dir("pod_logs")
+    work = [("pg_logs", pod) for pod in find_pg_pods() or []]
+    work += [("pod_logs", pod, container)
+             for pod, container in container_log_work("pod_logs") or []]
+    work.sort(key=lambda item: OPT.target.budget.work_size(*item[1:]),
+              reverse=True)
+
+    def collect(item):
+        if item[0] == "pg_logs":
+            return collect_pod_pg_logs(*item)
+        return collect_container_log(*item)
+
+    failed = 0
+    for item, result in run_parallel(collect, work):
+        if item[0] == "pg_logs":
+            log_pg_logs_result(item[1], result)
+            failed += 1 if result[0] else 0
+        else:
+            failed += log_container_log_result(item[1:], result)
+    logger.info("Collected %d PG and container logs (%d failed) with %d"
+                " worker(s)", len(work) - failed, failed,
+                min(OPT.jobs, len(work)) or 1)
+
+
+def find_log_pods():
+    """
+        Returns list of pods names to collect container logs from:
+        PGO v4 pods, or PGO v5 pods, and the operator pod
+    """
+    pods = (get_pods_v4() or []) + (get_op_pod() or [])
     if not pods:
         logger.debug("No Pods found, trying PGO V5 methods...")
-        pods = get_pg_pods_v5()
-        if not pods:
-            logger.warning("Could not get pods list - skipping PG pod details collection")
-            logger.error("########")
-            logger.error("#### You will need to collect Postgres pod logs manually ####")
-            logger.error("########")
-            logger.warning("»HINT: Was the correct namespace used?")
-            logger.debug("This error sometimes happens when labels have been modified")
-            return
-
-    logger.info("Found and processing the following containers:")
-    for pod in pods:
-        containers = get_containers(pod)
-        for cont in containers:
-            container = cont.rstrip()
-            with open("{}/{}_{}.log".format(logs_dir, pod,
-                                            container), "ab+") as file_pointer:
-                for command in (CONTAINER_COMMANDS['all'] +
-                                CONTAINER_COMMANDS[container]):
-                    cmd = (OPT.kube_cli + " exec -it {} -c {} {} -- "
-                           "/bin/bash -c '{}'"
-                           .format(get_namespace_argument(),
-                                   container, pod, command))
-                    handle = subprocess.Popen(cmd, shell=True,
-                                              stdout=file_pointer.fileno(),
-                                              stderr=file_pointer.fileno())
-                    try: 
-                        out=handle.communicate(timeout=60)
-                    except subprocess.TimeoutExpired: 
-                        logger.warning("The output for " + cmd + " was not captured due to timeout")
-                        handle.kill()
-            logger.info("  + pod:%s, container:%s", pod, container)
+        pods = (get_pods_v5() or []) + (get_op_pod() or [])
+    return pods
 
 
-def collect_pg_logs():
+def find_pg_pods():
     """
-        Collects PG database server logs
+        Returns list of PGO v4 or, failing that, v5 database pods names
     """
-    logger.info("Collecting last %s PG logs "
-                "(may take a while)", OPT.pg_logs_count)
-    logs_dir = posixpath.join(OPT.output_dir, "pg_logs")
-    os.makedirs(logs_dir)
     pods = get_pg_pods_v4()
     if not pods:
         logger.debug("No Pods found, trying PGO V5 methods...")
         pods = get_pg_pods_v5()
-        if not pods:
-            logger.warning("Could not get pods list - skipping pods logs collection")
-            logger.error("########")
-            logger.error("#### You will need to collect these Postgres logs manually ####")
-            logger.error("########")
-            logger.warning("»HINT: Was the correct namespace used?")
-            logger.debug("This error sometimes happens when labels have been modified")
-            return
-
-    logger.info("Found and processing the following containers:")
-    for pod in pods:
-        tgt_file = "{}/{}".format(logs_dir, pod)
-        os.makedirs(tgt_file)
-        # print("OPT.pg_logs_count:  ", OPT.pg_logs_count)
-        cmd = (OPT.kube_cli +
-               " exec -it {} -c database {} -- /bin/bash -c"
-               " 'ls -1dt /pgdata/*/pglogs/* | head -{}'"
-               .format(get_namespace_argument(), pod, OPT.pg_logs_count))
-        # print(cmd)
-        handle = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
-                                  stderr=subprocess.STDOUT)
-        while True:
-            line = handle.stdout.readline()
-            if line:
-                cmd = (OPT.kube_cli +
-                       " cp -c database {} {}:{} {}"
-                       .format(get_namespace_argument(),
-                               pod, line.rstrip().decode('UTF-8'),
-                               tgt_file + line.rstrip().decode('UTF-8')))
-                handle2 = subprocess.Popen(cmd, shell=True,
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.STDOUT)
-                handle2.wait()
-            else:
-                break
-        logger.info("  + pod:%s", pod)
+    return pods
 
 
-def sizeof_fmt(num, suffix="B"):
+def collect_container_log(logs_dir, pod, container):
     """
-        Formats the file size in a human-readable format
-        Probably overkill to go to Zi range, but reusable
+        Streams the log of a single container into its own file
+        Returns a tuple of the kube cli exit code, bytes written
     """
-    for unit in ["", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"]:
-        if abs(num) < 1024.0:
-            return f"{num:3.1f}{unit}{suffix}"
-        num /= 1024.0
-    return f"{num:.1f}Yi{suffix}"
+    since = started = None
+    options = OrderedDict()
+    if OPT.target.state is not None:
+        since = OPT.target.state.container_since(pod, container)
+        started = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        if since:
+            options["sinceTime"] = since
+    if OPT.since is not None:
+        options["sinceTime"] = time.strftime("%Y-%m-%dT%H:%M:%SZ",
+                                             time.gmtime(OPT.since))
+    if OPT.until is not None:
+        # lines are cut at the first one past --until by their timestamp
+        options["timestamps"] = "true"
+    limit = None
+    if OPT.target.budget is not None:
+        limit = OPT.target.budget.limit(pod, container)
+        if limit is not None:
+            # limitBytes would count from the start of the tail and cut
+            # the newest lines: enough lines are asked for to fill limit
+            # unless they are very short, and trimmed to limit locally
+            options["tailLines"] = max(limit // BUDGET_LINE_SIZE, 1)
 
+    if OPT.target.client is not None:
+        return_code, size = rest_container_log(logs_dir, pod, container,
+                                               options, limit)
+    else:
+        cmd = (OPT.kube_cli + " logs {} {} -c {}".
+               format(get_namespace_argument(), pod, container))
+        for option, value in options.items():
+            cmd += " {}={}".format(LOG_OPTION_FLAGS[option], value)
+        size = 0
+        op_started = time.monotonic()
+        with OPT.limiter, open_output(
+                "{}/{}_{}.log".format(logs_dir, pod, container),
+                log_file=True) as file_pointer, \
+                tempfile.TemporaryFile() as errors:
+            # a log transfer takes as long as its size needs, only the
+            # run deadline bounds it; with --until, errors are kept apart
+            # from the timestamped lines
+            handle = OPT.watchdog.start(cmd, None,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT
+                                        if OPT.until is None else errors)
+            ended = False
+            tail = LogTail(file_pointer, limit)
+            while True:
+                line = handle.stdout.readline()
+                if line and OPT.until is not None:
+                    line = until_line(line)
+                    if line is None:
+                        OPT.watchdog.stop(handle)
+                        ended = True
+                        break
+                if line:
+                    tail.write(line)
+                else:
+                    break
+            size = tail.close()
+            return_code = 0 if ended else handle.wait()
+            if return_code and OPT.until is not None:
+                errors.seek(0)
+                file_pointer.write(errors.read())
+        if handle.timed_out:
+            logger.warning("Log of %s/%s cut at the run deadline", pod, container)
+            return_code = EXEC_TIMEOUT_CODE
+        record_operation(cmd, op_started, return_code, size,
+                         timeout=handle.timed_out, transfer=True)
 
-def archive_files():
+    if return_code == 0:
+        mark_collected("{}/{}_{}.log".format(logs_dir, pod, container))
+    if OPT.target.state is not None and return_code == 0:
+        OPT.target.state.mark_container(pod, container, since, started)
+    return return_code, size
+
+
+def rest_container_log(logs_dir, pod, container, options=None, limit=None):
     """
-        Create an archive and compress it
+        collect_container_log() over the REST client connection pool
     """
-    archive_file_size = 0
-    file_name = OPT.output_dir + ".tar.gz"
+    size = 0
+    with OPT.limiter, open_output(
+            "{}/{}_{}.log".format(logs_dir, pod, container),
+            log_file=True) as file_pointer:
+        tail = LogTail(file_pointer, limit)
+        try:
+            response = OPT.target.client.pod_log(pod, container, options)
+            while True:
+                if OPT.until is not None:
+                    chunk = until_line(response.readline())
+                elif limit is not None:
+                    chunk = response.readline()
+                else:
+                    chunk = response.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                tail.write(chunk)
+                size += len(chunk)
+            OPT.target.client.release(response, size)
+        except (http.client.HTTPException, OSError) as error:
+            tail.close()
+            file_pointer.write(str(error).encode('utf-8'))
+            return 1, size
+        size = tail.close()
+    return (0 if response.status == 200 else 1), size
 
-    with tarfile.open(file_name, "w|gz") as tar:
-        tar.add(OPT.output_dir, arcname=OPT.dir_name)
-    logger.info("")
 
-    # Let user choose to delete the files manually
+class LogTail():
+    """
+        Writes a container log to file_pointer, or with limit only its
+        last whole lines that fit in limit bytes, kept in memory until
+        close
+    """
+    def __init__(self, file_pointer, limit=None):
+        self.file_pointer = file_pointer
+        self.limit = limit
+        self.lines = deque()
+        self.size = 0
 
-    if OPT.delete_dir:
-        rtn, out = run_shell_command(f"rm -rf {OPT.output_dir}")
-        if rtn:
-            logger.warning('Failed to delete directory after archiving: %s',
-                           out)
-            logger.info("support dump files saved at %s", OPT.output_dir)
-    try:
-        archive_file_size = os.stat(file_name).st_size
-        logger.info("┌──────────────────────────────────────────────────────────────────-")
-        logger.info("│ Archive file saved to: %s ", file_name)
-        if archive_file_size > MAX_ARCHIVE_EMAIL_SIZE:
-            logger.info("│ Archive file (%d) may be too big to email.",
-                        sizeof_fmt(archive_file_size))
-            logger.info("│ Please request file share link by"
-                        " emailing support@crunchydata.com")
-        else:
-            logger.info("│ Archive file size: %s ", sizeof_fmt(archive_file_size))
-            logger.info("│ Email the support dump to support@crunchydata.com")
-            logger.info("│ or attach as a email reply to your existing Support Ticket")
-        logger.info("└──────────────────────────────────────────────────────────────────-")
-    except (OSError, ValueError) as e:  # pylint: disable=invalid-name
-        logger.warning("Archive file size: NA --- %s", e)
+    def write(self, line):
+        """
+            Writes a line, or keeps it among the last ones
+        """
+        self.size += len(line)
+        if self.limit is None:
+            self.file_pointer.write(line)
+            return
+        self.lines.append(line)
+        while self.size > self.limit:
+            self.size -= len(self.lines.popleft())
 
+    def close(self):
+        """
+            Writes the lines kept, returns the bytes written
+        """
+        while self.lines:
+            self.file_pointer.write(self.lines.popleft())
+        return self.size
 
-def get_pods_v4():
+
+def until_line(line):
     """
-        Returns list of pods names, all pods
+        Returns a container log line read with timestamps without its
+        timestamp, None once past --until; lines that do not start with
+        a timestamp are returned as they are
     """
-    cmd = (OPT.kube_cli + " get pod {} -lvendor=crunchydata "
-           "-o=custom-columns=NAME:.metadata.name "
-           "--no-headers".format(get_namespace_argument()))
-    return_code, out = run_shell_command(cmd)
-    if return_code == 0:
-        return out.decode("utf-8").split("\n")[:-1]
-    logger.warning("Failed to get pods: %s", out)
-    return None
+    match = LOG_LINE_STAMP_RE.match(line)
+    if not match:
+        return line
+    moment = calendar.timegm(time.strptime(match.group(1).decode('ascii'),
+                                           "%Y-%m-%dT%H:%M:%S"))
+    if match.group(2) not in (b"Z", b"z"):
+        sign = -1 if match.group(2)[:1] == b"+" else 1
+        moment += sign * (int(match.group(2)[1:3]) * 3600 +
+                          int(match.group(2)[4:6]) * 60)
+    if moment > OPT.until:
+        return None
+    return line[match.end():]
 
 
-def get_pods_v5():
+def run_parallel(func, items):
     """
-        Returns list of pods names, all pods
+        Runs func over items with up to OPT.jobs worker threads, in the
+        target of the calling thread
+        Yields (item, result) tuples as each item completes; with a
+        single worker the items are processed sequentially, in order
+        Items not started by the run deadline are skipped
     """
-    cmd = (OPT.kube_cli + " get pod {} "
-           "-lpostgres-operator.crunchydata.com/cluster "
-           "-o=custom-columns=NAME:.metadata.name "
-           "--no-headers".format(get_namespace_argument()))
-    return_code, out = run_shell_command(cmd)
-    if return_code == 0:
-        return out.decode("utf-8").split("\n")[:-1]
-    logger.warning("Failed to get pods: %s", out)
-    return None
+    if OPT.jobs <= 1 or len(items) <= 1:
+        for done, item in enumerate(items):
+            if OPT.watchdog.expired():
+                logger.warning("Run deadline reached, skipped %d of %d",
+                               len(items) - done, len(items))
+                return
+            yield item, func(item)
+        return
 
+    target = OPT.target
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=min(OPT.jobs, len(items))) as pool:
+        futures = {pool.submit(run_in_target, target, func, item): item
+                   for item in items}
+        for future in as_completed(futures):
+            if future.cancelled():
+                skipped += 1
+                continue
+            yield futures[future], future.result()
+            if OPT.watchdog.expired():
+                for pending in futures:
+                    pending.cancel()
+    if skipped:
+        logger.warning("Run deadline reached, skipped %d of %d",
+                       skipped, len(items))
 
-def get_op_pod():
+
+def collect_pg_pod_details():
     """
-        Returns just the operator pod
+        Collects PG pods details
     """
-    cmd = (OPT.kube_cli + " get pod {} "
-           "-lapp.kubernetes.io/name=postgres-operator "
-           "-o=custom-columns=NAME:.metadata.name "
-           "--no-headers".format(get_namespace_argument()))
-    return_code, out = run_shell_command(cmd)
-    if return_code == 0:
-        return out.decode("utf-8").split("\n")[:-1]
-    logger.warning("Failed to get pods: %s", out)
-    return None
+    logger.info("Collecting PG pod details:")
+    logs_dir = "pg_pod_details"
+    make_output_dir(logs_dir)
+
+    pods = find_pg_pods()
+    if not pods:
+        logger.warning("Could not get pods list - skipping PG pod details collection")
+        logger.error("########")
+        logger.error("#### You will need to collect Postgres pod logs manually ####")
+        logger.error("########")
+        logger.warning("»HINT: Was the correct namespace used?")
+        logger.debug("This error sometimes happens when labels have been modified")
+        return
+
+    logger.info("Found and processing the following containers:")
+    work = []
+    for pod in pods:
+        containers = get_containers(pod) or []
+        for cont in containers:
+            if is_collected("{}/{}_{}.log".format(logs_dir, pod, cont.rstrip())):
+                logger.info("  + pod:%s, container:%s (resumed)", pod, cont.rstrip())
+                continue
+            work.append((pod, cont.rstrip()))
 
+    for (pod, container), results in run_parallel(
+            lambda item: collect_container_details(logs_dir, *item), work):
+        failed = ["{} (exit code {})".format(command, return_code)
+                  for command, return_code, _ in results if return_code]
+        if failed:
+            logger.warning("  - pod:%s, container:%s: %s", pod, container,
+                           ", ".join(failed))
+        else:
+            logger.info("  + pod:%s, container:%s (%d commands)",
+                        pod, container, len(results))
 
-def get_pg_pods_v4():
+
+def collect_container_details(logs_dir, pod, container):
     """
-        Returns list of pods names, only DB pods
+        Runs all detail commands of a container in one exec session
+        Each command is delimited in the output by BEGIN/END markers
+        carrying its exit code and elapsed time
+        Returns a list of (command, exit code, elapsed ms) tuples
     """
-    cmd = (OPT.kube_cli + " get pod {} "
-           "-lpgo-pg-database=true,vendor=crunchydata "
-           "-o=custom-columns=NAME:.metadata.name "
-           "--no-headers".format(get_namespace_argument()))
-    return_code, out = run_shell_command(cmd)
-    if return_code == 0:
-        return out.decode("utf-8").split("\n")[:-1]
-    logger.warning("Failed to get pods: %s", out)
-    return None
+    commands = (CONTAINER_COMMANDS['all'] +
+                CONTAINER_COMMANDS.get(container, []))
+    cmd = (OPT.kube_cli + " exec {} -c {} {} -- /bin/bash -c {}"
+           .format(get_namespace_argument(), container, pod,
+                   shlex.quote(build_exec_script(commands, OPT.exec_timeout))))
+    results = []
+    op_started = time.monotonic()
+    with OPT.limiter, open_output(
+            "{}/{}_{}.log".format(logs_dir, pod, container)) as file_pointer:
+        # the in-pod timeout bounds each command; this bounds the session
+        handle = OPT.watchdog.start(cmd, OPT.exec_timeout * len(commands) + 30,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+        size = 0
+        for line in handle.stdout:
+            file_pointer.write(line)
+            size += len(line)
+            match = EXEC_END_RE.match(line)
+            if match:
+                index = int(match.group(1)) - 1
+                results.append((commands[index], int(match.group(2)),
+                                int(match.group(3))))
+        return_code = handle.wait()
 
+    record_operation(cmd, op_started, return_code, size, transfer=True,
+                     timeout=len(results) < len(commands) or any(
+                         result[1] == EXEC_TIMEOUT_CODE for result in results))
+    if len(results) == len(commands) and not any(
+            result[1] == EXEC_TIMEOUT_CODE for result in results):
+        mark_collected("{}/{}_{}.log".format(logs_dir, pod, container))
+    for command in commands[len(results):]:
+        # commands that never reported: the session failed or timed out
+        results.append((command, return_code or EXEC_TIMEOUT_CODE, None))
+    for command, return_code, _ in results:
+        if return_code == EXEC_TIMEOUT_CODE:
+            logger.warning("The output for %s in %s/%s was not captured"
+                           " due to timeout", command, pod, container)
+    return results
 
-def get_pg_pods_v5():
+
+def build_exec_script(commands, timeout):
     """
-        Returns list of pods names, only DB pods
+        Returns a bash script running commands one after the other,
+        each with its own timeout when the container has timeout(1)
     """
-    cmd = (OPT.kube_cli + " get pod {} "
-           "-lpostgres-operator.crunchydata.com/cluster "
-           "-o=custom-columns=NAME:.metadata.name "
-           "--no-headers".format(get_namespace_argument()))
-    return_code, out = run_shell_command(cmd)
-    if return_code == 0:
-        return out.decode("utf-8").split("\n")[:-1]
-    logger.warning("Failed to get pods: %s", out)
-    return None
+    parts = ["t=; command -v timeout >/dev/null && t='timeout {}'".format(timeout)]
+    for index, command in enumerate(commands, 1):
+        parts.append(
+            "printf '##### BEGIN [%s] %s\\n' {index} {quoted}; "
+            "s=$(date +%s%N); $t /bin/bash -c {quoted} 2>&1; rc=$?; "
+            "e=$(date +%s%N); printf '##### END [%s] exit_code=%s "
+            "elapsed_ms=%s\\n' {index} $rc $(( (e - s) / 1000000 ))"
+            .format(index=index, quoted=shlex.quote(command)))
+    return "; ".join(parts)
 
 
-def get_containers(pod_name):
+def collect_pg_samples():
+    """
+        Samples the statistics views of all the PG pods over the same
+        period, one psql session per pod
+    """
+    logger.info("Sampling PG statistics for %ss every %ss:",
+                OPT.pg_sample, OPT.pg_sample_interval)
+    logs_dir = "pg_samples"
+    make_output_dir(logs_dir)
+    pods = find_pg_pods()
+    if not pods:
+        logger.warning("Could not get pods list - skipping PG sampling")
+        return
+
+    # every pod is sampled at once, outside of the call limiter: the
+    # sessions are idle between samples
+    target = OPT.target
+    with ThreadPoolExecutor(max_workers=len(pods)) as pool:
+        futures = {pool.submit(run_in_target, target, sample_pod_stats,
+                               logs_dir, pod): pod for pod in pods}
+        for future in as_completed(futures):
+            samples, errors = future.result()
+            if samples:
+                logger.info("  + pod:%s (%d samples)", futures[future], samples)
+            else:
+                logger.warning("  - pod:%s: %s", futures[future],
+                               errors[-1] if errors else "no samples")
+
+
+def sample_pod_stats(logs_dir, pod):
+    """
+        Takes the samples of a pod in a single psql session: the SQL of
+        each sample is sent when it is due and the output spooled to a
+        temporary file, then turned into CSV series
+        Returns a tuple of the number of samples and the psql errors
+    """
+    cmd = (OPT.kube_cli + " exec -i {} -c database {} -- psql -X -A -t -z"
+           " -v ON_ERROR_STOP=0 -f -".format(get_namespace_argument(), pod))
+    count = max(int(OPT.pg_sample // OPT.pg_sample_interval), 1)
+    op_started = time.monotonic()
+    with tempfile.TemporaryFile() as output, tempfile.TemporaryFile() as errors:
+        handle = OPT.watchdog.start(
+            cmd, OPT.pg_sample + OPT.call_timeout, stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE, stderr=errors)
+        reader = threading.Thread(target=shutil.copyfileobj,
+                                  args=(handle.stdout, output), daemon=True)
+        reader.start()
+        try:
+            handle.stdin.write(PG_SAMPLE_SETUP.encode('utf-8'))
+            for index in range(count):
+                delay = op_started + index * OPT.pg_sample_interval - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                if OPT.watchdog.expired() or handle.poll() is not None:
+                    break
+                handle.stdin.write(build_sample_script().encode('utf-8'))
+                handle.stdin.flush()
+            handle.stdin.write(PG_SAMPLE_STATEMENTS.encode('utf-8'))
+            handle.stdin.close()
+        except OSError:
+            # psql exited, its errors tell why
+            pass
+        reader.join()
+        handle.stdout.close()
+        return_code = handle.wait()
+        size = output.tell()
+        output.seek(0)
+        samples = write_pg_samples(logs_dir, pod, output)
+        errors.seek(0)
+        messages = errors.read().decode('utf-8', 'replace').splitlines()
+    record_operation(cmd, op_started, return_code, size,
+                     timeout=handle.timed_out, paced=False)
+    with open_output("{}/{}/samples.json".format(logs_dir, pod)) as file_pointer:
+        file_pointer.write(json.dumps(OrderedDict([
+            ("pod", pod), ("interval", OPT.pg_sample_interval),
+            ("samples", samples["count"]), ("started", samples["started"]),
+            ("ended", samples["ended"]), ("exit_code", return_code),
+            ("errors", messages[:50])]), indent=2).encode('utf-8'))
+    return samples["count"], messages
+
+
+def build_sample_script():
+    """
+        Returns the psql input of one sample: a marker and the time of
+        the sample, then each query preceded by a marker
+    """
+    parts = ["\\echo '##### sample'",
+             "SELECT extract(epoch FROM clock_timestamp());"]
+    for name, _, condition, sql in PG_SAMPLE_QUERIES:
+        parts.append("\\echo '##### {}'".format(name))
+        if condition:
+            parts += ["\\if :" + condition, sql + ";", "\\endif"]
+        else:
+            parts.append(sql + ";")
+    return "\n".join(parts) + "\n"
+
+
+def write_pg_samples(logs_dir, pod, output):
+    """
+        Turns the psql output of a sampling session into one CSV file
+        per query, and counters.csv with the delta and the per second
+        rate of each cumulative counter since the previous sample; the
+        counters that did not change are left out after the first one
+        Returns a dict of the number, first and last time of the samples
+    """
+    columns = {name: names for name, names, _, _ in PG_SAMPLE_QUERIES if names}
+    files = OrderedDict()
+    row_buffer = io.StringIO()
+    row_writer = csv.writer(row_buffer, lineterminator="\n")
+
+    def write_row(name, header, row):
+        if name not in files:
+            files[name] = open_output("{}/{}/{}.csv".format(logs_dir, pod, name))
+            write_row(name, None, header)
+        row_writer.writerow(row)
+        files[name].write(row_buffer.getvalue().encode('utf-8'))
+        row_buffer.seek(0)
+        row_buffer.truncate()
+
+    samples = {"count": 0, "started": None, "ended": None}
+    previous = {}
+    section = stamp = None
+    try:
+        for line in output:
+            line = line.rstrip(b"\n").decode('utf-8', 'replace')
+            if line.startswith("##### "):
+                section = line[len("##### "):]
+                continue
+            if not line:
+                continue
+            fields = line.split("\0")
+            if section == "sample":
+                stamp = float(fields[0])
+                samples["count"] += 1
+                samples["started"] = samples["started"] or stamp
+                samples["ended"] = stamp
+            elif section == "statement_text":
+                write_row("statements", ["queryid", "query"], fields[:2])
+            elif section in columns:
+                write_row(section, ["time", "sample"] + columns[section],
+                          [round(stamp, 3), samples["count"]] + fields)
+            elif stamp is not None and len(fields) == 3:
+                try:
+                    value = float(fields[2])
+                except ValueError:
+                    continue
+                key = (fields[0], fields[1])
+                last = previous.get(key)
+                previous[key] = (stamp, value)
+                if last is None:
+                    delta = rate = ""
+                else:
+                    delta = value - last[1]
+                    if not delta:
+                        continue
+                    rate = (round(delta / (stamp - last[0]), 3)
+                            if stamp > last[0] else "")
+                write_row("counters", ["time", "sample", "object", "counter",
+                                       "value", "delta", "rate_per_second"],
+                          [round(stamp, 3), samples["count"], fields[0],
+                           fields[1], fields[2], delta, rate])
+    finally:
+        for file_pointer in files.values():
+            file_pointer.close()
+    return samples
+
+
+def collect_pg_logs():
+    """
+        Collects PG database server logs
+    """
+    logger.info("Collecting last %s PG logs "
+                "(may take a while)", OPT.pg_logs_count)
+    logs_dir = "pg_logs"
+    make_output_dir(logs_dir)
+    pods = find_pg_pods()
+    if not pods:
+        logger.warning("Could not get pods list - skipping pods logs collection")
+        logger.error("########")
+        logger.error("#### You will need to collect these Postgres logs manually ####")
+        logger.error("########")
+        logger.warning("»HINT: Was the correct namespace used?")
+        logger.debug("This error sometimes happens when labels have been modified")
+        return
+
+    logger.info("Found and processing the following containers:")
+    for pod, result in run_parallel(
+            lambda pod: collect_pod_pg_logs(logs_dir, pod), pods):
+        log_pg_logs_result(pod, result)
+
+
+def log_pg_logs_result(pod, result):
+    """
+        Logs the outcome of the PG logs transfer of a pod
+    """
+    return_code, files, size = result
+    if return_code:
+        logger.warning("  - pod:%s (exit code %s, %d files, %s)",
+                       pod, return_code, files, sizeof_fmt(size))
+    else:
+        logger.info("  + pod:%s (%d files, %s)", pod, files, sizeof_fmt(size))
+
+
+def collect_pod_pg_logs(logs_dir, pod):
+    """
+        Collects the newest PG log files of a pod in one exec session
+        Returns a tuple of the exit code, files and bytes collected
+    """
+    tgt_dir = "{}/{}".format(logs_dir, pod)
+    make_output_dir(tgt_dir)
+    window = OPT.since is not None or OPT.until is not None
+    if (OPT.target.state is None and OPT.target.budget is None and not window
+            and not (OPT.resume is not None and OPT.resume.resumed)):
+        return stream_pod_files(pod, "database",
+                                PG_LOGS_LIST_CMD.format(OPT.pg_logs_count),
+                                tgt_dir)
+
+    listing = OPT.target.budget.pg_logs.get(pod) if OPT.target.budget is not None else None
+    if listing is None:
+        listing = list_pod_pg_logs(pod)
+    if listing is None:
+        return 1, 0, 0
+    state = OPT.target.state
+    new_files = []
+    tail_files = tail_size = 0
+    return_code = 0
+    for size, mtime, path, inode, head in listing:
+        offset = 0
+        if state is not None:
+            offset = state.pg_log_offset(pod, path, size, mtime, inode, head)
+            if offset is None:
+                logger.debug("Skipping unchanged pg log %s:%s", pod, path)
+                continue
+        limit = None
+        if OPT.target.budget is not None:
+            limit = OPT.target.budget.limit(pod, path)
+            if limit == 0:
+                continue
+            if limit is not None and size - offset > limit:
+                offset = size - limit
+        # the checkpoint of a file is only moved once it was copied, a
+        # failed transfer is retried by the next incremental run
+        checkpoint = (pod, path, offset, size, mtime, inode, head)
+        if window:
+            if not is_collected(tgt_dir + path):
+                copy_code, copied = window_from_pod(pod, "database", path,
+                                                    tgt_dir + path, limit)
+                if copy_code:
+                    return_code = copy_code
+                    continue
+                tail_size += copied
+                tail_files += 1
+        elif is_collected(tgt_dir + path, size - offset):
+            logger.debug("Keeping pg log %s:%s collected before the resume",
+                         pod, path)
+        elif offset == 0:
+            new_files.append(checkpoint)
+            continue
+        else:
+            copy_code = tail_from_pod(pod, "database", path, offset, tgt_dir + path)
+            if copy_code:
+                return_code = copy_code
+                continue
+            tail_files += 1
+            tail_size += size - offset
+        if state is not None:
+            state.mark_pg_log(*checkpoint)
+    if not new_files:
+        return return_code, tail_files, tail_size
+    stream_code, files, size = stream_pod_files(
+        pod, "database",
+        "printf '%s\\n' " + " ".join(shlex.quote(checkpoint[1])
+                                      for checkpoint in new_files),
+        tgt_dir)
+    if stream_code == 0 and state is not None:
+        for checkpoint in new_files:
+            state.mark_pg_log(*checkpoint)
+    return stream_code or return_code, files + tail_files, size + tail_size
+
+
+def list_pod_pg_logs(pod):
+    """
+        Returns list of (size, mtime, path, inode, head) of the newest PG
+        log files of a pod, or with --since/--until of those overlapping
+        the time window, newest first, or None on failure; head is the
+        checksum of the first PG_LOG_HEAD_SIZE bytes, which tells a file
+        truncated on rotation and grown again from one that only grew
+    """
+    window = OPT.since is not None or OPT.until is not None
+    list_cmd = PG_LOGS_LIST_CMD.format(OPT.pg_logs_count)
+    if window:
+        list_cmd = list_cmd.split(" | head")[0]
+    cmd = (OPT.kube_cli +
+           " exec {} -c database {} -- /bin/bash -c {}"
+           .format(get_namespace_argument(), pod,
+                   shlex.quote(list_cmd + PG_LOGS_STAT_CMD.format(PG_LOG_HEAD_SIZE))))
+    return_code, out = run_shell_command(cmd, merge_stderr=False)
+    if return_code:
+        logger.warning("Failed to list pg logs of %s: %s", pod,
+                       out.decode('utf-8').rstrip())
+        return None
+    listing = []
+    for line in out.decode('UTF-8').splitlines():
+        size, mtime, inode, head, path = line.split(" ", 4)
+        listing.append((int(size), int(mtime), path, inode, head))
+    if window:
+        # a file holds the lines written after the previous one was last
+        # modified, up to its own mtime
+        listing = [entry for entry, older in zip(listing, listing[1:] + [None])
+                   if (OPT.since is None or entry[1] >= OPT.since)
+                   and (OPT.until is None or older is None or older[1] < OPT.until)]
+    return listing
+
+
+def stream_pod_files(pod, container, list_cmd, tgt_dir):
+    """
+        Transfers the files listed by list_cmd in a pod container as a
+        single tar stream, compressed in the pod when gzip is there,
+        unpacking each file under tgt_dir as it arrives
+        Returns a tuple of the exit code, files and bytes collected
+    """
+    script = ("set -o pipefail; files=$({}); [ -n \"$files\" ] || exit 0; "
+              "printf '%s\\n' \"$files\" | sed 's|^/||' | tar -C / -cf - -T - | "
+              "if command -v gzip >/dev/null; then gzip -1; else cat; fi"
+              .format(list_cmd))
+    cmd = (OPT.kube_cli +
+           " exec {} -c {} {} -- /bin/bash -c {}"
+           .format(get_namespace_argument(), container, pod,
+                   shlex.quote(script)))
+    files = size = 0
+    op_started = time.monotonic()
+    with OPT.limiter, tempfile.TemporaryFile() as errors:
+        # no call timeout for a transfer, only the run deadline
+        handle = OPT.watchdog.start(cmd, None,
+                                    stdout=subprocess.PIPE, stderr=errors)
+        try:
+            with tarfile.open(fileobj=handle.stdout, mode="r|*") as tar:
+                for member in tar:
+                    name = posixpath.normpath(member.name)
+                    if not member.isfile() or name.startswith(("/", "..")):
+                        continue
+                    with open_output(posixpath.join(tgt_dir, name),
+                                     log_file=True) as file_pointer:
+                        shutil.copyfileobj(tar.extractfile(member), file_pointer)
+                    mark_collected(posixpath.join(tgt_dir, name), member.size)
+                    files += 1
+                    size += member.size
+        except (tarfile.ReadError, EOFError) as error:
+            # an empty stream just means there was nothing to copy
+            if files or handle.timed_out:
+                logger.warning("Truncated tar stream from %s: %s", pod, error)
+        handle.stdout.close()
+        return_code = handle.wait()
+        if handle.timed_out:
+            return_code = EXEC_TIMEOUT_CODE
+        record_operation(cmd, op_started, return_code, size,
+                         timeout=handle.timed_out, transfer=True)
+        if return_code:
+            errors.seek(0)
+            logger.debug("Failed to stream files from %s: %s", pod,
+                         errors.read().decode('utf-8', 'replace').rstrip())
+    return return_code, files, size
+
+
+def tail_from_pod(pod, container, remote_path, offset, file_name):
+    """
+        Copies the bytes of a pod container file after offset
+        Returns the exit code of the copy
+    """
+    return copy_pod_output(pod, container,
+                           "tail -c +{} {}".format(offset + 1,
+                                                 shlex.quote(remote_path)),
+                           remote_path, file_name)[0]
+
+
+def window_from_pod(pod, container, remote_path, file_name, limit=None):
+    """
+        Copies the lines of a pod container PG log file in the
+        --since/--until window, their last limit bytes if given
+        Returns a tuple of the exit code and the bytes copied
+    """
+    stamps = ["" if moment is None else
+              time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(moment))
+              for moment in (OPT.since, OPT.until)]
+    script = PG_LOG_WINDOW_CMD.format(shlex.quote(stamps[0]), shlex.quote(stamps[1]),
+                                      shlex.quote(remote_path))
+    if limit is not None:
+        script += " | tail -c {}".format(limit)
+    return copy_pod_output(pod, container, "/bin/bash -c " + shlex.quote(script),
+                           remote_path, file_name)
+
+
+def copy_pod_output(pod, container, command, remote_path, file_name):
+    """
+        Copies the output of a command run in a pod container reading
+        remote_path into file_name
+        Returns a tuple of the exit code and the bytes copied
+    """
+    cmd = (OPT.kube_cli +
+           " exec {} -c {} {} -- {}"
+           .format(get_namespace_argument(), container, pod, command))
+    op_started = time.monotonic()
+    size = 0
+    with OPT.limiter, open_output(file_name, log_file=True) as file_pointer, \
+            tempfile.TemporaryFile() as errors:
+        # no call timeout for a transfer, only the run deadline
+        handle = OPT.watchdog.start(cmd, None,
+                                    stdout=subprocess.PIPE, stderr=errors)
+        while True:
+            chunk = handle.stdout.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            file_pointer.write(chunk)
+            size += len(chunk)
+        handle.wait()
+        errors.seek(0)
+        err = errors.read()
+    record_operation(cmd, op_started, handle.returncode, size,
+                     timeout=handle.timed_out, transfer=True)
+    if handle.returncode:
+        logger.warning("Failed to copy %s:%s: %s", pod, remote_path,
+                       err.decode('utf-8').rstrip())
+    else:
+        mark_collected(file_name, size)
+    return handle.returncode, size
+
+
+class SizeBudget():
+    """
+        Plans the log collection so that the archive fits max_size
+        Container and PG log sizes are estimated up front, then the
+        budget left after the metadata is given to the logs by
+        diagnostic priority; logs that do not fit are tailed or skipped
+        With no max_size, only the estimates are made, to schedule the
+        largest logs first
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.metadata_size = 0
+        self.pg_logs = {}
+        self.items = []
+        self.limits = {}
+
+    def plan(self):
+        """
+            Estimates the log sizes and allots the remaining budget
+        """
+        self.metadata_size = collected_size()
+        operator_pods = set(get_op_pod() or [])
+        log_sizes = get_container_log_sizes()
+        for pod in find_log_pods():
+            for container in get_containers(pod) or []:
+                size = log_sizes.get((pod, container))
+                if pod in operator_pods:
+                    priority = 1
+                elif container == "database":
+                    priority = 2
+                else:
+                    priority = 5
+                self.items.append(OrderedDict([
+                    ("type", "container_log"), ("pod", pod), ("name", container),
+                    ("priority", priority), ("estimated", size is None),
+                    ("size", BUDGET_UNKNOWN_LOG_SIZE if size is None else size)]))
+        for pod in find_pg_pods() or []:
+            self.pg_logs[pod] = list_pod_pg_logs(pod)
+            for rank, (size, _, path, _, _) in enumerate(self.pg_logs[pod] or []):
+                self.items.append(OrderedDict([
+                    ("type", "pg_log"), ("pod", pod), ("name", path),
+                    ("priority", 3 if rank == 0 else 4), ("estimated", False),
+                    ("size", size)]))
+        if self.max_size is None:
+            for item in self.items:
+                item["collected"] = item["size"]
+                item["action"] = "full"
+            return
+
+        remaining = (self.max_size -
+                     self.metadata_size * BUDGET_COMPRESSION_RATIO) / BUDGET_COMPRESSION_RATIO
+        # smaller items first within a priority, so one huge log does
+        # not crowd out all its peers
+        for item in sorted(self.items, key=lambda item: (item["priority"], item["size"])):
+            if item["size"] <= remaining:
+                item["collected"] = item["size"]
+                item["action"] = "full"
+            elif remaining >= BUDGET_MIN_TAIL:
+                item["collected"] = int(remaining)
+                item["action"] = "truncated"
+                self.limits[(item["pod"], item["name"])] = int(remaining)
+            else:
+                item["collected"] = 0
+                item["action"] = "skipped"
+                self.limits[(item["pod"], item["name"])] = 0
+            remaining -= item["collected"]
+
+        trimmed = [item for item in self.items if item["action"] != "full"]
+        logger.info("Size budget %s: %d of %d logs will be tailed or skipped",
+                    sizeof_fmt(self.max_size), len(trimmed), len(self.items))
+
+    def limit(self, pod, name):
+        """
+            Returns the bytes allotted to a log, None when not limited
+        """
+        return self.limits.get((pod, name))
+
+    def work_size(self, pod, name=None):
+        """
+            Returns the planned bytes of a container log, or with no name
+            of all the PG logs of a pod
+        """
+        return sum(item["collected"] for item in self.items
+                   if item["pod"] == pod and (item["name"] == name if name
+                                              else item["type"] == "pg_log"))
+
+    def manifest(self):
+        """
+            Returns the plan as a JSON serializable dict
+        """
+        return OrderedDict([
+            ("max_size", self.max_size),
+            ("metadata_size", self.metadata_size),
+            ("compression_ratio", BUDGET_COMPRESSION_RATIO),
+            ("items", self.items)])
+
+
+def get_container_log_sizes():
+    """
+        Returns a dict of (pod, container) -> log bytes on the node,
+        as reported by the kubelet stats summary of each node
+    """
+    inventory = get_pod_inventory()
+    if inventory is None:
+        return {}
+    nodes = set(pod["spec"].get("nodeName") for pod in inventory.pods.values())
+    sizes = {}
+    for node in sorted(node for node in nodes if node):
+        path = "/api/v1/nodes/{}/proxy/stats/summary".format(node)
+        if OPT.target.client is not None:
+            try:
+                status, summary = OPT.target.client.get_json(path)
+            except (http.client.HTTPException, OSError) as error:
+                status, summary = 0, {"message": str(error)}
+            if status != 200:
+                logger.debug("Failed to get stats of node %s: %s", node,
+                             summary.get("message"))
+                continue
+        else:
+            return_code, out = run_shell_command(
+                OPT.kube_cli + " get --raw {} {}".format(
+                    path, get_context_argument()), merge_stderr=False)
+            if return_code:
+                logger.debug("Failed to get stats of node %s: %s", node,
+                             out.decode('utf-8').rstrip())
+                continue
+            try:
+                summary = json.loads(out.decode('utf-8'))
+            except ValueError:
+                continue
+        namespace = OPT.target.namespace
+        for pod in summary.get("pods", []):
+            if namespace and pod["podRef"].get("namespace") != namespace:
+                continue
+            for container in pod.get("containers", []):
+                used = (container.get("logs") or {}).get("usedBytes")
+                if used is not None:
+                    sizes[(pod["podRef"]["name"], container["name"])] = used
+    return sizes
+
+
+def collected_size():
+    """
+        Returns the bytes collected so far for the current target
+    """
+    if OPT.archive is not None:
+        return OPT.target.size
+    total = 0
+    log_file = posixpath.join(OPT.output_dir, "dumptool.log")
+    for root, _, files in os.walk(posixpath.join(OPT.output_dir,
+                                                 OPT.target.dir_name)):
+        for name in files:
+            path = posixpath.join(root, name)
+            if path != log_file:
+                total += os.path.getsize(path)
+    return total
+
+
+def plan_size_budget():
+    """
+        Plans the log collection against the --max-size budget, shared
+        equally by the namespaces collected, or only estimates the log
+        sizes for --longest-first and --plan
+    """
+    OPT.target.budget = SizeBudget(OPT.max_size // len(OPT.targets)
+                                   if OPT.max_size else None)
+    OPT.target.budget.plan()
+
+
+def estimated_seconds(size):
+    """
+        Returns the time a log transfer of size bytes is assumed to take
+    """
+    return PLAN_CALL_SECONDS + size / PLAN_BYTES_PER_SECOND
+
+
+def schedule_seconds(sizes, workers):
+    """
+        Returns the run time of transfers of the given sizes handed in
+        order to the first free of workers
+    """
+    finish = [0.0] * max(min(workers, len(sizes)), 1)
+    for size in sizes:
+        finish[finish.index(min(finish))] += estimated_seconds(size)
+    return max(finish)
+
+
+def print_plan():
+    """
+        --plan dry run: estimates the logs of each target and prints
+        their bytes and transfer time, and the run time of the logs with
+        OPT.jobs workers, largest first and in the default order
+    """
+    for target in OPT.targets:
+        run_in_target(target, plan_size_budget)
+        budget = target.budget
+        print("{}{:>12}  {:>8}  {:<8}  {}".format(
+            "[{}]\n".format(target.dir_name) if target.dir_name else "",
+            "BYTES", "SECONDS", "ACTION", "LOG"))
+        for item in sorted(budget.items, key=lambda item: item["collected"],
+                           reverse=True):
+            print("{:>12}{} {:>8.1f}  {:<8}  {} {}".format(
+                item["collected"], "~" if item["estimated"] else " ",
+                estimated_seconds(item["collected"]), item["action"],
+                item["pod"], item["name"]))
+        # one transfer per container log and per pod for its PG logs
+        default = ([budget.work_size(pod) for pod in budget.pg_logs] +
+                   [item["collected"] for item in budget.items
+                    if item["type"] == "container_log" and item["collected"]])
+        print("Total {} in {} transfers: about {:.1f}s with {} worker(s)"
+              " largest first, {:.1f}s in the default order".format(
+                  sizeof_fmt(sum(default)), len(default),
+                  schedule_seconds(sorted(default, reverse=True), OPT.jobs),
+                  OPT.jobs, schedule_seconds(default, OPT.jobs)))
+
+
+def collect_budget_manifest():
+    """
+        Records the size budget plan: which logs were tailed or skipped
+    """
+    with open_output("budget.json") as file_pointer:
+        file_pointer.write(json.dumps(OPT.target.budget.manifest(), indent=2).encode('utf-8'))
+    logger.info("Collected size budget manifest")
+
+
+class CollectionState():
+    """
+        Checkpoints of incremental collection, kept between runs in a
+        small JSON state file: the time each container log was last
+        collected and the size, mtime, inode and first bytes checksum of
+        each pg log file
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.previous = {"containers": {}, "pg_logs": {}}
+        try:
+            with open(path, encoding="utf-8") as file_pointer:
+                self.previous.update(json.load(file_pointer))
+        except FileNotFoundError:
+            pass
+        except ValueError as error:
+            logger.warning("Ignoring unreadable state file %s: %s", path, error)
+        self.current = {"run": OPT.dir_name,
+                        "containers": dict(self.previous["containers"]),
+                        "pg_logs": dict(self.previous["pg_logs"])}
+        self.delta = {"containers": {}, "pg_logs": {}}
+
+    @property
+    def previous_run(self):
+        """
+            Name of the previous run the dump is a delta of, or None
+        """
+        return self.previous.get("run")
+
+    def container_since(self, pod, container):
+        """
+            Returns the time a container log was last collected, or None
+        """
+        return self.previous["containers"].get("{}/{}".format(pod, container))
+
+    def mark_container(self, pod, container, since, started):
+        """
+            Records that a container log was collected up to started
+        """
+        key = "{}/{}".format(pod, container)
+        with self.lock:
+            self.current["containers"][key] = started
+            self.delta["containers"][key] = since
+
+    def pg_log_offset(self, pod, path, size, mtime, inode=None, head=None):
+        """
+            Returns the offset to collect a pg log file from, 0 for new
+            or rotated files, None when it is unchanged since last run
+            A file is rotated when it shrank, was replaced by another
+            inode, or its first bytes changed: the per weekday names of
+            log_truncate_on_rotation are truncated and grow again
+        """
+        seen = self.previous["pg_logs"].get("{}:{}".format(pod, path))
+        if seen is None or size < seen["size"] or (
+                inode is not None and seen.get("inode") not in (None, inode)) or (
+                    head is not None and seen.get("head") is not None
+                    and seen["size"] >= PG_LOG_HEAD_SIZE and head != seen["head"]):
+            offset = 0
+        elif size == seen["size"] and mtime == seen["mtime"]:
+            return None
+        else:
+            offset = seen["size"]
+        return offset
+
+    def mark_pg_log(self, pod, path, offset, size, mtime, inode=None, head=None):
+        """
+            Records that a pg log file was collected from offset up to
+            size, once its transfer succeeded
+        """
+        key = "{}:{}".format(pod, path)
+        with self.lock:
+            self.current["pg_logs"][key] = {"size": size, "mtime": mtime,
+                                            "inode": inode, "head": head}
+            self.delta["pg_logs"][key] = offset
+
+    def save(self):
+        """
+            Writes the checkpoints for the next incremental run
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file_pointer:
+            json.dump(self.current, file_pointer, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class ResumeManifest():
+    """
+        Append-only manifest of the items of the dump collected so far,
+        one JSON line each with the file name, size and sha256, and the
+        bytes read from the source when that may grow, so that an
+        interrupted run can be resumed without collecting them again
+        The sha256, computed as open_output writes the file, is
+        informational: done() only checks the size
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(path, encoding="utf-8") as file_pointer:
+                for line in file_pointer:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # the last line of a killed run may be cut
+                        continue
+                    self.entries[entry["name"]] = entry
+        except FileNotFoundError:
+            pass
+        self.resumed = len(self.entries)
+        self.written = {}  # file name -> (size, sha256) of written files
+        self.file = open(path, "a", encoding="utf-8")
+
+    def done(self, file_name, source_size=None):
+        """
+            Returns True when file_name was collected whole, and from a
+            source of source_size bytes when given
+        """
+        entry = self.entries.get(file_name)
+        if entry is None or (source_size is not None
+                             and entry.get("source_size") != source_size):
+            return False
+        try:
+            return os.path.getsize(posixpath.join(OPT.output_dir,
+                                                  file_name)) == entry["size"]
+        except OSError:
+            return False
+
+    def record(self, file_name, source_size=None):
+        """
+            Appends file_name, as written in the output directory
+        """
+        with self.lock:
+            written = self.written.pop(file_name, None)
+        if written is not None:
+            entry = OrderedDict([("name", file_name), ("size", written[0]),
+                                 ("sha256", written[1])])
+        else:
+            # not written through open_output in one go, no checksum
+            entry = OrderedDict([("name", file_name), ("size", os.path.getsize(
+                posixpath.join(OPT.output_dir, file_name)))])
+        if source_size is not None:
+            entry["source_size"] = source_size
+        with self.lock:
+            self.entries[file_name] = entry
+            self.file.write(json.dumps(entry) + "\n")
+            self.file.flush()
+
+
+def is_collected(file_name, source_size=None):
+    """
+        Returns True when a resumed run already collected file_name of
+        the current target
+    """
+    return OPT.resume is not None and OPT.resume.done(
+        posixpath.join(OPT.target.dir_name, file_name), source_size)
+
+
+def mark_collected(file_name, source_size=None):
+    """
+        Records file_name of the current target as collected
+    """
+    if OPT.resume is not None:
+        OPT.resume.record(posixpath.join(OPT.target.dir_name, file_name),
+                          source_size)
+
+
+def find_resume_dir(dest_dir):
+    """
+        Returns the name of the latest dump directory of dest_dir that
+        has a resume manifest but no archive, or None
+    """
+    suffixes = set(suffix for _, suffix in COMPRESSORS.values())
+    candidates = []
+    if not os.path.isdir(dest_dir or "."):
+        return None
+    for name in os.listdir(dest_dir or "."):
+        path = posixpath.join(dest_dir, name)
+        if (name.startswith("crunchy_k8s_support_dump_")
+                and os.path.isfile(posixpath.join(path, RESUME_MANIFEST))
+                and not any(os.path.exists(path + suffix) for suffix in suffixes)):
+            candidates.append((os.path.getmtime(path), name))
+    return max(candidates)[1] if candidates else None
+
+
+def collect_incremental_info():
+    """
+        Records what the incremental dump is a delta of: the previous
+        run, the since-time of each container log and the byte offset
+        each pg log file was collected from
+    """
+    info = OrderedDict([("previous_run", OPT.target.state.previous_run),
+                        ("containers_since", OPT.target.state.delta["containers"]),
+                        ("pg_logs_offset", OPT.target.state.delta["pg_logs"])])
+    with open_output("incremental.json") as file_pointer:
+        file_pointer.write(json.dumps(info, indent=2).encode('utf-8'))
+    logger.info("Collected incremental info")
+
+
+class RunReport():
+    """
+        Wall time, bytes and exit codes of every collector and of every
+        subprocess or API call they make, for run_report.json and a
+        Prometheus textfile summary
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.clock = time.monotonic()
+        self.lock = threading.Lock()
+        self.collectors = []
+        self.operations = []
+
+    def run_collector(self, collector):
+        """
+            Runs a collector function, recording its time and bytes
+            Collectors of a namespace directory are named after it
+        """
+        target = OPT.target
+        target.collector = posixpath.join(target.dir_name, collector.__name__)
+        size = collected_size()
+        started = time.monotonic()
+        try:
+            collector()
+        finally:
+            entry = OrderedDict([
+                ("collector", target.collector),
+                ("seconds", round(time.monotonic() - started, 3)),
+                ("bytes", collected_size() - size)])
+            with self.lock:
+                self.collectors.append(entry)
+            target.collector = None
+
+    def record(self, kind, command, started, return_code, size=0,
+               timeout=False, retries=0):
+        """
+            Records an operation that started at monotonic time started
+        """
+        operation = OrderedDict([
+            ("collector", OPT.target.collector), ("kind", kind),
+            ("command", command[:200]),
+            ("seconds", round(time.monotonic() - started, 3)),
+            ("exit_code", return_code), ("bytes", size),
+            ("timeout", timeout), ("retries", retries)])
+        with self.lock:
+            self.operations.append(operation)
+
+    def totals(self):
+        """
+            Returns operation totals per (collector, kind)
+        """
+        totals = OrderedDict()
+        for operation in self.operations:
+            key = (operation["collector"] or "", operation["kind"])
+            total = totals.setdefault(key, OrderedDict([
+                ("count", 0), ("seconds", 0.0), ("bytes", 0), ("failures", 0),
+                ("timeouts", 0), ("retries", 0)]))
+            total["count"] += 1
+            total["seconds"] += operation["seconds"]
+            total["bytes"] += operation["bytes"]
+            total["failures"] += 1 if operation["exit_code"] else 0
+            total["timeouts"] += 1 if operation["timeout"] else 0
+            total["retries"] += operation["retries"]
+        return totals
+
+    def to_json(self):
+        """
+            Returns the report as JSON
+        """
+        return json.dumps(OrderedDict([
+            ("version", __version__),
+            ("started", time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.started))),
+            ("seconds", round(time.monotonic() - self.clock, 3)),
+            ("jobs", OPT.jobs),
+            ("concurrency", OPT.limiter.history
+             if isinstance(OPT.limiter, AdaptiveLimiter) else None),
+            ("collectors", self.collectors),
+            ("operations", self.operations)]), indent=2)
+
+    def to_prometheus(self):
+        """
+            Returns the report summary in Prometheus textfile format
+        """
+        lines = [
+            "# HELP crunchy_gather_run_seconds Wall time of the support dump run.",
+            "# TYPE crunchy_gather_run_seconds gauge",
+            "crunchy_gather_run_seconds {:.3f}".format(time.monotonic() - self.clock),
+        ]
+        for metric, field, text in (
+                ("collector_seconds", "seconds", "Wall time of each collector."),
+                ("collector_bytes", "bytes", "Bytes written by each collector.")):
+            lines += ["# HELP crunchy_gather_{} {}".format(metric, text),
+                      "# TYPE crunchy_gather_{} gauge".format(metric)]
+            lines += ['crunchy_gather_{}{{collector="{}"}} {}'.format(
+                metric, entry["collector"], entry[field]) for entry in self.collectors]
+        totals = self.totals()
+        for metric, field, text in (
+                ("operations_total", "count", "Subprocess and API calls."),
+                ("operation_seconds_total", "seconds", "Wall time of the calls."),
+                ("operation_bytes_total", "bytes", "Bytes read by the calls."),
+                ("operation_failures_total", "failures", "Calls that failed."),
+                ("operation_timeouts_total", "timeouts", "Calls that timed out."),
+                ("operation_retries_total", "retries", "Retries of the calls.")):
+            lines += ["# HELP crunchy_gather_{} {}".format(metric, text),
+                      "# TYPE crunchy_gather_{} counter".format(metric)]
+            lines += ['crunchy_gather_{}{{collector="{}",kind="{}"}} {}'.format(
+                metric, collector, kind,
+                round(total[field], 3) if field == "seconds" else total[field])
+                      for (collector, kind), total in totals.items()]
+        return "\n".join(lines) + "\n"
+
+    def log_profile(self, top):
+        """
+            Logs the slowest collectors and operations of the run
+        """
+        logger.info("Slowest collectors:")
+        for entry in sorted(self.collectors, key=lambda entry: -entry["seconds"])[:top]:
+            logger.info("  %8.2fs %10s  %s", entry["seconds"],
+                        sizeof_fmt(entry["bytes"]), entry["collector"])
+        logger.info("Slowest operations:")
+        for operation in sorted(self.operations,
+                                key=lambda operation: -operation["seconds"])[:top]:
+            logger.info("  %8.2fs %10s  %s (exit code %s%s)",
+                        operation["seconds"], sizeof_fmt(operation["bytes"]),
+                        operation["command"][:100], operation["exit_code"],
+                        ", timeout" if operation["timeout"] else "")
+
+
+def record_operation(command, started, return_code, size=0, timeout=False,
+                     retries=0, kind=None, transfer=False, paced=True):
+    """
+        Records a subprocess or API call in the run report, if any
+        The duration of a transfer follows its size rather than the API
+        server health, so only its errors feed --adaptive; calls that
+        are not paced by the limiter, watches and psql sessions, do not
+        feed it at all
+    """
+    if kind is None:
+        words = command.split()
+        kind = (words[1] if len(words) > 1 and words[0] == OPT.kube_cli
+                else words[0] if words else "")
+    if paced and isinstance(OPT.limiter, AdaptiveLimiter):
+        OPT.limiter.observe(kind, None if transfer else time.monotonic() - started,
+                            timeout or retries > 0 or return_code < 0
+                            or (kind == "rest" and return_code in RETRY_STATUSES))
+    if OPT.report is None:
+        return
+    OPT.report.record(kind, command, started, return_code, size,
+                      timeout, retries)
+
+
+def collect_run_report():
+    """
+        Writes run_report.json and run_report.prom to the dump
+    """
+    with open_output("run_report.json") as file_pointer:
+        file_pointer.write(OPT.report.to_json().encode('utf-8'))
+    with open_output("run_report.prom") as file_pointer:
+        file_pointer.write(OPT.report.to_prometheus().encode('utf-8'))
+    logger.info("Collected run report")
+
+
+class ArchiveWriter():
+    """
+        Compressed tar archive of the support dump, written as a stream
+        Members may be added concurrently from collector threads
+    """
+    def __init__(self, output_dir, compression):
+        command, suffix = COMPRESSORS[compression]
+        self.file_name = output_dir + suffix
+        self.lock = threading.Lock()
+        self.process = None
+        self.output = None
+        self.size = 0
+        if command is None:
+            self.tar = tarfile.open(self.file_name, "w|gz")
+        else:
+            self.output = open(self.file_name, "wb")
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                            stdout=self.output)
+            self.tar = tarfile.open(fileobj=self.process.stdin, mode="w|")
+
+    def add(self, file_name, file_pointer, size):
+        """
+            Adds size bytes read from file_pointer as member file_name
+        """
+        info = tarfile.TarInfo(posixpath.join(OPT.dir_name, file_name))
+        info.size = size
+        info.mtime = time.time()
+        info.mode = 0o644
+        with self.lock:
+            self.tar.addfile(info, file_pointer)
+            self.size += size
+            OPT.target.size += size
+
+    def add_tree(self, path):
+        """
+            Adds a directory tree as the root of the archive
+        """
+        with self.lock:
+            self.tar.add(path, arcname=OPT.dir_name)
+
+    def close(self):
+        """
+            Finishes the archive, returns the compressor exit code
+        """
+        with self.lock:
+            self.tar.close()
+            if self.process is None:
+                return 0
+            self.process.stdin.close()
+            return_code = self.process.wait()
+            self.output.close()
+            return return_code
+
+
+class ArchiveMember():
+    """
+        Writable file added to the streaming archive when closed
+        Spooled in memory up to SPOOL_SIZE, then in a temporary file,
+        or written to path when an on-disk copy is kept
+    """
+    def __init__(self, file_name, path=None):
+        self.file_name = file_name
+        if path is None:
+            self.file = tempfile.SpooledTemporaryFile(
+                max_size=SPOOL_SIZE, dir=OPT.dest_dir or None)
+        else:
+            os.makedirs(posixpath.dirname(path), exist_ok=True)
+            self.file = open(path, "wb+")
+
+    def write(self, data):
+        """
+            Writes data to the member
+        """
+        return self.file.write(data)
+
+    def fileno(self):
+        """
+            Returns a file descriptor subprocesses can write to
+        """
+        return self.file.fileno()
+
+    def close(self):
+        """
+            Adds the member to the archive
+        """
+        self.file.seek(0, os.SEEK_END)
+        size = self.file.tell()
+        self.file.seek(0)
+        OPT.archive.add(self.file_name, self.file, size)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ChunkStore():
+    """
+        Content addressed store shared by repeated support dumps
+        Files are split into STORE_CHUNK_SIZE chunks kept once, zlib
+        compressed, under chunks/ by their sha256; each dump is a JSON
+        manifest of the chunks of its files under manifests/
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def chunk_path(self, digest):
+        """
+            Returns the path of a chunk
+        """
+        return posixpath.join(self.path, "chunks", digest[:2], digest)
+
+    def manifest_path(self, name):
+        """
+            Returns the path of the manifest of dump name
+        """
+        return posixpath.join(self.path, "manifests", name + ".json")
+
+    def put(self, data):
+        """
+            Stores a chunk unless present, returns a tuple of its digest
+            and the bytes added to the store
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(posixpath.dirname(path), exist_ok=True)
+        data = zlib.compress(data)
+        # concurrent writers of a chunk write the same bytes
+        temp_fd, temp_path = tempfile.mkstemp(dir=posixpath.dirname(path))
+        with os.fdopen(temp_fd, "wb") as file_pointer:
+            file_pointer.write(data)
+        os.replace(temp_path, path)
+        return digest, len(data)
+
+    def get(self, digest):
+        """
+            Returns the data of a chunk, checking its digest
+        """
+        with open(self.chunk_path(digest), "rb") as file_pointer:
+            data = zlib.decompress(file_pointer.read())
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError("corrupted chunk {}".format(digest))
+        return data
+
+    def names(self):
+        """
+            Returns the names of the stored dumps
+        """
+        try:
+            return sorted(name[:-len(".json")] for name in os.listdir(
+                posixpath.join(self.path, "manifests")) if name.endswith(".json"))
+        except OSError:
+            return []
+
+    def load_manifest(self, name):
+        """
+            Returns the manifest of dump name
+        """
+        with open(self.manifest_path(name), encoding="utf-8") as file_pointer:
+            return json.load(file_pointer)
+
+
+class StoreWriter():
+    """
+        ArchiveWriter counterpart saving the support dump into a
+        ChunkStore, the manifest is written when closed
+    """
+    def __init__(self, path):
+        self.store = ChunkStore(path)
+        self.file_name = self.store.manifest_path(OPT.dir_name)
+        self.lock = threading.Lock()
+        self.files = []
+        self.size = 0
+        self.chunks = 0
+        self.new_chunks = []
+        self.new_size = 0
+
+    def add(self, file_name, file_pointer, size):
+        """
+            Adds size bytes read from file_pointer as file_name
+        """
+        self._add(file_name, file_pointer, size)
+        OPT.target.size += size
+
+    def _add(self, file_name, file_pointer, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            data = file_pointer.read(min(STORE_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            digest, added = self.store.put(data)
+            chunks.append(digest)
+            remaining -= len(data)
+            if added:
+                with self.lock:
+                    self.new_chunks.append(digest)
+                    self.new_size += added
+        with self.lock:
+            self.files.append(OrderedDict([
+                ("name", file_name), ("size", size - remaining),
+                ("mtime", int(time.time())), ("chunks", chunks)]))
+            self.size += size - remaining
+            self.chunks += len(chunks)
+
+    def add_tree(self, path):
+        """
+            Adds the files of a directory tree
+        """
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = posixpath.join(root, name)
+                with open(file_path, "rb") as file_pointer:
+                    self._add(posixpath.relpath(file_path, path), file_pointer,
+                              os.fstat(file_pointer.fileno()).st_size)
+
+    def close(self):
+        """
+            Writes the manifest of the dump, returns 0
+        """
+        manifest = OrderedDict([
+            ("name", OPT.dir_name), ("version", __version__),
+            ("chunk_size", STORE_CHUNK_SIZE), ("size", self.size),
+            ("files", sorted(self.files, key=lambda entry: entry["name"])),
+            # chunks first stored by this dump, all that an upload of
+            # the store since the previous dump has to send
+            ("new_chunks", self.new_chunks)])
+        os.makedirs(posixpath.dirname(self.file_name), exist_ok=True)
+        with open(self.file_name + ".tmp", "w", encoding="utf-8") as file_pointer:
+            json.dump(manifest, file_pointer, indent=1)
+        os.replace(self.file_name + ".tmp", self.file_name)
+        return 0
+
+
+class StoredFile():
+    """
+        Readable file of the chunks of a stored dump file
+    """
+    def __init__(self, store, chunks):
+        self.store = store
+        self.chunks = iter(chunks)
+        self.buffer = b""
+        self.offset = 0
+
+    def read(self, size=-1):
+        """
+            Returns up to size bytes, all the remaining ones if negative
+            Each byte is copied once: the current chunk is read from an
+            offset rather than resliced
+        """
+        parts = []
+        while size != 0:
+            if self.offset == len(self.buffer):
+                digest = next(self.chunks, None)
+                if digest is None:
+                    break
+                self.buffer, self.offset = self.store.get(digest), 0
+                continue
+            end = (len(self.buffer) if size < 0
+                   else min(len(self.buffer), self.offset + size))
+            parts.append(self.buffer[self.offset:end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b"".join(parts)
+
+
+class SeekableArchiveWriter():
+    """
+        ArchiveWriter counterpart compressing each tar member into its
+        own gzip member: the file is still a valid .tar.gz, and the index
+        of the members written at the end allows reading any of them
+        alone, see SeekableArchive
+    """
+    def __init__(self, output_dir):
+        self.file_name = output_dir + ".tar.gz"
+        self.lock = threading.Lock()
+        self.output = open(self.file_name, "wb")
+        self.entries = []
+        self.size = 0
+
+    def add(self, file_name, file_pointer, size):
+        """
+            Adds size bytes read from file_pointer as member file_name
+        """
+        self._add(posixpath.join(OPT.dir_name, file_name), file_pointer, size)
+        OPT.target.size += size
+
+    def _add(self, name, file_pointer, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = time.time()
+        info.mode = 0o644
+        header = info.tobuf(tarfile.GNU_FORMAT, "utf-8", "surrogateescape")
+        digest = hashlib.sha256()
+        with self.lock:
+            offset = self.output.tell()
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self.output.write(compressor.compress(header))
+            remaining = size
+            while remaining > 0:
+                data = file_pointer.read(min(STREAM_CHUNK_SIZE, remaining))
+                if not data:
+                    raise OSError("{} is shorter than {} bytes".format(name, size))
+                digest.update(data)
+                self.output.write(compressor.compress(data))
+                remaining -= len(data)
+            padding = -size % tarfile.BLOCKSIZE
+            self.output.write(compressor.compress(b"\0" * padding))
+            self.output.write(compressor.flush())
+            self.entries.append(OrderedDict([
+                ("name", name), ("offset", offset),
+                ("length", self.output.tell() - offset),
+                ("header", len(header)), ("size", size),
+                ("sha256", digest.hexdigest())]))
+            self.size += size
+
+    def add_tree(self, path):
+        """
+            Adds the files of a directory tree as the root of the archive
+        """
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = posixpath.join(root, name)
+                with open(file_path, "rb") as file_pointer:
+                    self._add(posixpath.join(OPT.dir_name,
+                                             posixpath.relpath(file_path, path)),
+                              file_pointer, os.fstat(file_pointer.fileno()).st_size)
+
+    def close(self):
+        """
+            Writes the index member, a copy of it next to the archive,
+            and the end of the archive, returns 0
+        """
+        index = json.dumps(OrderedDict([("version", 1),
+                                        ("members", self.entries)]),
+                           indent=1).encode('utf-8')
+        with open(self.file_name[:-len(".tar.gz")] + ".index.json", "wb") as file_pointer:
+            file_pointer.write(index)
+        self._add(posixpath.join(OPT.dir_name, ARCHIVE_INDEX), io.BytesIO(index),
+                  len(index))
+        with self.lock:
+            index_entry = self.entries.pop()
+            self.output.write(seekable_trailer(index_entry["offset"],
+                                               index_entry["length"]))
+            self.output.close()
+        return 0
+
+
+def seekable_trailer(index_offset, index_length):
+    """
+        Returns the last gzip member of a --seekable archive: the end of
+        archive blocks of tar, stored uncompressed so that the member has
+        a fixed size, with the offset and length of the index member in
+        its FEXTRA field
+    """
+    extra = b"CG" + struct.pack("<HQQ", 16, index_offset, index_length)
+    data = b"\0" * (2 * tarfile.BLOCKSIZE)
+    return (b"\x1f\x8b\x08\x04\0\0\0\0\0\xff" + struct.pack("<H", len(extra)) + extra +
+            # a final stored deflate block
+            b"\x01" + struct.pack("<HH", len(data), 0xffff ^ len(data)) + data +
+            struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data)))
+
+
+class SeekableArchive():
+    """
+        Reader of a --seekable archive: lists its members from the index
+        and extracts one in time proportional to its size
+    """
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = len(seekable_trailer(0, 0))
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() < size:
+            raise ValueError("{} is not a seekable archive".format(path))
+        self.file.seek(-size, os.SEEK_END)
+        trailer = self.file.read(size)
+        if trailer[:4] != b"\x1f\x8b\x08\x04" or trailer[12:14] != b"CG":
+            raise ValueError("{} is not a seekable archive".format(path))
+        offset, length = struct.unpack("<QQ", trailer[16:32])
+        index = io.BytesIO()
+        self._copy(OrderedDict([("offset", offset), ("length", length),
+                                ("header", 0), ("size", None)]), index)
+        with tarfile.open(fileobj=io.BytesIO(index.getvalue()), mode="r:") as tar:
+            member = tar.next()
+            self.members = json.loads(tar.extractfile(member).read().decode('utf-8'))["members"]
+
+    def find(self, name):
+        """
+            Returns the index entry of member name, which may leave out
+            the dump directory, or None
+        """
+        for entry in self.members:
+            if entry["name"] == name or entry["name"].endswith("/" + name.lstrip("/")):
+                return entry
+        return None
+
+    def extract(self, entry, file_pointer):
+        """
+            Writes the data of a member to file_pointer, checking it
+        """
+        digest = self._copy(entry, file_pointer)
+        if digest.hexdigest() != entry["sha256"]:
+            raise ValueError("checksum mismatch of {}".format(entry["name"]))
+
+    def _copy(self, entry, file_pointer):
+        """
+            Decompresses the gzip member of an entry, writing its bytes
+            after the tar header, up to its size, returns their sha256
+        """
+        self.file.seek(entry["offset"])
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        digest = hashlib.sha256()
+        skip = entry["header"]
+        remaining = entry["size"]
+        left = entry["length"]
+        while left > 0 and remaining != 0:
+            data = decompressor.decompress(self.file.read(min(STREAM_CHUNK_SIZE, left)))
+            left -= STREAM_CHUNK_SIZE
+            if skip:
+                data, skip = data[skip:], max(skip - len(data), 0)
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            digest.update(data)
+            file_pointer.write(data)
+        return digest
+
+    def close(self):
+        """
+            Closes the archive file
+        """
+        self.file.close()
+
+
+def read_archive(path, member, dest_dir):
+    """
+        Lists the members of a seekable archive, or extracts member
+        into dest_dir, returns 0 on success
+    """
+    try:
+        archive = SeekableArchive(path)
+    except (OSError, ValueError, zlib.error, tarfile.TarError) as error:
+        logger.error("Cannot read archive index of %s: %s", path, error)
+        return 1
+    try:
+        if not member:
+            for entry in archive.members:
+                print("{:>12}  {:>12}  {}".format(entry["size"], entry["length"],
+                                                  entry["name"]))
+            return 0
+        entry = archive.find(member)
+        if entry is None:
+            logger.error("No member %s in %s", member, path)
+            return 1
+        # the index is read from the archive, a member name must not
+        # lead out of dest_dir
+        dest_dir = os.path.realpath(dest_dir or ".")
+        target = os.path.realpath(os.path.join(dest_dir, entry["name"]))
+        if (posixpath.isabs(entry["name"]) or ".." in entry["name"].split("/")
+                or os.path.commonpath([dest_dir, target]) != dest_dir
+                or target == dest_dir):
+            logger.error("Refusing to extract %s outside of %s", entry["name"],
+                         dest_dir)
+            return 1
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as file_pointer:
+            archive.extract(entry, file_pointer)
+        logger.info("Extracted %s (%s) to %s", entry["name"],
+                    sizeof_fmt(entry["size"]), target)
+        return 0
+    except (OSError, ValueError, zlib.error) as error:
+        logger.error("Cannot read %s: %s", member or path, error)
+        return 1
+    finally:
+        archive.close()
+
+
+def open_archive():
+    """
+        Returns the writer of the support dump archive, seekable with
+        --seekable, or of the content addressed store with --store
+    """
+    if OPT.store:
+        return StoreWriter(OPT.store)
+    if OPT.seekable:
+        return SeekableArchiveWriter(OPT.output_dir)
+    return ArchiveWriter(OPT.output_dir, OPT.compression)
+
+
+def export_stored_dump(store_dir, name, dest_dir):
+    """
+        Rebuilds the tar archive of a stored dump in dest_dir, returns
+        0 on success
+    """
+    store = ChunkStore(store_dir)
+    name = posixpath.basename(name)
+    if name.endswith(".json"):
+        name = name[:-len(".json")]
+    try:
+        manifest = store.load_manifest(name)
+    except (OSError, ValueError) as error:
+        logger.error("Cannot read stored dump %s: %s", name, error)
+        logger.info("Stored dumps: %s", ", ".join(store.names()) or "none")
+        return 1
+    OPT.dir_name = manifest["name"]
+    os.makedirs(dest_dir, exist_ok=True)
+    archive = ArchiveWriter(posixpath.join(dest_dir, OPT.dir_name),
+                            OPT.compression)
+    try:
+        for entry in manifest["files"]:
+            archive.add(entry["name"], StoredFile(store, entry["chunks"]),
+                        entry["size"])
+    except (OSError, ValueError, zlib.error) as error:
+        logger.error("Cannot export %s: %s", name, error)
+        archive.close()
+        return 1
+    if archive.close():
+        logger.error("Compressor failed, archive may be incomplete")
+        return 1
+    logger.info("Exported %s (%d files, %s) to %s", name,
+                len(manifest["files"]), sizeof_fmt(manifest["size"]),
+                archive.file_name)
+    return 0
+
+
+def open_output(file_name, append=False, log_file=False):
+    """
+        Opens a support dump file for writing, relative to the directory
+        of the current target
+        In streaming mode the file becomes an archive member when closed
+        Log files are passed line by line through the line filters
+    """
+    file_name = posixpath.join(OPT.target.dir_name, file_name)
+    path = posixpath.join(OPT.output_dir, file_name)
+    if OPT.archive is not None:
+        file_pointer = ArchiveMember(file_name, path if OPT.keep_files else None)
+    else:
+        os.makedirs(posixpath.dirname(path), exist_ok=True)
+        file_pointer = open(path, "ab" if append else "wb")
+        if OPT.resume is not None and not append:
+            file_pointer = DigestWriter(file_pointer, file_name)
+    # redact first, so nothing downstream sees the masked values
+    filters = [line_filter for line_filter in (OPT.redactor, OPT.scanner)
+               if line_filter is not None]
+    if log_file and filters:
+        return LineWriter(file_pointer, file_name, filters)
+    return file_pointer
+
+
+class DigestWriter():
+    """
+        Writable file computing the size and sha256 of what is written,
+        handed to the resume manifest when closed
+    """
+    def __init__(self, file_pointer, file_name):
+        self.file = file_pointer
+        self.file_name = file_name
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        """
+            Writes data, adding it to the digest
+        """
+        self.digest.update(data)
+        self.size += len(data)
+        return self.file.write(data)
+
+    def close(self):
+        """
+            Closes the file and records its size and digest
+        """
+        self.file.close()
+        with OPT.resume.lock:
+            OPT.resume.written[self.file_name] = (self.size, self.digest.hexdigest())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class LineWriter():
+    """
+        Writable file passing each complete line through line filters
+        before writing it to the underlying file
+        A filter has process(file_name, offset, line) returning the
+        line to write, and close(file_name) called at the end
+    """
+    def __init__(self, file_pointer, file_name, filters):
+        self.file = file_pointer
+        self.file_name = file_name
+        self.filters = filters
+        self.offset = 0
+        self.pending = b""
+
+    def write(self, data):
+        """
+            Buffers data, writing out the complete lines, returns the
+            number of bytes of data
+        """
+        size = len(data)
+        data = self.pending + data
+        start = 0
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                if len(data) - start <= MAX_LINE_SIZE:
+                    break
+                end = start + MAX_LINE_SIZE - 1
+            self._write_line(data[start:end + 1])
+            start = end + 1
+        self.pending = data[start:]
+        return size
+
+    def _write_line(self, line):
+        for line_filter in self.filters:
+            line = line_filter.process(self.file_name, self.offset, line)
+        self.file.write(line)
+        self.offset += len(line)
+
+    def close(self):
+        """
+            Writes out the last partial line and closes the file
+        """
+        if self.pending:
+            self._write_line(self.pending)
+            self.pending = b""
+        for line_filter in self.filters:
+            line_filter.close(self.file_name)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def collect_log_index():
+    """
+        Writes the index built by the log scanner
+    """
+    OPT.scanner.write()
+
+
+class LogScanner():
+    """
+        Line filter indexing the log lines that match any of a set of
+        patterns, compiled into a single regex so each line is matched
+        once; the index is spooled to a temporary file as it grows
+    """
+    def __init__(self, patterns):
+        self.patterns = patterns
+        self.regex = re.compile(b"|".join(
+            b"(?P<p%d>%s)" % (index, regex)
+            for index, (_, _, regex) in enumerate(patterns)))
+        self.index = tempfile.TemporaryFile(dir=OPT.dest_dir or None)
+        self.lock = threading.Lock()
+        self.summary = OrderedDict()
+        self.local = threading.local()
+
+    @classmethod
+    def from_file(cls, path):
+        """
+            Loads patterns from a JSON list of {name, severity, regex}
+        """
+        with open(path, encoding="utf-8") as file_pointer:
+            patterns = json.load(file_pointer)
+        return cls([(pattern["name"], pattern.get("severity", "ERROR"),
+                     pattern["regex"].encode('utf-8')) for pattern in patterns])
+
+    def _file_summary(self, file_name):
+        summary = getattr(self.local, "summary", None)
+        if summary is None or self.local.file_name != file_name:
+            summary = OrderedDict([("lines", 0), ("bytes", 0), ("matches", OrderedDict()),
+                                   ("first_match", None), ("last_match", None)])
+            self.local.summary = summary
+            self.local.file_name = file_name
+            self.local.entries = []
+        return summary
+
+    def process(self, file_name, offset, line):
+        """
+            Indexes line if it matches, returns it unchanged
+        """
+        summary = self._file_summary(file_name)
+        summary["lines"] += 1
+        summary["bytes"] += len(line)
+        match = self.regex.search(line)
+        if match:
+            name, severity, _ = self.patterns[int(match.lastgroup[1:])]
+            stamp = LOG_TIMESTAMP_RE.match(line)
+            timestamp = stamp.group(1).decode('ascii') if stamp else ""
+            summary["matches"][name] = summary["matches"].get(name, 0) + 1
+            if timestamp:
+                summary["first_match"] = summary["first_match"] or timestamp
+                summary["last_match"] = timestamp
+            self.local.entries.append("{}\t{}\t{}\t{}\t{}\n".format(
+                file_name, offset, timestamp, severity, name))
+            if len(self.local.entries) >= 1000:
+                self._flush()
+        return line
+
+    def _flush(self):
+        with self.lock:
+            self.index.write("".join(self.local.entries).encode('utf-8'))
+        self.local.entries = []
+
+    def close(self, file_name):
+        """
+            Flushes the index entries and summary of a log file
+        """
+        summary = self._file_summary(file_name)
+        self._flush()
+        with self.lock:
+            self.summary[file_name] = summary
+        self.local.summary = None
+
+    def write(self):
+        """
+            Writes log_index.tsv and log_index_summary.json to the dump
+        """
+        with self.lock:
+            self.index.seek(0)
+            with open_output("log_index.tsv") as file_pointer:
+                file_pointer.write(b"file\toffset\ttimestamp\tseverity\tpattern\n")
+                shutil.copyfileobj(self.index, file_pointer)
+            self.index.close()
+            with open_output("log_index_summary.json") as file_pointer:
+                file_pointer.write(json.dumps(self.summary, indent=2).encode('utf-8'))
+        logger.info("Collected log index of %d files", len(self.summary))
+
+
+def collect_redaction_summary():
+    """
+        Writes the number of redactions of each log file
+    """
+    OPT.redactor.write()
+
+
+class Redactor():
+    """
+        Line filter masking the values matched by a set of rules,
+        compiled into a single regex so each line is scanned once, and
+        counting the redactions of each file
+        Lines without any trigger string of the rules skip the regex;
+        a rule without triggers disables that shortcut
+    """
+    def __init__(self, rules):
+        self.rules = []
+        self.triggers = set()
+        parts = []
+        group = 1
+        for name, regex, triggers in rules:
+            if self.triggers is not None:
+                self.triggers = (self.triggers.union(triggers) if triggers
+                                 else None)
+            # rule groups are numbered after the wrapping group
+            parts.append(b"(%s)" % regex)
+            inner = re.compile(regex).groups
+            self.rules.append((name, group, group + 1 if inner else group,
+                               b"[REDACTED:" + name.encode('utf-8') + b"]"))
+            group += 1 + inner
+        self.regex = re.compile(b"|".join(parts))
+        if self.triggers is not None:
+            self.triggers = re.compile(b"|".join(
+                re.escape(trigger) for trigger in sorted(self.triggers)))
+        self.by_group = {rule[1]: rule for rule in self.rules}
+        self.lock = threading.Lock()
+        self.summary = OrderedDict()
+        self.local = threading.local()
+
+    @classmethod
+    def from_file(cls, path):
+        """
+            Loads rules from a JSON list of {name, regex, triggers}
+        """
+        with open(path, encoding="utf-8") as file_pointer:
+            rules = json.load(file_pointer)
+        return cls([(rule["name"], rule["regex"].encode('utf-8'),
+                     [trigger.lower().encode('utf-8')
+                      for trigger in rule.get("triggers", [])])
+                    for rule in rules])
+
+    def _counts(self, file_name):
+        counts = getattr(self.local, "counts", None)
+        if counts is None or self.local.file_name != file_name:
+            counts = OrderedDict()
+            self.local.counts = counts
+            self.local.file_name = file_name
+        return counts
+
+    def _mask(self, match):
+        name, _, group, mask = self.by_group[match.lastindex]
+        counts = self.local.counts
+        counts[name] = counts.get(name, 0) + 1
+        whole = match.group(0)
+        if match.start(group) < 0:
+            return mask
+        start = match.start(group) - match.start(0)
+        end = match.end(group) - match.start(0)
+        return whole[:start] + mask + whole[end:]
+
+    def process(self, file_name, offset, line):  # pylint: disable=unused-argument
+        """
+            Returns line with the values matched by the rules masked
+        """
+        self._counts(file_name)
+        if self.triggers is not None and not self.triggers.search(line.lower()):
+            return line
+        return self.regex.sub(self._mask, line)
+
+    def close(self, file_name):
+        """
+            Records the redaction counts of a log file
+        """
+        counts = self._counts(file_name)
+        if counts:
+            with self.lock:
+                self.summary[file_name] = counts
+        self.local.counts = None
+
+    def write(self):
+        """
+            Writes redaction_summary.json to the dump
+        """
+        with self.lock:
+            total = sum(sum(counts.values()) for counts in self.summary.values())
+            with open_output("redaction_summary.json") as file_pointer:
+                file_pointer.write(json.dumps(self.summary, indent=2).encode('utf-8'))
+        logger.info("Redacted %d values in %d files", total, len(self.summary))
+
+
+def make_output_dir(dir_name):
+    """
+        Creates a support dump directory, unless streaming to the archive
+    """
+    if OPT.archive is None or OPT.keep_files:
+        os.makedirs(posixpath.join(OPT.output_dir, OPT.target.dir_name,
+                                   dir_name), exist_ok=True)
+
+
+def choose_compression(requested):
+    """
+        Returns the archive compression to use for the requested one
+        auto prefers multi-threaded pigz, falling back to in-process gzip
+    """
+    if requested == "auto":
+        return "pigz" if shutil.which("pigz") else "gzip"
+    command = COMPRESSORS[requested][0]
+    if command is not None and not shutil.which(command[0]):
+        logger.warning("%s not found, using gzip compression", command[0])
+        return "gzip"
+    return requested
+
+
+def parse_size(value):
+    """
+        Parses a size such as 500K, 25M or 2G into bytes
+    """
+    units = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*$", value, re.I)
+    if not match:
+        raise argparse.ArgumentTypeError("invalid size: {}".format(value))
+    return int(float(match.group(1)) * units[match.group(2).upper()])
+
+
+def parse_time(value):
+    """
+        Parses a UTC time such as 2024-05-01T10:00:00Z, 2024-05-01 10:00
+        or 2024-05-01, or a time ago such as 90s, 30m, 2h or 1d, into
+        epoch seconds
+    """
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([smhd])\s*$", value, re.I)
+    if match:
+        units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+        return time.time() - float(match.group(1)) * units[match.group(2).lower()]
+    for time_format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S",
+                        "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value.strip().rstrip("Zz"),
+                                                 time_format))
+        except ValueError:
+            continue
+    raise argparse.ArgumentTypeError("invalid time: {}".format(value))
+
+
+def sizeof_fmt(num, suffix="B"):
+    """
+        Formats the file size in a human-readable format
+        Probably overkill to go to Zi range, but reusable
+    """
+    for unit in ["", "Ki", "Mi", "Gi", "Ti", "Pi", "Ei", "Zi"]:
+        if abs(num) < 1024.0:
+            return f"{num:3.1f}{unit}{suffix}"
+        num /= 1024.0
+    return f"{num:.1f}Yi{suffix}"
+
+
+def archive_files():
+    """
+        Create an archive and compress it
+    """
+    archive_file_size = 0
+    if OPT.archive is None:
+        OPT.archive = open_archive()
+        OPT.archive.add_tree(OPT.output_dir)
+    else:
+        for handler in logging.getLogger('').handlers:
+            handler.flush()
+        log_file = posixpath.join(OPT.output_dir, "dumptool.log")
+        with open(log_file, "rb") as file_pointer:
+            OPT.archive.add("dumptool.log", file_pointer,
+                            os.fstat(file_pointer.fileno()).st_size)
+    file_name = OPT.archive.file_name
+    if OPT.archive.close():
+        logger.warning("Compressor failed, archive may be incomplete")
+    logger.info("")
+
+    # Let user choose to delete the files manually, the files of a dump
+    # saved in a store are in its chunks and only take space twice
+
+    if OPT.delete_dir or (OPT.store and not OPT.keep_files):
+        rtn, out = run_shell_command(f"rm -rf {OPT.output_dir}")
+        if rtn:
+            logger.warning('Failed to delete directory after archiving: %s',
+                           out)
+            logger.info("support dump files saved at %s", OPT.output_dir)
+    if OPT.store:
+        logger.info("Support dump stored in %s: %s in %d chunks, %d new"
+                    " (%s added to the store)", file_name,
+                    sizeof_fmt(OPT.archive.size), OPT.archive.chunks,
+                    len(OPT.archive.new_chunks),
+                    sizeof_fmt(OPT.archive.new_size))
+        logger.info("Export it with: %s --store %s --export %s -o <dir>",
+                    sys.argv[0], OPT.store, OPT.dir_name)
+        return
+    try:
+        archive_file_size = os.stat(file_name).st_size
+        logger.info("┌──────────────────────────────────────────────────────────────────-")
+        logger.info("│ Archive file saved to: %s ", file_name)
+        if archive_file_size > MAX_ARCHIVE_EMAIL_SIZE:
+            logger.info("│ Archive file (%s) may be too big to email.",
+                        sizeof_fmt(archive_file_size))
+            logger.info("│ Please request file share link by"
+                        " emailing support@crunchydata.com")
+        else:
+            logger.info("│ Archive file size: %s ", sizeof_fmt(archive_file_size))
+            logger.info("│ Email the support dump to support@crunchydata.com")
+            logger.info("│ or attach as a email reply to your existing Support Ticket")
+        logger.info("└──────────────────────────────────────────────────────────────────-")
+        if OPT.max_size and archive_file_size > OPT.max_size:
+            logger.warning("Archive file is larger than the %s size budget;"
+                           " logs compressed less than estimated",
+                           sizeof_fmt(OPT.max_size))
+    except (OSError, ValueError) as e:  # pylint: disable=invalid-name
+        logger.warning("Archive file size: NA --- %s", e)
+
+
+class PodInventory():
+    """
+        In-memory index of the namespace pods, built from one get
+    """
+    def __init__(self, pods):
+        self.pods = OrderedDict((pod["metadata"]["name"], pod) for pod in pods)
+
+    def select(self, selector):
+        """
+            Returns the names of the pods matching a label selector
+            Supports comma separated key, key=value and key!=value terms
+        """
+        terms = []
+        for term in selector.split(","):
+            if "!=" in term:
+                key, value = term.split("!=", 1)
+                terms.append((key, value, False))
+            elif "=" in term:
+                key, value = term.split("=", 1)
+                terms.append((key.rstrip("="), value, True))
+            else:
+                terms.append((term, None, True))
+
+        names = []
+        for name, pod in self.pods.items():
+            labels = pod["metadata"].get("labels") or {}
+            if all((labels.get(key) == value) == wanted if value is not None
+                   else key in labels for key, value, wanted in terms):
+                names.append(name)
+        return names
+
+    def containers(self, pod_name):
+        """
+            Returns list of containers in a pod, None if unknown
+        """
+        pod = self.pods.get(pod_name)
+        if pod is None:
+            return None
+        return [container["name"] for container in pod["spec"]["containers"]]
+
+
+POD_INVENTORY = {}
+
+
+def get_pod_inventory():
+    """
+        Returns the PodInventory of the namespace, fetching all pods
+        with a single kube cli get the first time; None on failure
+    """
+    key = get_namespace_argument()
+    if key not in POD_INVENTORY and OPT.target.client is not None:
+        try:
+            pods = OPT.target.client.list("pods")
+        except (http.client.HTTPException, OSError) as error:
+            logger.debug("REST client get failed: %s", error)
+            pods = None
+        if pods is not None:
+            set_pod_inventory(pods)
+    if key not in POD_INVENTORY:
+        cmd = OPT.kube_cli + " get pods {} -o json".format(key)
+        return_code, out = run_shell_command(cmd, merge_stderr=False)
+        if return_code:
+            logger.warning("Failed to get pods: %s", out.decode('utf-8').rstrip())
+            return None
+        try:
+            set_pod_inventory(json.loads(out.decode('utf-8')).get("items", []))
+        except ValueError as error:
+            logger.warning("Failed to parse pods list: %s", error)
+            return None
+    return POD_INVENTORY[key]
+
+
+def set_pod_inventory(pods):
+    """
+        Seeds the namespace PodInventory from already fetched pod items
+    """
+    POD_INVENTORY[get_namespace_argument()] = PodInventory(pods)
+
+
+def select_pods(selector):
+    """
+        Returns list of pods names matching the label selector
+    """
+    inventory = get_pod_inventory()
+    if inventory is None:
+        return None
+    return inventory.select(selector)
+
+
+def get_pods_v4():
+    """
+        Returns list of pods names, all pods
+    """
+    return select_pods("vendor=crunchydata")
+
+
+def get_pods_v5():
+    """
+        Returns list of pods names, all pods
+    """
+    return select_pods("postgres-operator.crunchydata.com/cluster")
+
+
+def get_op_pod():
+    """
+        Returns just the operator pod
+    """
+    return select_pods("app.kubernetes.io/name=postgres-operator")
+
+
+def get_pg_pods_v4():
+    """
+        Returns list of pods names, only DB pods
+    """
+    return select_pods("pgo-pg-database=true,vendor=crunchydata")
+
+
+def get_pg_pods_v5():
+    """
+        Returns list of pods names, only DB pods
+    """
+    return select_pods("postgres-operator.crunchydata.com/cluster")
+
+
+def get_containers(pod_name):
     """
         Returns list of containers in a pod
     """
-    cmd = (OPT.kube_cli + " get pods {} {} --no-headers "
-           "-o=custom-columns=CONTAINERS:.spec.containers[*].name"
-           .format(get_namespace_argument(), pod_name))
-    return_code, out = run_shell_command(cmd)
-    if return_code == 0:
-        return out.decode("utf-8").split(",")
-    logger.warning("Failed to get pods: %s", out)
-    return None
+    inventory = get_pod_inventory()
+    if inventory is None:
+        return None
+    containers = inventory.containers(pod_name)
+    if containers is None:
+        logger.warning("Failed to get containers of pod %s", pod_name)
+    return containers
 
 
 def get_namespace_argument():
     """
-        Returns namespace option for kube cli
+        Returns namespace option for kube cli, after the context one
+    """
+    if OPT.target.namespace:
+        return (get_context_argument() + " -n {}".format(
+            OPT.target.namespace)).lstrip()
+    return get_context_argument()
+
+
+def get_context_argument():
+    """
+        Returns kube context option for kube cli
     """
-    if OPT.namespace:
-        return "-n {}".format(OPT.namespace)
+    if OPT.target.context:
+        return "--context {}".format(shlex.quote(OPT.target.context))
     return ""
 
 
@@ -547,49 +3892,414 @@ def collect_helper(cmd, file_name, resource_name):
     """
         helper function to gather data
     """
-    return_code, out = run_shell_command(cmd)
+    if is_collected(file_name):
+        logger.info("Collected %s (resumed)", resource_name)
+        return
+    return_code, size, error = stream_shell_command(cmd, file_name)
     if return_code:
-        logger.warning("Error when running %s: %s", cmd, out.decode('utf-8').rstrip())
+        logger.warning("Error when running %s: %s", cmd,
+                       error.decode('utf-8', 'replace').rstrip())
         return
-    path = posixpath.join(OPT.output_dir, file_name)
-    with open(path, "wb") as file_pointer:
-        file_pointer.write(out)
+    if not size:
+        # keep the kube cli message, e.g. no resources found
+        with open_output(file_name) as file_pointer:
+            file_pointer.write(error)
+    mark_collected(file_name)
     logger.info("Collected %s", resource_name)
 
 
-def run_shell_command(cmd, log_error=True):
+def run_shell_command(cmd, log_error=True, merge_stderr=True):
     """
         Returns a tuple of the shell exit code, output
+        With merge_stderr=False the output is stdout on success and
+        stderr on failure, so it can be parsed without CLI warnings
+        The call is killed after --call-timeout seconds, exit code 124,
+        and retried with backoff when it fails with a transient error
     """
-    try:
-        output = subprocess.check_output(
-            cmd,
-            shell=True,
-            stderr=subprocess.STDOUT)
-    except subprocess.CalledProcessError as ex:
-        if log_error:
-            logger.debug("Failed in shell command: %s, output: %s",
-                    cmd, ex.output.decode('utf-8').rstrip())
-            logger.debug("This is probably fine; an item which doesn't exist in v4/v5")
-        return ex.returncode, ex.output
+    started = time.monotonic()
+    for attempt in range(CALL_RETRIES + 1):
+        if OPT.watchdog.expired():
+            output = b"run deadline reached"
+            record_operation(cmd, started, EXEC_TIMEOUT_CODE, timeout=True,
+                             retries=attempt)
+            return EXEC_TIMEOUT_CODE, output
+        with OPT.limiter:
+            handle = OPT.watchdog.start(
+                cmd, OPT.call_timeout, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE)
+            out, err = handle.communicate()
+        return_code = EXEC_TIMEOUT_CODE if handle.timed_out else handle.returncode
+        output = out if return_code == 0 or merge_stderr else err
+        if (return_code and not handle.timed_out and attempt < CALL_RETRIES
+                and TRANSIENT_ERROR_RE.search(output)):
+            logger.debug("Retrying: %s: %s", cmd,
+                         output.decode('utf-8', 'replace').rstrip())
+            backoff(attempt)
+            continue
+        break
+
+    record_operation(cmd, started, return_code, len(output),
+                     timeout=handle.timed_out, retries=attempt)
+    if handle.timed_out:
+        logger.warning("Killed at its deadline: %s", cmd)
+    elif return_code and log_error:
+        logger.debug("Failed in shell command: %s, output: %s",
+                cmd, output.decode('utf-8').rstrip())
+        logger.debug("This is probably fine; an item which doesn't exist in v4/v5")
+    return return_code, output
+
+
+def stream_shell_command(cmd, file_name):
+    """
+        Streams the stdout of a shell command into a support dump file
+        in STREAM_CHUNK_SIZE chunks; the file is only created once the
+        command outputs something
+        Returns a tuple of the shell exit code, bytes written, stderr
+        The call is killed after --call-timeout seconds, exit code 124,
+        and retried with backoff when it fails with a transient error
+        before writing anything
+    """
+    started = time.monotonic()
+    for attempt in range(CALL_RETRIES + 1):
+        if OPT.watchdog.expired():
+            record_operation(cmd, started, EXEC_TIMEOUT_CODE, timeout=True,
+                             retries=attempt)
+            return EXEC_TIMEOUT_CODE, 0, b"run deadline reached"
+        size = 0
+        file_pointer = None
+        with OPT.limiter, tempfile.TemporaryFile() as errors:
+            handle = OPT.watchdog.start(cmd, OPT.call_timeout,
+                                        stdout=subprocess.PIPE, stderr=errors)
+            try:
+                while True:
+                    chunk = handle.stdout.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if file_pointer is None:
+                        file_pointer = open_output(file_name)
+                    file_pointer.write(chunk)
+                    size += len(chunk)
+            finally:
+                if file_pointer is not None:
+                    file_pointer.close()
+            handle.stdout.close()
+            return_code = handle.wait()
+            errors.seek(0)
+            error = errors.read()
+        if handle.timed_out:
+            return_code = EXEC_TIMEOUT_CODE
+        if (return_code and not size and not handle.timed_out
+                and attempt < CALL_RETRIES and TRANSIENT_ERROR_RE.search(error)):
+            logger.debug("Retrying: %s: %s", cmd,
+                         error.decode('utf-8', 'replace').rstrip())
+            backoff(attempt)
+            continue
+        break
+
+    record_operation(cmd, started, return_code, size,
+                     timeout=handle.timed_out, retries=attempt)
+    if handle.timed_out:
+        logger.warning("Killed at its deadline: %s", cmd)
+    elif error and not return_code:
+        logger.debug("Warnings of %s: %s", cmd,
+                     error.decode('utf-8', 'replace').rstrip())
+    return return_code, size, error
+
 
-    return 0, output
+def backoff(attempt, delay=None):
+    """
+        Sleeps before retrying a call: delay seconds, as asked by the
+        server, or CALL_RETRY_DELAY doubled for each attempt, plus jitter
+    """
+    try:
+        delay = min(float(delay), 30)
+    except (TypeError, ValueError):
+        delay = CALL_RETRY_DELAY * 2 ** attempt
+    time.sleep(delay + random.uniform(0, delay))
 
 
 def run_kube_get(resource_type):
     """
-        Returns a tuple of the shell exit code, and kube cli get output
+        Streams the kube cli get output of resource_type into
+        {resource_type}.yml, returns True when it was collected
     """
     cmd = OPT.kube_cli + " get {} {} -o yaml".format(resource_type,
                                                      get_namespace_argument())
-    return_code, out = run_shell_command(cmd)
+    return_code, _, error = stream_shell_command(cmd, f"{resource_type}.yml")
     if return_code == 0:
-        return out
+        return True
     logger.debug("Failed to get %s resource: %s. Resource may not exist",
             resource_type,
-            out.decode('utf-8').rstrip())
+            error.decode('utf-8', 'replace').rstrip())
     logger.debug("This is probably fine; an item which doesn't exist in v4/v5")
-    return None
+    return False
+
+
+def run_kube_get_batch(resource_types):
+    """
+        Fetches several resource types with a single kube cli get,
+        streaming their items into one {type}.yml List file per type
+        Types the server does not serve are dropped and the get retried
+        The pods are also kept for the pod inventory
+        Returns an OrderedDict of resource type -> number of items, or
+        None when the batched output could not be used
+    """
+    if OPT.target.client is not None:
+        return rest_get_batch(resource_types)
+
+    pending = list(resource_types)
+    while pending:
+        cmd = OPT.kube_cli + " get {} {} -o json".format(
+            ",".join(pending), get_namespace_argument())
+        by_kind = {API_RESOURCE_KINDS[resource]: resource for resource in pending}
+        writer = ResourceListWriter()
+        pods = []
+        parse_error = None
+        started = time.monotonic()
+        with OPT.limiter, tempfile.TemporaryFile() as errors:
+            handle = OPT.watchdog.start(cmd, OPT.call_timeout,
+                                        stdout=subprocess.PIPE, stderr=errors)
+            reader = JsonItemsReader(handle.stdout)
+            try:
+                for item in reader:
+                    resource = by_kind.get(item.get("kind"))
+                    if resource is None:
+                        logger.debug("Ignoring unexpected kind %s", item.get("kind"))
+                        continue
+                    writer.add(resource, item)
+                    if resource == "pods":
+                        pods.append(item)
+            except ValueError as error:
+                parse_error = error
+            finally:
+                handle.stdout.close()
+                return_code = handle.wait()
+            errors.seek(0)
+            error = errors.read().decode('utf-8', 'replace')
+        record_operation(cmd, started, return_code, reader.size,
+                         timeout=handle.timed_out)
+
+        if writer.counts:
+            # items were written: keep them rather than fetch them again
+            if return_code or parse_error:
+                logger.warning("Incomplete output of %s: %s", cmd,
+                               str(parse_error or error).rstrip())
+            if pods:
+                set_pod_inventory(pods)
+            return writer.close(() if return_code or parse_error else pending)
+        writer.close()
+        if return_code == 0:
+            if parse_error:
+                logger.debug("Could not parse batched get output: %s", parse_error)
+                return None
+            return ResourceListWriter().close(pending)
+        match = UNKNOWN_RESOURCE_RE.search(error)
+        if not match or match.group(1) not in pending:
+            logger.debug("Failed to get %s resources: %s",
+                         ",".join(pending), error.rstrip())
+            return None
+        logger.debug("Resource %s does not exist; this is probably fine,"
+                     " an item which doesn't exist in v4/v5", match.group(1))
+        pending.remove(match.group(1))
+        if OPT.target.snapshot is not None:
+            # not served: nothing for the snapshot to fetch either
+            OPT.target.snapshot.loaded.add(match.group(1))
+    return OrderedDict()
+
+
+def rest_get_batch(resource_types):
+    """
+        run_kube_get_batch() over the REST client connection pool
+    """
+    writer = ResourceListWriter()
+    served = []
+    pods = []
+    try:
+        for resource in resource_types:
+            def add(item, resource=resource):
+                writer.add(resource, item)
+                if resource == "pods":
+                    pods.append(item)
+            if OPT.target.client.stream_list(resource, add) is None:
+                logger.debug("Resource %s does not exist; this is probably"
+                             " fine, an item which doesn't exist in v4/v5",
+                             resource)
+                if OPT.target.snapshot is not None:
+                    OPT.target.snapshot.loaded.add(resource)
+                continue
+            served.append(resource)
+    except (http.client.HTTPException, OSError, ValueError) as error:
+        logger.debug("REST client get failed: %s", error)
+        if not writer.counts:
+            writer.close()
+            return None
+    if pods:
+        set_pod_inventory(pods)
+    return writer.close(served)
+
+
+class JsonItemsReader():
+    """
+        Incremental reader of the "items" of a kubernetes List JSON
+        document: each item is decoded from a rolling buffer as soon as
+        it is complete, so memory holds one item rather than the list
+    """
+    def __init__(self, file_pointer):
+        # a pipe yields what is available rather than a full chunk, so
+        # a slow stream such as a watch is read as it arrives
+        self.read = (file_pointer.read1 if isinstance(file_pointer, io.BufferedReader)
+                     else file_pointer.read)
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+        self.size = 0
+
+    def _fill(self, size):
+        """
+            Reads until the unparsed buffer holds size characters or EOF
+        """
+        self.buffer = self.buffer[self.position:]
+        self.position = 0
+        while len(self.buffer) < size and not self.eof:
+            chunk = self.read(STREAM_CHUNK_SIZE)
+            self.eof = not chunk
+            self.size += len(chunk)
+            self.buffer += self.text.decode(chunk, final=self.eof)
+
+    def _peek(self):
+        """
+            Returns the next non blank character, '' at the end
+        """
+        while True:
+            while (self.position < len(self.buffer)
+                   and self.buffer[self.position] in " \t\r\n"):
+                self.position += 1
+            if self.position < len(self.buffer) or self.eof:
+                return self.buffer[self.position:self.position + 1]
+            self._fill(1)
+
+    def _expect(self, chars):
+        """
+            Consumes and returns the next character, one of chars
+        """
+        char = self._peek()
+        if not char or char not in chars:
+            raise ValueError("expected one of {} at offset {}, found {!r}".format(
+                chars, self.size - len(self.buffer) + self.position, char))
+        self.position += 1
+        return char
+
+    def _value(self):
+        """
+            Decodes the next JSON value, reading more input as needed;
+            the buffer doubles on each attempt, so parsing stays linear
+        """
+        self._peek()
+        size = len(self.buffer) - self.position
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except ValueError:
+                if self.eof:
+                    raise
+                value, end = None, None
+            # a number, true, false or null may continue in the next chunk
+            if end is not None and (self.eof or end < len(self.buffer)
+                                    or isinstance(value, (dict, list, str))):
+                self.position = end
+                return value
+            size = max(size * 2, STREAM_CHUNK_SIZE)
+            self._fill(size)
+
+    def values(self):
+        """
+            Yields the top level values of a stream of concatenated JSON
+            documents, such as kube cli watch output
+        """
+        while self._peek():
+            yield self._value()
+
+    def __iter__(self):
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            self._expect(":")
+            if key != "items":
+                self._value()
+            else:
+                self._expect("[")
+                if self._peek() == "]":
+                    self.position += 1
+                else:
+                    while True:
+                        yield self._value()
+                        if self._expect(",]") == "]":
+                            break
+            if self._expect(",}") == "}":
+                return
+
+
+class ResourceListWriter():
+    """
+        Streams items into a kube cli style List document per resource
+        type, {type}.yml, YAML when PyYAML is available, otherwise JSON
+        (a YAML subset), writing each item as it is added
+    """
+    def __init__(self):
+        self.files = OrderedDict()
+        self.counts = OrderedDict()
+
+    def add(self, resource, item):
+        """
+            Appends item to the List document of resource
+        """
+        if resource not in self.files:
+            self.files[resource] = open_output(f"{resource}.yml")
+            self.counts[resource] = 0
+        if OPT.target.snapshot is not None:
+            OPT.target.snapshot.add(resource, item)
+        first = self.counts[resource] == 0
+        if yaml is not None:
+            data = (("apiVersion: v1\nitems:\n" if first else "") +
+                    yaml.safe_dump([item], default_flow_style=False))
+        else:
+            data = (('{\n    "apiVersion": "v1",\n    "items": [\n' if first
+                     else ",\n") +
+                    "        " + json.dumps(item, indent=4).replace("\n", "\n        "))
+        self.files[resource].write(data.encode('utf-8'))
+        self.counts[resource] += 1
+
+    def close(self, resources=()):
+        """
+            Ends the List documents, writing empty ones for the resources
+            without items, returns an OrderedDict of resource -> items
+            resources are the types fetched completely, the snapshot
+            does not fetch them again
+        """
+        if OPT.target.snapshot is not None:
+            OPT.target.snapshot.loaded.update(resources)
+        for resource in resources:
+            if resource not in self.files:
+                self.files[resource] = open_output(f"{resource}.yml")
+                self.counts[resource] = 0
+        for resource, file_pointer in self.files.items():
+            empty = self.counts[resource] == 0
+            if yaml is not None:
+                data = (("apiVersion: v1\nitems: []\n" if empty else "") +
+                        "kind: List\nmetadata:\n  resourceVersion: ''\n")
+            else:
+                data = (('{\n    "apiVersion": "v1",\n    "items": [],\n' if empty
+                         else "\n    ],\n") +
+                        '    "kind": "List",\n    "metadata": {\n'
+                        '        "resourceVersion": ""\n    }\n}\n')
+            file_pointer.write(data.encode('utf-8'))
+            file_pointer.close()
+        self.files.clear()
+        return self.counts
 
 
 def get_kube_cli():
@@ -609,14 +4319,297 @@ def get_kube_cli():
     sys.exit()
 
 
+class KubeRestClient():
+    """
+        Minimal kubernetes API client for get, list and log calls
+        Reads the kubeconfig once and reuses keep-alive connections
+        from a pool instead of starting a kube cli process per call
+    """
+    def __init__(self, server, ssl_context=None, token=None, pool_size=8):
+        url = urllib.parse.urlsplit(server)
+        self.https = url.scheme == "https"
+        self.host = url.hostname
+        self.port = url.port or (443 if self.https else 80)
+        self.prefix = url.path.rstrip("/")
+        self.ssl_context = ssl_context
+        self.headers = {"Accept": "application/json",
+                        "User-Agent": "crunchy-support-dump/" + __version__}
+        if token:
+            self.headers["Authorization"] = "Bearer " + token
+        self.pool = queue.LifoQueue(maxsize=pool_size)
+        self.resources = None
+        self.discovery_lock = threading.Lock()
+
+    @classmethod
+    def from_kubeconfig(cls):
+        """
+            Builds a client from the current kube cli context
+            Returns None when the credentials are not supported, e.g.
+            exec or auth-provider plugins that only the kube cli can run
+        """
+        cmd = (OPT.kube_cli + " config view --minify --flatten -o json " +
+               get_context_argument())
+        return_code, out = run_shell_command(cmd, merge_stderr=False)
+        if return_code:
+            return None
+        try:
+            config = json.loads(out.decode('utf-8'))
+            cluster = config["clusters"][0]["cluster"]
+            user = (config.get("users") or [{}])[0].get("user") or {}
+        except (ValueError, KeyError, IndexError) as error:
+            logger.debug("Could not read kubeconfig: %s", error)
+            return None
+
+        if "exec" in user or "auth-provider" in user or "username" in user:
+            logger.debug("Unsupported kubeconfig credentials for REST client")
+            return None
+
+        ssl_context = None
+        if cluster["server"].startswith("https"):
+            ssl_context = ssl.create_default_context()
+            if cluster.get("insecure-skip-tls-verify"):
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+            elif "certificate-authority-data" in cluster:
+                ssl_context.load_verify_locations(cadata=base64.b64decode(
+                    cluster["certificate-authority-data"]).decode('ascii'))
+            if "client-certificate-data" in user:
+                load_client_certificate(
+                    ssl_context,
+                    base64.b64decode(user["client-certificate-data"]),
+                    base64.b64decode(user["client-key-data"]))
+
+        token = user.get("token")
+        if not token and user.get("tokenFile"):
+            with open(user["tokenFile"], encoding="utf-8") as file_pointer:
+                token = file_pointer.read().strip()
+        return cls(cluster["server"], ssl_context, token,
+                   pool_size=max(OPT.jobs, 1) * 2)
+
+    def _connection(self, fresh=False):
+        try:
+            if not fresh:
+                return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        if self.https:
+            return http.client.HTTPSConnection(
+                self.host, self.port, context=self.ssl_context,
+                timeout=OPT.call_timeout)
+        return http.client.HTTPConnection(self.host, self.port,
+                                          timeout=OPT.call_timeout)
+
+    def _release(self, connection):
+        try:
+            self.pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def request(self, path, query=None):
+        """
+            Sends a GET, returns the response with its body unread
+            The caller must read it fully and call release(response)
+        """
+        url = self.prefix + path
+        if query:
+            url += "?" + urllib.parse.urlencode(query)
+        started = time.monotonic()
+        for attempt in (1, 2):
+            connection = self._connection(fresh=attempt == 2)
+            try:
+                connection.request("GET", url, headers=self.headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                # a pooled keep-alive connection may have been closed
+                # by the server, retry once on a new one
+                if attempt == 2:
+                    record_operation("GET " + url, started, -1,
+                                     retries=1, kind="rest")
+                    raise
+                continue
+            response.connection = connection
+            response.url = url
+            response.started = started
+            response.retries = attempt - 1
+            return response
+        return None
+
+    def release(self, response, size=0):
+        """
+            Returns the connection of a fully read response to the pool
+        """
+        record_operation("GET " + response.url, response.started,
+                         0 if response.status == 200 else response.status,
+                         size, retries=response.retries, kind="rest",
+                         transfer=urllib.parse.urlsplit(response.url).path.endswith("/log"))
+        if response.will_close or not response.isclosed():
+            response.connection.close()
+        else:
+            self._release(response.connection)
+
+    def get_json(self, path, query=None):
+        """
+            Returns a tuple of the HTTP status, decoded JSON body
+            Overload and server errors are retried with backoff
+        """
+        for attempt in range(CALL_RETRIES + 1):
+            with OPT.limiter:
+                response = self.request(path, query)
+                body = response.read()
+                self.release(response, len(body))
+            if (response.status not in RETRY_STATUSES or attempt == CALL_RETRIES
+                    or OPT.watchdog.expired()):
+                break
+            logger.debug("Retrying: GET %s: HTTP %s", response.url,
+                         response.status)
+            backoff(attempt, response.getheader("Retry-After"))
+        try:
+            return response.status, json.loads(body.decode('utf-8'))
+        except ValueError:
+            return response.status, {"message": body.decode('utf-8', 'replace')}
+
+    def list(self, resource_type):
+        """
+            Returns the items of resource_type in the namespace, each
+            with kind and apiVersion set, or None if it is not served
+        """
+        items = []
+        if self.stream_list(resource_type, items.append) is None:
+            return None
+        return items
+
+    def stream_list(self, resource_type, add):
+        """
+            Calls add() with each item of resource_type in the namespace
+            as it is decoded from the response, with kind and apiVersion
+            set, returns the number of items or None if it is not served
+        """
+        resource = self.find_resource(resource_type)
+        if resource is None:
+            return None
+        path = self.resource_path(resource)
+        for attempt in range(CALL_RETRIES + 1):
+            with OPT.limiter:
+                response = self.request(path)
+                if response.status != 200:
+                    body = response.read()
+                    self.release(response, len(body))
+                else:
+                    reader = JsonItemsReader(response)
+                    count = 0
+                    try:
+                        for item in reader:
+                            item.setdefault("kind", resource["kind"])
+                            item.setdefault("apiVersion", resource["groupVersion"])
+                            add(item)
+                            count += 1
+                    finally:
+                        self.release(response, reader.size)
+                    return count
+            if (response.status not in RETRY_STATUSES or attempt == CALL_RETRIES
+                    or OPT.watchdog.expired()):
+                break
+            logger.debug("Retrying: GET %s: HTTP %s", response.url,
+                         response.status)
+            backoff(attempt, response.getheader("Retry-After"))
+        logger.debug("Failed to list %s: HTTP %s: %s", resource_type,
+                     response.status, body.decode('utf-8', 'replace').rstrip())
+        return None
+
+    def pod_log(self, pod, container, query=None):
+        """
+            Returns the streaming response of a container log
+        """
+        query = dict(query or {}, container=container)
+        return self.request(self.namespace_path(
+            "api/v1", "pods/{}/log".format(urllib.parse.quote(pod))), query)
+
+    def resource_path(self, resource):
+        """
+            Returns the URL path listing a discovered resource
+        """
+        group_path = ("api/v1" if resource["groupVersion"] == "v1"
+                      else "apis/" + resource["groupVersion"])
+        if not resource["namespaced"]:
+            return "/{}/{}".format(group_path, resource["name"])
+        return self.namespace_path(group_path, resource["name"])
+
+    @staticmethod
+    def namespace_path(group_path, name):
+        """
+            Returns the URL path of name in the current namespace
+        """
+        if not OPT.target.namespace:
+            return "/{}/{}".format(group_path, name)
+        return "/{}/namespaces/{}/{}".format(
+            group_path, urllib.parse.quote(OPT.target.namespace), name)
+
+    def find_resource(self, resource_type):
+        """
+            Resolves a kube cli resource name (plural, singular, short
+            name or kind) through API discovery, None if not served
+        """
+        with self.discovery_lock:
+            if self.resources is None:
+                self.resources = self.discover()
+        wanted = resource_type.lower()
+        for resource in self.resources:
+            if wanted in (resource["name"], resource.get("singularName"),
+                          resource["kind"].lower()) \
+                    or wanted in resource.get("shortNames", []):
+                return resource
+        return None
+
+    def discover(self):
+        """
+            Returns the resources of the core and preferred group versions
+        """
+        group_versions = ["v1"]
+        status, body = self.get_json("/apis")
+        if status == 200:
+            group_versions += [group["preferredVersion"]["groupVersion"]
+                               for group in body.get("groups", [])]
+        resources = []
+        for group_version in group_versions:
+            path = "/api/v1" if group_version == "v1" else "/apis/" + group_version
+            status, body = self.get_json(path)
+            if status != 200:
+                continue
+            for resource in body.get("resources", []):
+                if "/" in resource["name"]:
+                    continue
+                resource["groupVersion"] = group_version
+                resources.append(resource)
+        return resources
+
+
+def load_client_certificate(ssl_context, cert, key):
+    """
+        Loads an in-memory client certificate and key into ssl_context
+        The ssl module only reads them from files, so they are written
+        to a private temporary directory that is removed right after
+    """
+    cert_dir = tempfile.mkdtemp()
+    try:
+        cert_file = posixpath.join(cert_dir, "client.crt")
+        key_file = posixpath.join(cert_dir, "client.key")
+        for path, data in ((cert_file, cert), (key_file, key)):
+            with open(os.open(path, os.O_WRONLY | os.O_CREAT, 0o600), "wb") as file_pointer:
+                file_pointer.write(data)
+        ssl_context.load_cert_chain(cert_file, key_file)
+    finally:
+        shutil.rmtree(cert_dir, ignore_errors=True)
+
+
 def check_kube_access():
     """
         Check if the user has access to kube cluster
     """
     if OPT.kube_cli == "oc":
-        cmd = "oc whoami"
+        cmd = "oc whoami " + get_context_argument()
     else:
-        cmd = "kubectl cluster-info"
+        cmd = "kubectl cluster-info " + get_context_argument()
 
     return_code, _ = run_shell_command(cmd)
     return return_code
@@ -629,10 +4622,12 @@ if __name__ == "__main__":
                                      'collector', add_help=True)
 
     namedArgs = parser.add_argument_group('Named arguments')
-    namedArgs.add_argument('-n', '--namespace', required=True,
+    namedArgs.add_argument('-n', '--namespace', required=False,
                            action="store", type=str,
-                           help='kubernetes namespace to dump')
-    namedArgs.add_argument('-o', '--dest_dir', required=True,
+                           help='kubernetes namespace to dump, or a comma'
+                           ' separated list of namespaces to dump'
+                           ' concurrently, each into its own directory')
+    namedArgs.add_argument('-o', '--dest_dir', required=False,
                            action="store", type=str,
                            help='path to save dump tarball')
     namedArgs.add_argument('-l', '--pg_logs_count', required=False,
@@ -641,16 +4636,262 @@ if __name__ == "__main__":
     namedArgs.add_argument('-d', '--delete_dir', required=False,
                            action="store_true",
                            help='delete the temporary working directory')
+    namedArgs.add_argument('-j', '--jobs', required=False,
+                           action="store", type=int, default=DEFAULT_JOBS,
+                           help='number of concurrent log collection workers'
+                           ' and of kube cli or API calls in flight, across'
+                           ' all namespaces (default: %(default)s)')
+    namedArgs.add_argument('--adaptive', required=False,
+                           action="store_true",
+                           help='adjust the number of calls in flight, between'
+                           ' --min-jobs and -j, to the latency and errors of'
+                           ' the API server')
+    namedArgs.add_argument('--min-jobs', required=False,
+                           action="store", type=int, default=DEFAULT_MIN_JOBS,
+                           help='with --adaptive, lowest number of calls in'
+                           ' flight (default: %(default)s)')
+    namedArgs.add_argument('--sequential', required=False,
+                           action="store_true",
+                           help='collect logs one container at a time to'
+                           ' reduce load on the API server (same as -j 1)')
+    namedArgs.add_argument('--exec-timeout', required=False,
+                           action="store", type=int,
+                           default=DEFAULT_EXEC_TIMEOUT,
+                           help='seconds each pod detail command may run'
+                           ' (default: %(default)s)')
+    namedArgs.add_argument('--call-timeout', required=False,
+                           action="store", type=int,
+                           default=DEFAULT_CALL_TIMEOUT,
+                           help='seconds each kube cli or API request may run'
+                           ' before it is killed; log and file transfers are'
+                           ' only bounded by --deadline (default: %(default)s)')
+    namedArgs.add_argument('--deadline', required=False,
+                           action="store", type=int,
+                           help='seconds the whole collection may run; the'
+                           ' calls still running are then killed and what'
+                           ' was collected is archived')
+    namedArgs.add_argument('--scan', required=False,
+                           action="store_true",
+                           help='index ERROR/FATAL/PANIC, OOM, failover and'
+                           ' leader change lines of the collected logs'
+                           ' into log_index.tsv while they are written')
+    namedArgs.add_argument('--scan-patterns', required=False,
+                           action="store", type=str,
+                           help='JSON list of {name, severity, regex}'
+                           ' patterns to index (implies --scan)')
+    namedArgs.add_argument('--redact', required=False,
+                           action="store_true",
+                           help='mask passwords, tokens and e-mail addresses'
+                           ' in the collected logs while they are written;'
+                           ' counts go to redaction_summary.json')
+    namedArgs.add_argument('--redact-rules', required=False,
+                           action="store", type=str,
+                           help='JSON list of {name, regex, triggers}'
+                           ' redaction rules (implies --redact); only the'
+                           ' first group of a regex with groups is masked,'
+                           ' and only lines containing a trigger string'
+                           ' are matched when all rules have triggers')
+    namedArgs.add_argument('--watch', required=False,
+                           action="store_true",
+                           help='record the namespace events and pod state'
+                           ' changes during the whole run from watch streams'
+                           ' into watch_timeline.jsonl')
+    namedArgs.add_argument('--snapshot', required=False,
+                           action="store_true",
+                           help='also load the pods, containers, PVCs,'
+                           ' configmaps, events and Postgres resources into'
+                           ' an indexed SQLite database, resources.sqlite')
+    namedArgs.add_argument('--profile', required=False,
+                           action="store", type=int, nargs="?", const=10,
+                           default=0,
+                           help='print the N slowest collectors and'
+                           ' operations at the end (default N: 10)')
+    namedArgs.add_argument('--max-size', required=False,
+                           action="store", type=parse_size, nargs="?",
+                           const=MAX_ARCHIVE_EMAIL_SIZE,
+                           help='size budget of the archive, e.g. 500M;'
+                           ' the lowest priority logs are tailed or'
+                           ' skipped to fit (default when given without'
+                           ' a value: the email size limit)')
+    namedArgs.add_argument('--longest-first', required=False,
+                           action="store_true",
+                           help='estimate the log sizes up front and collect'
+                           ' the largest logs first')
+    namedArgs.add_argument('--plan', required=False,
+                           action="store_true",
+                           help='print the estimated bytes and time of each'
+                           ' log and of the run, without collecting anything')
+    namedArgs.add_argument('--stream', required=False,
+                           action="store_true",
+                           help='write collected files straight into the'
+                           ' archive instead of staging them on disk')
+    namedArgs.add_argument('--keep-files', required=False,
+                           action="store_true",
+                           help='with --stream or --store, also keep an'
+                           ' on-disk copy of the collected files')
+    namedArgs.add_argument('--compress', required=False,
+                           action="store", default="auto",
+                           choices=["auto"] + list(COMPRESSORS),
+                           help='archive compression; auto uses pigz when'
+                           ' available (default: %(default)s)')
+    namedArgs.add_argument('--seekable', required=False,
+                           action="store_true",
+                           help='gzip each archive member on its own and'
+                           ' index them, so that --read-archive can extract'
+                           ' one without decompressing the whole archive;'
+                           ' still a valid .tar.gz')
+    namedArgs.add_argument('--read-archive', required=False,
+                           action="store", type=str, metavar="ARCHIVE",
+                           help='list the members of a --seekable archive,'
+                           ' or extract --member into dest_dir, and exit')
+    namedArgs.add_argument('--member', required=False,
+                           action="store", type=str,
+                           help='with --read-archive, path of the member to'
+                           ' extract, with or without the dump directory')
+    namedArgs.add_argument('--rest-client', required=False,
+                           action="store_true",
+                           help='use the in-process kubernetes API client,'
+                           ' with pooled connections, for get and log calls')
+    namedArgs.add_argument('--pg-sample', required=False,
+                           action="store", type=int, default=0,
+                           metavar="SECONDS",
+                           help='sample pg_stat_activity, locks, replication'
+                           ' lag and the cumulative statistics views of each'
+                           ' database pod for SECONDS, over one psql session'
+                           ' per pod, into pg_samples/')
+    namedArgs.add_argument('--pg-sample-interval', required=False,
+                           action="store", type=float,
+                           default=DEFAULT_PG_SAMPLE_INTERVAL,
+                           help='seconds between two --pg-sample samples'
+                           ' (default: %(default)s)')
+    namedArgs.add_argument('--incremental', required=False,
+                           action="store_true",
+                           help='only collect log lines and pg log files'
+                           ' that are new since the previous incremental'
+                           ' run into the same dest_dir')
+    namedArgs.add_argument('--since', required=False,
+                           action="store", type=parse_time, metavar="TIME",
+                           help='only collect the pg log files and container'
+                           ' log lines from this UTC time, e.g.'
+                           ' 2024-05-01T10:00, or this long ago, e.g. 2h;'
+                           ' ignores --pg_logs_count')
+    namedArgs.add_argument('--until', required=False,
+                           action="store", type=parse_time, metavar="TIME",
+                           help='only collect the pg log files and container'
+                           ' log lines up to this time')
+    namedArgs.add_argument('--resume', required=False,
+                           action="store", type=str, nargs="?", const="",
+                           metavar="DUMP_DIR",
+                           help='continue an interrupted run in its dump'
+                           ' directory (default: the latest one of dest_dir'
+                           ' without an archive), skipping the items it'
+                           ' completed; not with --stream')
+    namedArgs.add_argument('--context', required=False,
+                           action="store", type=str,
+                           help='kube context, or comma separated list of'
+                           ' contexts, to collect the namespaces from'
+                           ' (default: the current context)')
+    namedArgs.add_argument('--store', required=False,
+                           action="store", type=str,
+                           help='save the dump into this content addressed'
+                           ' store directory, shared by repeated dumps,'
+                           ' instead of a tar archive; the staged files are'
+                           ' removed once stored unless --keep-files')
+    namedArgs.add_argument('--export', required=False,
+                           action="store", type=str, metavar="DUMP",
+                           help='with --store, rebuild the tar archive of'
+                           ' the stored dump DUMP in dest_dir and exit')
     namedArgs.add_argument('-c', '--client_program', required=False,
                            type=str, action="store",
                            help='client program.  valid options:  '
                            + str(allowed_cli))
 
     results = parser.parse_args()
-    OPT.namespace = results.namespace
+    if results.read_archive:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        sys.exit(read_archive(results.read_archive, results.member,
+                              results.dest_dir))
+    if not results.dest_dir:
+        parser.error("the following arguments are required: -o/--dest_dir")
+    if results.export:
+        if not results.store:
+            parser.error("--export requires --store")
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+        OPT.compression = choose_compression(results.compress)
+        sys.exit(export_stored_dump(results.store, results.export,
+                                    results.dest_dir))
+    if not results.namespace:
+        parser.error("the following arguments are required: -n/--namespace")
+    if results.incremental and (results.since is not None
+                                or results.until is not None):
+        parser.error("--incremental collects what is new since the previous"
+                     " run, it cannot be used with --since or --until")
+    if (results.since is not None and results.until is not None
+            and results.since > results.until):
+        parser.error("--since is after --until")
+    if results.resume is not None and results.stream:
+        parser.error("--resume needs the files of the interrupted run on"
+                     " disk, it cannot be used with --stream")
     OPT.dest_dir = results.dest_dir
     OPT.pg_logs_count = results.pg_logs_count
     OPT.delete_dir = results.delete_dir
+    OPT.jobs = 1 if results.sequential else max(results.jobs, 1)
+    if results.adaptive:
+        OPT.limiter = AdaptiveLimiter(min(max(results.min_jobs, 1), OPT.jobs),
+                                      OPT.jobs)
+    else:
+        OPT.limiter = threading.BoundedSemaphore(OPT.jobs)
+    OPT.exec_timeout = results.exec_timeout
+    OPT.call_timeout = results.call_timeout
+    OPT.max_size = results.max_size
+    OPT.since = results.since
+    OPT.until = results.until
+    OPT.longest_first = results.longest_first
+    OPT.profile = results.profile
+    OPT.stream_archive = results.stream
+    OPT.keep_files = results.keep_files
+    OPT.store = results.store
+    OPT.seekable = results.seekable
+    if OPT.store and OPT.seekable:
+        parser.error("--seekable archives cannot be written to a --store")
+    OPT.watch = results.watch
+    OPT.snapshot = results.snapshot
+    if OPT.snapshot and sqlite3 is None:
+        parser.error("--snapshot requires the Python sqlite3 module")
+    OPT.pg_sample = max(results.pg_sample, 0)
+    OPT.pg_sample_interval = max(results.pg_sample_interval, 0.1)
+
+    namespaces = [name for name in results.namespace.split(",") if name]
+    contexts = ([name for name in results.context.split(",") if name]
+                if results.context else None) or [None]
+    if len(namespaces) * len(contexts) == 1:
+        OPT.root.namespace = namespaces[0]
+        OPT.root.context = contexts[0]
+    else:
+        # one directory per namespace, under one per context if several
+        OPT.targets = [
+            Target(namespace, context, namespace if len(contexts) == 1 else
+                   posixpath.join(re.sub(r"[^\w.-]", "_", context), namespace))
+            for context in contexts for namespace in namespaces]
+
+    if results.incremental:
+        for target in OPT.targets:
+            key = target.namespace
+            if target.context:
+                key = re.sub(r"[^\w.-]", "_", target.context) + "." + key
+            target.state = CollectionState(posixpath.join(
+                OPT.dest_dir, ".crunchy_gather_state.{}.json".format(key)))
+        if any(target.state.previous_run for target in OPT.targets):
+            OPT.dir_name += "_delta"
+
+    if results.resume is not None:
+        resume_dir = (posixpath.basename(results.resume.rstrip("/"))
+                      or find_resume_dir(OPT.dest_dir))
+        if not resume_dir or not os.path.isdir(
+                posixpath.join(OPT.dest_dir, resume_dir)):
+            parser.error("no interrupted support dump to resume in {}".format(
+                posixpath.join(OPT.dest_dir, resume_dir or "")))
+        OPT.dir_name = resume_dir
 
     # Initialize the target for logging and file collection
     if OPT.dest_dir:
@@ -659,22 +4900,27 @@ if __name__ == "__main__":
         OPT.output_dir = (posixpath.join(posixpath.abspath(__file__),
                                          OPT.dir_name))
 
-    try:
-        os.makedirs(OPT.output_dir)
-    except OSError as error:
-        print(error)
-
-    # Log everything to the file, only info+ to stdout
-    logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(f"{OPT.output_dir}/dumptool.log"),
-                ]
-            )
+    if results.plan:
+        # a dry run writes nothing
+        logging.basicConfig(level=logging.DEBUG, handlers=[logging.NullHandler()])
+    else:
+        try:
+            os.makedirs(OPT.output_dir)
+        except OSError as error:
+            print(error)
+
+        # Log everything to the file, only info+ to stdout
+        logging.basicConfig(
+                level=logging.DEBUG,
+                format='%(asctime)s - %(levelname)s - %(message)s',
+                handlers=[
+                    logging.FileHandler(f"{OPT.output_dir}/dumptool.log"),
+                    ]
+                )
     console = logging.StreamHandler()
     console.setLevel(logging.INFO)
     logging.getLogger('').addHandler(console)
+    logger.addFilter(TargetLogFilter())
 
     logger.info("┌────────────────────────────────────────────────────────────────────────────-")
     logger.info("│ Crunchy Support Dump Collector")
@@ -694,8 +4940,57 @@ if __name__ == "__main__":
     else:
         OPT.kube_cli = get_kube_cli()
 
-    if check_kube_access() != 0:
-        logger.error("Not connected to kubernetes cluster")
-        sys.exit()
+    # first target of each context, to check access and read kubeconfig
+    context_targets = OrderedDict()
+    for target in OPT.targets:
+        context_targets.setdefault(target.context, target)
+    for context, target in context_targets.items():
+        if run_in_target(target, check_kube_access) != 0:
+            logger.error("Not connected to kubernetes cluster%s",
+                         " with context " + context if context else "")
+            sys.exit()
+
+    OPT.compression = choose_compression(results.compress)
+    if results.scan_patterns:
+        try:
+            OPT.scanner = LogScanner.from_file(results.scan_patterns)
+        except (OSError, ValueError, KeyError, re.error) as error:
+            logger.error("Invalid scan patterns file %s: %s",
+                         results.scan_patterns, error)
+            sys.exit()
+    elif results.scan:
+        OPT.scanner = LogScanner(SCAN_PATTERNS)
+    if results.redact_rules:
+        try:
+            OPT.redactor = Redactor.from_file(results.redact_rules)
+        except (OSError, ValueError, KeyError, re.error) as error:
+            logger.error("Invalid redaction rules file %s: %s",
+                         results.redact_rules, error)
+            sys.exit()
+    elif results.redact:
+        OPT.redactor = Redactor(REDACT_RULES)
+    if results.rest_client:
+        for context, target in context_targets.items():
+            client = run_in_target(target, KubeRestClient.from_kubeconfig)
+            if client is None:
+                logger.warning("Kubeconfig credentials%s not supported by"
+                               " the REST client, using %s",
+                               " of context " + context if context else "",
+                               OPT.kube_cli)
+            for each in OPT.targets:
+                if each.context == context:
+                    each.client = client
 
-    run()
+    if results.deadline:
+        OPT.watchdog.deadline = time.monotonic() + results.deadline
+    if results.plan:
+        try:
+            print_plan()
+        finally:
+            OPT.watchdog.cancel()
+        sys.exit(0)
+    try:
+        run()
+    finally:
+        # no kube cli call may outlive an interrupted run
+        OPT.watchdog.cancel()